@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+# Copyright 2015-2016 Cisco Systems, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+""" Batch longest prefix match benchmark
+
+Longest match of many IPv4 addresses in an Adj-RIB-In, one RIB lookup
+for each address against the interval index, and the cost of refreshing
+the index after some route changes.
+
+    $ python tools/benchmark/batch_lpm.py --prefixes 800000 --addresses 500000
+"""
+
+from __future__ import print_function
+import argparse
+import random
+import time
+
+from yabgp.core.lpm import LPMIndex
+from yabgp.core.rib import new_adj_rib
+from yabgp.core.rib import RIBSnapshot
+
+
+def random_prefix(rand):
+    # about the prefix length distribution of an internet table
+    length = rand.choice([16, 19, 20, 21, 22, 22, 23, 23, 24, 24, 24, 24, 24, 24, 24, 24])
+    ip = rand.getrandbits(32) & ~((1 << (32 - length)) - 1)
+    return '%s.%s.%s.%s/%s' % (ip >> 24, ip >> 16 & 0xff, ip >> 8 & 0xff, ip & 0xff, length)
+
+
+def snapshot(rib):
+    return RIBSnapshot.take(rib.attr_table, {'ipv4': rib}, {}).adj_rib_in['ipv4']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='batch longest prefix match benchmark')
+    parser.add_argument('--prefixes', type=int, default=800000, help='number of prefixes in the RIB')
+    parser.add_argument('--addresses', type=int, default=500000, help='number of addresses matched')
+    parser.add_argument('--changes', type=int, default=1000, help='number of route changes before a refresh')
+    args = parser.parse_args()
+
+    rand = random.Random(0)
+    rib = new_adj_rib('ipv4')
+    for i in range(args.prefixes):
+        rib.update(random_prefix(rand), {1: 0, 5: i % 10})
+    addresses = ['%s.%s.%s.%s' % tuple(rand.getrandbits(8) for _ in range(4)) for _ in range(args.addresses)]
+    snap_rib = snapshot(rib)
+
+    start = time.time()
+    rib_matches = [snap_rib.lookup(address).get('prefix') for address in addresses]
+    elapsed = time.time() - start
+    print('%-32s %8.2f s %8.2f us/address' % ('RIB lookup', elapsed, elapsed * 1e6 / len(addresses)))
+
+    index = LPMIndex('ipv4')
+    start = time.time()
+    index.refresh(snap_rib)
+    print('%-32s %8.2f s' % ('index build', time.time() - start))
+    start = time.time()
+    keys = index.lookup(addresses)
+    elapsed = time.time() - start
+    print('%-32s %8.2f s %8.2f us/address' % ('index lookup', elapsed, elapsed * 1e6 / len(addresses)))
+    assert rib_matches == [rib.unpack(key) if key is not None else None for key in keys]
+
+    for i in range(args.changes):
+        prefix = random_prefix(rand)
+        if i % 2:
+            rib.withdraw(prefix)
+        else:
+            rib.update(prefix, {1: 0})
+    snap_rib = snapshot(rib)
+    start = time.time()
+    index.refresh(snap_rib)
+    print('%-32s %8.2f s' % ('index refresh %s changes' % args.changes, time.time() - start))
+
+
+if __name__ == '__main__':
+    main()
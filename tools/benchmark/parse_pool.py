@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+# Copyright 2015-2016 Cisco Systems, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+""" Update parse pool benchmark
+
+Time to parse many UPDATE messages in the worker processes when every
+message is one task of the pool and when the messages are sent in
+batches like the protocol does, with the parsing in the main process
+as the reference.
+
+    $ python tools/benchmark/parse_pool.py --messages 50000 --workers 2
+"""
+
+from __future__ import print_function
+import argparse
+import time
+
+from yabgp.core.parse_pool import parse_updates
+from yabgp.core.parse_pool import UpdateParsePool
+from yabgp.message.update import Update
+
+ATTR = {1: 0, 2: [[2, [65000, 65001, 65002]]], 3: '10.0.0.1', 5: 100, 8: ['65000:100']}
+
+
+def messages(count):
+    msgs = []
+    for i in range(count):
+        prefix = '%s.%s.%s.0/24' % (10 + (i >> 16), (i >> 8) & 0xff, i & 0xff)
+        msgs.append(Update.construct({'attr': ATTR, 'nlri': [prefix], 'withdraw': []})[19:])
+    return msgs
+
+
+def run(pool, msgs, batch_size):
+    futures = []
+    for i in range(0, len(msgs), batch_size):
+        futures.append(pool.submit(msgs[i:i + batch_size]))
+    return sum(len(future.result()) for future in futures)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='update parse pool benchmark')
+    parser.add_argument('--messages', type=int, default=50000, help='number of update messages')
+    parser.add_argument('--workers', type=int, default=2, help='number of worker processes')
+    parser.add_argument('--batch', type=int, default=500, help='number of messages of a batch')
+    args = parser.parse_args()
+
+    msgs = messages(args.messages)
+    start = time.time()
+    parse_updates(msgs, False, {})
+    elapsed = time.time() - start
+    print('%-24s %8.2f s %8.0f msg/s' % ('main process', elapsed, len(msgs) / elapsed))
+
+    pool = UpdateParsePool(args.workers, args.batch * args.workers)
+    # start the workers before timing
+    run(pool, msgs[:args.workers], 1)
+    for name, batch_size in (('one task per message', 1), ('batch of %s' % args.batch, args.batch)):
+        start = time.time()
+        assert run(pool, msgs, batch_size) == len(msgs)
+        elapsed = time.time() - start
+        print('%-24s %8.2f s %8.0f msg/s' % (name, elapsed, len(msgs) / elapsed))
+    pool.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+# Copyright 2015-2016 Cisco Systems, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+""" Adj-RIB memory benchmark
+
+Load a synthetic IPv4 and IPv6 table into the Adj-RIB and print the
+memory used per route, compared with a dict keyed by prefix strings.
+
+    $ python tools/benchmark/rib_memory.py --ipv4 1000000 --ipv6 300000
+"""
+
+from __future__ import print_function
+import argparse
+import gc
+import time
+import tracemalloc
+
+from yabgp.core.rib import AttrTable
+from yabgp.core.rib import new_adj_rib
+
+
+def ipv4_prefixes(count):
+    for i in range(count):
+        # /24 prefixes from 1.0.0.0
+        yield '%d.%d.%d.0/24' % (1 + (i >> 16), (i >> 8) & 0xff, i & 0xff)
+
+
+def ipv6_prefixes(count):
+    for i in range(count):
+        # /48 prefixes from 2001::
+        yield '2001:%x:%x::/48' % (i >> 16, i & 0xffff)
+
+
+def attr_sets(count):
+    return [
+        {
+            1: 0,
+            2: [[2, [65000, 3356, 64512 + i % 1000]]],
+            3: '10.0.0.%d' % (i % 250 + 1),
+            5: 100,
+            8: ['65000:%d' % i]
+        } for i in range(count)
+    ]
+
+
+def measure(name, load):
+    gc.collect()
+    tracemalloc.start()
+    start = time.time()
+    rib, count = load()
+    elapsed = time.time() - start
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print('%-24s %9d routes %8.1f MB %6.1f bytes/route %6.2f s' % (
+        name, count, size / 1048576.0, float(size) / count, elapsed))
+    return rib
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Adj-RIB memory benchmark')
+    parser.add_argument('--ipv4', type=int, default=1000000, help='number of IPv4 prefixes')
+    parser.add_argument('--ipv6', type=int, default=300000, help='number of IPv6 prefixes')
+    parser.add_argument('--attrs', type=int, default=5000, help='number of distinct attribute sets')
+    parser.add_argument('--per-update', type=int, default=10, help='number of prefixes in one update message')
+    args = parser.parse_args()
+
+    for afi_safi, count, prefixes in (('ipv4', args.ipv4, ipv4_prefixes), ('ipv6', args.ipv6, ipv6_prefixes)):
+        if not count:
+            continue
+        attrs = attr_sets(args.attrs)
+
+        def updates():
+            # every update message has its own decoded attribute dict
+            attr = None
+            for i, prefix in enumerate(prefixes(count)):
+                if i % args.per_update == 0:
+                    attr = dict(attrs[i // args.per_update % len(attrs)])
+                yield prefix, attr
+
+        def load_dict():
+            rib = {}
+            for prefix, attr in updates():
+                rib[prefix] = attr
+            return rib, count
+
+        def load_rib():
+            rib = new_adj_rib(afi_safi, AttrTable())
+            for prefix, attr in updates():
+                rib.update(prefix, attr)
+            return rib, count
+
+        measure('%s dict' % afi_safi, load_dict)
+        measure('%s adj-rib' % afi_safi, load_rib)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+# Copyright 2015-2016 Cisco Systems, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+""" Route version tracking benchmark
+
+Per-NLRI cost of tracking MPLS VPN and flowspec routes in the send
+version dicts, the string key and deepcopy way against canonical NLRI
+keys and attribute fingerprints.
+
+    $ python tools/benchmark/route_version.py --nlri 200 --updates 20
+"""
+
+from __future__ import print_function
+import argparse
+import copy
+import time
+
+from yabgp.common.nlri import nlri_key
+from yabgp.core.rib import attr_fingerprint
+
+
+def string_key(prefix):
+    key = "{"
+    for k in sorted(prefix.keys()):
+        key += '"' + k + '"'
+        key += ':'
+        key += '"' + str(prefix[k]) + '"'
+        key += ','
+    key = key[:-1]
+    key += "}"
+    return key
+
+
+def track_string_deepcopy(store, attr):
+    changed = 0
+    for prefix in attr[14]['nlri']:
+        value = copy.deepcopy(attr)
+        del value[14]['nlri']
+        key = string_key(prefix)
+        if key not in store or value != store[key]:
+            changed += 1
+            store[key] = value
+    return changed
+
+
+def track_fingerprint(store, attr):
+    changed = 0
+    fingerprint = attr_fingerprint(attr)
+    for prefix in attr[14]['nlri']:
+        key = nlri_key(prefix)
+        if store.get(key) != fingerprint:
+            changed += 1
+            store[key] = fingerprint
+    return changed
+
+
+def mpls_vpn_update(count, local_pref):
+    return {
+        1: 0,
+        2: [[2, [65000, 65001]]],
+        5: local_pref,
+        16: ['route-target:100:100', 'route-target:100:200'],
+        14: {
+            'afi_safi': [1, 128],
+            'nexthop': {'rd': '0:0', 'str': '10.0.0.1'},
+            'nlri': [
+                {'label': [1000 + i], 'rd': '100:100', 'prefix': '10.%d.%d.0/24' % (i >> 8 & 0xff, i & 0xff)}
+                for i in range(count)
+            ]
+        }
+    }
+
+
+def flowspec_update(count, local_pref):
+    return {
+        1: 0,
+        5: local_pref,
+        16: ['traffic-rate:0:0'],
+        14: {
+            'afi_safi': [1, 133],
+            'nexthop': '',
+            'nlri': [
+                {'1': '10.%d.%d.0/24' % (i >> 8 & 0xff, i & 0xff), '2': '20.0.0.0/24', '5': '=80'}
+                for i in range(count)
+            ]
+        }
+    }
+
+
+def run(name, track, updates):
+    store = {}
+    total = 0
+    start = time.time()
+    for attr in updates:
+        track(store, attr)
+        total += len(attr[14]['nlri'])
+    elapsed = time.time() - start
+    print('%-32s %8d NLRI %8.2f us/NLRI' % (name, total, elapsed * 1e6 / total))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='route version tracking benchmark')
+    parser.add_argument('--nlri', type=int, default=200, help='number of NLRI in one update')
+    parser.add_argument('--updates', type=int, default=20, help='number of updates')
+    args = parser.parse_args()
+
+    for family, build in (('mpls_vpn', mpls_vpn_update), ('flowspec', flowspec_update)):
+        # every other update changes the attributes of the same routes
+        updates = [build(args.nlri, 100 + i % 2) for i in range(args.updates)]
+        run('%s string key + deepcopy' % family, track_string_deepcopy, updates)
+        run('%s nlri key + fingerprint' % family, track_fingerprint, updates)
+
+
+if __name__ == '__main__':
+    main()
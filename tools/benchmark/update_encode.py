@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+# Copyright 2015-2016 Cisco Systems, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+""" Update encoding benchmark
+
+Time to encode the UPDATE messages of a large batch of IPv4 and IPv6
+prefixes sharing one attribute set, with the bytes concatenation and
+netaddr way the encoder replaced, the bytearray encoder, and the encoder
+with the encoded attribute cache.
+
+    $ python tools/benchmark/update_encode.py --prefixes 10000 --rounds 10
+"""
+
+from __future__ import print_function
+import argparse
+import struct
+import time
+
+import netaddr
+
+from yabgp.common.cache import LRUCache
+from yabgp.message.attribute.mpreachnlri import MpReachNLRI
+from yabgp.message.update import Update
+
+ATTR = {1: 0, 2: [[2, [65000, 65001, 65002]]], 5: 100, 8: ['65000:100'], 16: [[2, '100:100']]}
+
+
+def legacy_prefix_v4(prefix_list):
+    nlri_raw_hex = b''
+    for prefix in prefix_list:
+        masklen = int(prefix.split('/')[1])
+        ip_hex = struct.pack('!I', netaddr.IPNetwork(prefix).value)
+        if 16 < masklen <= 24:
+            ip_hex = ip_hex[0:3]
+        elif 8 < masklen <= 16:
+            ip_hex = ip_hex[0:2]
+        elif masklen <= 8:
+            ip_hex = ip_hex[0:1]
+        nlri_raw_hex += struct.pack('!B', masklen) + ip_hex
+    return nlri_raw_hex
+
+
+def legacy_prefix_v6(prefix_list):
+    nlri_hex = b''
+    for prefix in prefix_list:
+        prefix = netaddr.IPNetwork(prefix)
+        nlri_hex += struct.pack('!B', prefix.prefixlen)
+        nlri_hex += prefix.ip.packed[:(prefix.prefixlen + 7) // 8]
+    return nlri_hex
+
+
+def legacy_ipv4(prefixes, per_message):
+    messages = []
+    for start in range(0, len(prefixes), per_message):
+        attr_hex = Update.construct_attributes(ATTR, True)
+        nlri_hex = legacy_prefix_v4(prefixes[start:start + per_message])
+        messages.append(Update.construct_header(
+            struct.pack('!H', 0) + struct.pack('!H', len(attr_hex)) + attr_hex + nlri_hex))
+    return messages
+
+
+def legacy_ipv6(prefixes, per_message):
+    messages = []
+    nexthop = netaddr.IPAddress('2001:db8::1').packed
+    for start in range(0, len(prefixes), per_message):
+        attr_value = struct.pack('!HBB', 2, 1, 16) + nexthop + b'\x00' + \
+            legacy_prefix_v6(prefixes[start:start + per_message])
+        mp_hex = struct.pack('!BBH', MpReachNLRI.FLAG, MpReachNLRI.ID, len(attr_value)) + attr_value
+        attr_hex = Update.construct_attributes(ATTR, True) + mp_hex
+        messages.append(Update.construct_header(struct.pack('!H', 0) + struct.pack('!H', len(attr_hex)) + attr_hex))
+    return messages
+
+
+def run(name, encode, prefixes, rounds):
+    start = time.time()
+    for _ in range(rounds):
+        messages = encode()
+    elapsed = (time.time() - start) / rounds
+    print('%-28s %6d prefixes %4d messages %8.2f ms %8.2f us/prefix' % (
+        name, len(prefixes), len(messages), elapsed * 1000, elapsed * 1e6 / len(prefixes)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='update encoding benchmark')
+    parser.add_argument('--prefixes', type=int, default=10000, help='number of prefixes')
+    parser.add_argument('--rounds', type=int, default=10, help='number of rounds')
+    args = parser.parse_args()
+
+    v4 = ['%d.%d.%d.0/24' % (10 + (i >> 16), i >> 8 & 0xff, i & 0xff) for i in range(args.prefixes)]
+    v6 = ['2001:db8:%x:%x::/64' % (i >> 16, i & 0xffff) for i in range(args.prefixes)]
+    mp_attr = dict(ATTR)
+    mp_attr[14] = {'afi_safi': (2, 1), 'nexthop': '2001:db8::1', 'nlri': v6}
+    cache = LRUCache(100)
+    # the same number of messages as the split ones
+    per_v4 = -(-len(v4) // len(Update.construct_split({'attr': ATTR, 'nlri': v4}, True)))
+    per_v6 = -(-len(v6) // len(Update.construct_split({'attr': mp_attr}, True)))
+
+    run('ipv4 legacy', lambda: legacy_ipv4(v4, per_v4), v4, args.rounds)
+    run('ipv4 encoder', lambda: Update.construct_split({'attr': ATTR, 'nlri': v4}, True), v4, args.rounds)
+    run('ipv4 encoder + attr cache',
+        lambda: Update.construct_split({'attr': ATTR, 'nlri': v4}, True, attr_cache=cache), v4, args.rounds)
+    run('ipv6 legacy', lambda: legacy_ipv6(v6, per_v6), v6, args.rounds)
+    run('ipv6 encoder', lambda: Update.construct_split({'attr': mp_attr}, True), v6, args.rounds)
+    run('ipv6 encoder + attr cache',
+        lambda: Update.construct_split({'attr': mp_attr}, True, attr_cache=cache), v6, args.rounds)
+
+
+if __name__ == '__main__':
+    main()
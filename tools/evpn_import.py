@@ -20,6 +20,7 @@
 """
 
 from __future__ import print_function
+import io
 import os
 import time
 import logging
@@ -29,6 +30,9 @@ import sys
 
 from pymongo import MongoClient
 
+from yabgp.common import msgfile
+from yabgp.common import msgindex
+
 
 CONFIG = {}
 
@@ -134,6 +138,15 @@ class MessageFileOperator(object):
             # get the first line and last line, if sequence number is between the first line
             # and last line, then find_flag is True and return the file name
             file_name = os.path.join(self.file_dir, file_)
+            if file_.endswith(msgfile.TMP_SUFFIX):
+                continue
+            if msgfile.compress_method(file_) != msgfile.COMPRESS_NONE:
+                # compressed files are not written anymore
+                first_line, last_line = self._first_and_last_record(file_name)
+                if first_line and last_line and first_line['seq'] <= self.lastseq <= last_line['seq']:
+                    find_flag = True
+                    break
+                continue
             first_line = {}
             last_line = {}
             with open(file_name, 'r') as f:
@@ -186,16 +199,41 @@ class MessageFileOperator(object):
             sys.exit()
 
     @staticmethod
-    def _locate_line(msgfile, lastseq=0):
+    def _first_and_last_record(file_name):
+        """Get the first and the last message of a compressed message file
+        """
+        first = last = None
+        for record in msgfile.read_records(file_name):
+            first = record
+            break
+        entry = msgindex.last_entry(file_name)
+        for record in msgfile.read_records(file_name, entry[0] if entry else None):
+            last = record
+        return first, last
+
+    @staticmethod
+    def _open_file(file_name, offset=0):
+        """Open a message file in text mode, compressed or not
+        """
+        if msgfile.compress_method(file_name) == msgfile.COMPRESS_NONE:
+            f = open(file_name, "r")
+            f.seek(offset)
+            return f
+        return io.TextIOWrapper(msgfile.open_file(file_name, offset), encoding='utf-8')
+
+    @staticmethod
+    def _locate_line(file_name, lastseq=0):
         """Get bgp message file handles and seek to the position after seq number your input
         """
 
         # Open message file
-        f = open(msgfile, "r")
-        LOG.info('Open BGP message file: %s' % msgfile)
+        LOG.info('Open BGP message file: %s' % file_name)
         if lastseq in [0, -1]:
-            return f
+            return MessageFileOperator._open_file(file_name)
         else:  # skip lastseq
+            # start from the last indexed message before lastseq if the file has an index
+            entry = msgindex.find_offset(msgindex.read_index(file_name), lastseq)
+            f = MessageFileOperator._open_file(file_name, entry[1] if entry else 0)
             line = f.readline()
             while line:
                 line_json = json.loads(line)
@@ -217,19 +255,12 @@ class MessageFileOperator(object):
         for file_ in dir_name_list:
             file_list.remove(file_)
         file_list.sort()
-        if len(file_list) == 1:
-            return None
-        index = file_list.index(old_file_name)
-        if index + 1 == len(file_list):
-            return None
-        try:
-            new_file_name = file_list[index + 1]
-        except Exception as e:
-            LOG.error(e)
-            ex_str = traceback.format_exc()
-            LOG.error(ex_str)
+        # the old file may have been compressed since it was opened
+        file_list = [name for name in file_list if name > old_file_name and
+                     msgfile.base_name(name) != old_file_name and not name.endswith(msgfile.TMP_SUFFIX)]
+        if not file_list:
             return None
-        return os.path.join(self.file_dir, new_file_name)
+        return os.path.join(self.file_dir, file_list[0])
 
     @property
     def readline(self):
@@ -267,7 +298,7 @@ class MessageFileOperator(object):
                     return None
                 else:
                     # need to check the next file
-                    with open(next_file, 'r') as f_next:
+                    with self._open_file(next_file) as f_next:
                         first_line = f_next.readline()
                         try:
                             first_seq = json.loads(first_line)['seq']
@@ -276,7 +307,7 @@ class MessageFileOperator(object):
                             if last_seq + 1 == first_seq:
                                 # really need open next file
                                 self._f.close()  # close old file
-                                self._f = open(next_file, 'r')
+                                self._f = self._open_file(next_file)
                                 LOG.info('Open next BGP message file: %s' % next_file)
                                 self.file_name = next_file
                                 return None
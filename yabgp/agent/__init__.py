@@ -25,9 +25,16 @@ from twisted.web.wsgi import WSGIResource
 
 from yabgp import version, log
 from yabgp.core.factory import BGPPeering
+from yabgp.core.peers import get_registry
+from yabgp.core.parse_pool import get_parse_pool
 from yabgp.config import get_bgp_config
+from yabgp.config import get_peers_config
+from yabgp.config import read_peers
 from yabgp.common import constants as bgp_cons
+from yabgp.agent.supervisor import Supervisor
+from yabgp.agent.supervisor import set_supervisor
 from yabgp.api.app import app
+from yabgp.api.app import supervisor_app
 from yabgp.handler.default_handler import DefaultHandler
 
 
@@ -61,26 +68,43 @@ def prepare_twisted_service(handler, reactor_thread_size=100):
     LOG.info('Prepare twisted services')
 
     LOG.info('Get peer configuration')
-    for conf_key in CONF.bgp.running_config:
-        LOG.info('---%s = %s', conf_key, CONF.bgp.running_config[conf_key])
+    for running_config in get_peers_config():
+        LOG.info('Peer %s', running_config['remote_addr'])
+        for conf_key in running_config:
+            LOG.info('---%s = %s', conf_key, running_config[conf_key])
 
     # init handler
     handler.init()
 
-    LOG.info('Create BGPPeering twsited instance')
-    afi_safi_list = [bgp_cons.AFI_SAFI_STR_DICT[afi_safi] for afi_safi in CONF.bgp.running_config['afi_safi']]
-    CONF.bgp.running_config['afi_safi'] = afi_safi_list
-    CONF.bgp.running_config['capability']['local']['afi_safi'] = afi_safi_list
-    bgp_peering = BGPPeering(
-        myasn=CONF.bgp.running_config['local_as'],
-        myaddr=CONF.bgp.running_config['local_addr'],
-        peerasn=CONF.bgp.running_config['remote_as'],
-        peeraddr=CONF.bgp.running_config['remote_addr'],
-        afisafi=CONF.bgp.running_config['afi_safi'],
-        md5=CONF.bgp.running_config['md5'],
-        handler=handler
-    )
-    CONF.bgp.running_config['factory'] = bgp_peering
+    # stop the update parse worker processes with the reactor
+    parse_pool = get_parse_pool()
+    if parse_pool:
+        reactor.addSystemEventTrigger('before', 'shutdown', parse_pool.shutdown)
+
+    # write the queued messages before the reactor stops
+    if getattr(handler, 'writer', None):
+        reactor.addSystemEventTrigger('before', 'shutdown', handler.writer.stop)
+    if getattr(handler, 'compressor', None):
+        reactor.addSystemEventTrigger('before', 'shutdown', handler.compressor.stop)
+
+    LOG.info('Create BGPPeering twsited instances')
+    registry = get_registry()
+    for running_config in get_peers_config():
+        afi_safi_list = [bgp_cons.AFI_SAFI_STR_DICT[afi_safi] for afi_safi in running_config['afi_safi']]
+        running_config['afi_safi'] = afi_safi_list
+        running_config['capability']['local']['afi_safi'] = afi_safi_list
+        bgp_peering = BGPPeering(
+            myasn=running_config['local_as'],
+            myaddr=running_config['local_addr'],
+            peerasn=running_config['remote_as'],
+            peeraddr=running_config['remote_addr'],
+            afisafi=running_config['afi_safi'],
+            md5=running_config['md5'],
+            handler=handler,
+            running_config=running_config
+        )
+        running_config['factory'] = bgp_peering
+        registry.add(bgp_peering)
 
     # Starting api server
     LOG.info("Prepare RESTAPI service")
@@ -95,8 +119,42 @@ def prepare_twisted_service(handler, reactor_thread_size=100):
         LOG.error(e, exc_info=True)
         sys.exit()
 
-    LOG.info('Starting BGPPeering twsited instance')
-    reactor.callLater(CONF.time.bgp_peer_call_later_time, bgp_peering.automatic_start)
+    LOG.info('Starting BGPPeering twsited instances')
+    for index, bgp_peering in enumerate(registry.peers()):
+        reactor.callLater(
+            CONF.time.bgp_peer_call_later_time + index * CONF.bgp.peer_start_interval, bgp_peering.automatic_start)
+
+    reactor.run()
+
+
+def prepare_supervisor_service(args, handler, api_hander=None, reactor_thread_size=100):
+    """prepare the supervisor of the worker processes
+    """
+    if CONF.bgp.config_file:
+        peers = read_peers(CONF.bgp.config_file)
+    else:
+        peers = [{'remote_as': CONF.bgp.remote_as, 'remote_addr': CONF.bgp.remote_addr}]
+    supervisor = Supervisor(
+        peers, CONF.workers, args, handler_cls=type(handler),
+        api_module=api_hander.__name__ if api_hander else None,
+        base_port=CONF.worker_base_port or CONF.rest.bind_port + 1,
+        reactor_thread_size=reactor_thread_size)
+    set_supervisor(supervisor)
+    reactor.addSystemEventTrigger('before', 'shutdown', supervisor.stop)
+
+    LOG.info("Prepare RESTAPI service")
+    reactor.suggestThreadPoolSize(reactor_thread_size)
+    resource = WSGIResource(reactor, reactor.getThreadPool(), supervisor_app)
+    site = Site(resource)
+    try:
+        reactor.listenTCP(CONF.rest.bind_port, site, interface=CONF.rest.bind_host)
+        LOG.info("serving RESTAPI on http://%s:%s", CONF.rest.bind_host, CONF.rest.bind_port)
+    except Exception as e:
+        LOG.error(e, exc_info=True)
+        sys.exit()
+
+    LOG.info('Starting %s workers for %s peers', len(supervisor.workers), len(peers))
+    supervisor.start()
 
     reactor.run()
 
@@ -130,6 +188,11 @@ def prepare_service(args=None, handler=None, api_hander=None, reactor_thread_siz
         LOG.error(e)
         LOG.debug(traceback.format_exc())
         sys.exit()
+    if CONF.workers > 0:
+        LOG.info('Starting supervisor in PID %s', os.getpid())
+        prepare_supervisor_service(
+            sys.argv[1:] if args is None else args, handler, api_hander, reactor_thread_size)
+        return
     # prepare api handler
     if api_hander:
         register_api_handler(api_hander)
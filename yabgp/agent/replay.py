@@ -0,0 +1,394 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Replay recorded BGP messages without a live peer
+
+    $ yabgp-replay --rib ~/data/bgp/10.0.0.1/msg/*.mrt
+"""
+
+from __future__ import print_function
+
+import argparse
+import binascii
+import io
+import logging
+import sys
+import time
+import traceback
+
+import simplejson as json
+from oslo_config import cfg
+
+from yabgp.common import constants as bgp_cons
+from yabgp.common import mrt
+from yabgp.common import msgfile
+from yabgp.core.protocol import BGP
+from yabgp.handler import BaseHandler
+from yabgp.message.open import Open
+from yabgp.message.update import Update
+
+LOG = logging.getLogger(__name__)
+
+CONF = cfg.CONF
+
+FORMAT_JSON = 'json'
+FORMAT_MRT = 'mrt'
+FORMAT_HEX = 'hex'
+
+
+class ReplayError(Exception):
+    pass
+
+
+class ReplayHandler(BaseHandler):
+    """
+    Handler which drops all the messages.
+    """
+
+    def init(self):
+        pass
+
+    def on_update_error(self, peer, timestamp, msg):
+        pass
+
+    def update_received(self, peer, timestamp, msg):
+        pass
+
+    def update_batch_received(self, peer, batch):
+        pass
+
+    def keepalive_received(self, peer, timestamp):
+        pass
+
+    def open_received(self, peer, timestamp, result):
+        pass
+
+    def send_open(self, peer, timestamp, result):
+        pass
+
+    def route_refresh_received(self, peer, msg, msg_type):
+        pass
+
+    def notification_received(self, peer, msg):
+        pass
+
+    def on_connection_lost(self, peer):
+        pass
+
+    def on_connection_failed(self, peer, msg):
+        pass
+
+    def on_established(self, peer, msg):
+        pass
+
+
+class ReplayFactory(object):
+    """
+    Stand-in for `BGPPeering` giving the protocol its handler and peer.
+    """
+
+    def __init__(self, handler, peer_addr):
+        self.handler = handler
+        self.peer_addr = peer_addr
+        self.my_asn = 0
+        self.peer_asn = 0
+        self.my_addr = None
+
+
+class ReplayFSM(object):
+    """
+    Stand-in for the FSM, header errors stop the replay.
+    """
+
+    def update_received(self):
+        pass
+
+    def keep_alive_received(self):
+        pass
+
+    def header_error(self, suberror, data=b''):
+        raise ReplayError('BGP message header error, sub error: %s' % suberror)
+
+
+class ReplayProtocol(BGP):
+    """
+    BGP protocol fed with recorded messages. The framing, update parsing,
+    RIB and handler delivery are the ones of `BGP`, the session messages
+    (OPEN, KEEPALIVE, NOTIFICATION, ROUTE-REFRESH) are only counted, and
+    the 4 bytes AS capability is taken from the recorded OPEN messages.
+    """
+
+    def __init__(self, factory):
+        super(ReplayProtocol, self).__init__()
+        self.factory = factory
+        self.fsm = ReplayFSM()
+        # the worker process results are collected by the reactor, which
+        # is not running here
+        self.parse_pool = None
+        self.prefixes = 0
+        # {<afi_safi>: [<count>, <total latency>, <max latency>]}
+        self.latency = {}
+
+    def _open_received(self, timestamp, msg):
+        self.msg_recv_stat['Opens'] += 1
+        open_msg = Open()
+        open_msg.parse(msg)
+        self.fourbytesas = bool(open_msg.capa_dict.get('four_bytes_as'))
+
+    def _keepalive_received(self, timestamp, msg):
+        self.msg_recv_stat['Keepalives'] += 1
+
+    def _notification_received(self, msg):
+        self.msg_recv_stat['Notifications'] += 1
+
+    def _route_refresh_received(self, msg, msg_type):
+        self.msg_recv_stat['RouteRefresh'] += 1
+
+    def _process_update(self, timestamp, result):
+        latency = time.time() - timestamp
+        afi_safi = None if result['sub_error'] else self.get_afi_safi(result)
+        stat = self.latency.setdefault(afi_safi, [0, 0.0, 0.0])
+        stat[0] += 1
+        stat[1] += latency
+        stat[2] = max(stat[2], latency)
+        if not result['sub_error']:
+            self.prefixes += len(result['nlri']) + len(result['withdraw'])
+            for attr_type, key in ((bgp_cons.BGPTYPE_MP_REACH_NLRI, 'nlri'),
+                                   (bgp_cons.BGPTYPE_MP_UNREACH_NLRI, 'withdraw')):
+                mp_nlri = result['attr'].get(attr_type, {}).get(key)
+                if mp_nlri:
+                    self.prefixes += len(mp_nlri) if isinstance(mp_nlri, list) else 1
+        super(ReplayProtocol, self)._process_update(timestamp, result)
+
+
+class Replayer(object):
+    """
+    Stream recorded messages through a `ReplayProtocol`. Messages are
+    handed to `dataReceived` in reads of about `read_size` bytes like TCP
+    data, or one by one at the recorded pace when `pace` is set.
+    """
+
+    def __init__(self, handler=None, peer_addr='0.0.0.0', pace=0, read_size=65536, asn4=True):
+        """
+        :param handler: message handler, default drops all the messages
+        :param peer_addr: peer address given to the handler
+        :param pace: 0 replays as fast as possible, 1 replays at the recorded
+            speed, 2 twice the recorded speed
+        :param read_size: bytes given to the protocol at once
+        :param asn4: the messages use 4 bytes AS numbers until an OPEN
+            message is replayed
+        """
+        self.protocol = ReplayProtocol(ReplayFactory(handler or ReplayHandler(), peer_addr))
+        self.protocol.fourbytesas = asn4
+        self.pace = pace
+        self.read_size = read_size
+        self.messages = 0
+        self.errors = 0
+        self.elapsed = 0
+        self._pending = []
+        self._pending_size = 0
+        self._first = None
+
+    def feed(self, timestamp, data):
+        """
+        Replay one BGP message.
+
+        :param timestamp: the recorded time of the message
+        :param data: BGP message bytes with the header
+        """
+        self.messages += 1
+        if self.pace and timestamp is not None:
+            if self._first is None:
+                self._first = (timestamp, time.time())
+            delay = (timestamp - self._first[0]) / self.pace - (time.time() - self._first[1])
+            if delay > 0:
+                time.sleep(delay)
+            self.protocol.dataReceived(data)
+            return
+        self._pending.append(data)
+        self._pending_size += len(data)
+        if self._pending_size >= self.read_size:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            data = b''.join(self._pending)
+            self._pending = []
+            self._pending_size = 0
+            self.protocol.dataReceived(data)
+
+    def replay_mrt(self, fh):
+        """
+        Replay the received messages of a MRT file, only BGP4MP records are used.
+
+        :param fh: file object opened in binary mode
+        """
+        for timestamp, mrt_type, subtype, body in mrt.read_records(fh):
+            if mrt_type not in (mrt.MRT_BGP4MP, mrt.MRT_BGP4MP_ET) or \
+                    subtype not in (mrt.BGP4MP_MESSAGE, mrt.BGP4MP_MESSAGE_AS4):
+                continue
+            asn4 = subtype == mrt.BGP4MP_MESSAGE_AS4
+            if self.protocol.msg_recv_stat['Opens'] == 0 and self.protocol.fourbytesas != asn4:
+                # no OPEN recorded, the AS number size follows the subtype
+                self.flush()
+                self.protocol.fourbytesas = asn4
+            self.feed(timestamp, mrt.parse_message(subtype, body)[4])
+
+    def replay_hex(self, fh):
+        """
+        Replay a text file of hex strings, one or more BGP messages in each line.
+
+        :param fh: file object opened in text mode
+        """
+        for line in fh:
+            line = ''.join(line.split()).replace('0x', '')
+            if line:
+                self.feed(None, binascii.unhexlify(line))
+
+    def replay_json(self, fh):
+        """
+        Replay the update messages of a json message file. The messages are
+        encoded again with 4 bytes AS numbers, a message which can not be
+        encoded is handed to the handler as it is.
+
+        :param fh: file object opened in text mode
+        """
+        self.protocol.fourbytesas = True
+        for line in fh:
+            if not line.startswith('{'):
+                continue
+            record = json.loads(line)
+            if record['type'] != bgp_cons.MSG_UPDATE:
+                continue
+            msg = record['msg']
+            msg['attr'] = {int(k): v for k, v in (msg.get('attr') or {}).items()}
+            for attr_type in (bgp_cons.BGPTYPE_MP_REACH_NLRI, bgp_cons.BGPTYPE_MP_UNREACH_NLRI):
+                if attr_type in msg['attr']:
+                    msg['attr'][attr_type]['afi_safi'] = tuple(msg['attr'][attr_type]['afi_safi'])
+            try:
+                data = Update.construct(msg, asn4=True)
+            except Exception as e:
+                LOG.debug('can not encode message %s: %s', record.get('seq'), e)
+                self.flush()
+                self.messages += 1
+                self.protocol._process_update(time.time(), {
+                    'attr': msg['attr'],
+                    'nlri': msg.get('nlri') or [],
+                    'withdraw': msg.get('withdraw') or [],
+                    'sub_error': None
+                })
+                continue
+            self.feed(record.get('t'), data)
+
+    def replay_file(self, path, file_format=None):
+        """
+        Replay one file.
+
+        :param path: file path
+        :param file_format: 'json', 'mrt' or 'hex', default is found from
+            the file name (.msg json, .mrt MRT and hex for other files),
+            .gz and .zst compressed files are read as the uncompressed ones
+        """
+        if not file_format:
+            if msgfile.base_name(path).endswith('.mrt'):
+                file_format = FORMAT_MRT
+            elif msgfile.base_name(path).endswith('.msg'):
+                file_format = FORMAT_JSON
+            else:
+                file_format = FORMAT_HEX
+        start = time.time()
+        try:
+            with msgfile.open_file(path) as fh:
+                if file_format == FORMAT_MRT:
+                    self.replay_mrt(fh)
+                elif file_format == FORMAT_JSON:
+                    self.replay_json(io.TextIOWrapper(fh, encoding='utf-8'))
+                else:
+                    self.replay_hex(io.TextIOWrapper(fh, encoding='utf-8'))
+            self.flush()
+            self.protocol.flush_update_batch()
+        except Exception as e:
+            self.errors += 1
+            LOG.error('failed to replay %s: %s', path, e)
+            LOG.debug(traceback.format_exc())
+        finally:
+            self.elapsed += time.time() - start
+
+    def stats(self):
+        """
+        :return: replay statistic dictionary, latency is in milliseconds
+        """
+        elapsed = self.elapsed or 1e-9
+        latency = {}
+        for afi_safi, (count, total, max_latency) in self.protocol.latency.items():
+            latency[str(afi_safi)] = {
+                'updates': count,
+                'avg': total * 1000 / count,
+                'max': max_latency * 1000
+            }
+        return {
+            'messages': self.messages,
+            'updates': self.protocol.msg_recv_stat['Updates'],
+            'prefixes': self.protocol.prefixes,
+            'errors': self.errors,
+            'elapsed': self.elapsed,
+            'messages_per_second': self.messages / elapsed,
+            'prefixes_per_second': self.protocol.prefixes / elapsed,
+            'latency': latency,
+            'rib': {k: len(v) for k, v in self.protocol.adj_rib_in.items()} if CONF.bgp.rib else {}
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='yabgp-replay', description='Replay recorded BGP messages through the YABGP parser')
+    parser.add_argument('files', nargs='+',
+                        help='json (.msg), MRT (.mrt) or hex message files, compressed (.gz, .zst) or not')
+    parser.add_argument('--format', choices=[FORMAT_JSON, FORMAT_MRT, FORMAT_HEX],
+                        help='file format, default is found from the file name')
+    parser.add_argument('--pace', type=float, default=0,
+                        help='replay speed relative to the recorded timestamps, 0 is as fast as possible')
+    parser.add_argument('--asn2', action='store_true',
+                        help='hex messages use 2 bytes AS numbers if there is no OPEN message')
+    parser.add_argument('--rib', action='store_true', help='build the Adj-RIB-In of all address families')
+    parser.add_argument('--json', action='store_true', help='print the statistic as json')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING)
+    if args.rib:
+        CONF.set_override('rib', True, 'bgp')
+        CONF.set_override('afi_safi', list(bgp_cons.AFI_SAFI_STR_DICT), 'bgp')
+    replayer = Replayer(pace=args.pace, asn4=not args.asn2)
+    for path in args.files:
+        replayer.replay_file(path, args.format)
+    stats = replayer.stats()
+    if args.json:
+        print(json.dumps(stats, indent=2, sort_keys=True))
+    else:
+        print('messages %d, updates %d, prefixes %d, errors %d in %.2f s' % (
+            stats['messages'], stats['updates'], stats['prefixes'], stats['errors'], stats['elapsed']))
+        print('%.0f messages/s, %.0f prefixes/s' % (stats['messages_per_second'], stats['prefixes_per_second']))
+        for afi_safi in sorted(stats['latency']):
+            latency = stats['latency'][afi_safi]
+            print('%-14s %9d updates  avg %.3f ms  max %.3f ms' % (
+                afi_safi, latency['updates'], latency['avg'], latency['max']))
+        for afi_safi in sorted(stats['rib']):
+            if stats['rib'][afi_safi]:
+                print('%-14s %9d routes' % (afi_safi, stats['rib'][afi_safi]))
+    return 1 if stats['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
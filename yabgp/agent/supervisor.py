@@ -0,0 +1,258 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+""" Supervisor of the worker processes
+
+With ``--workers N`` the peers are spread over N worker processes by
+consistent hashing of their address, each worker is a yabgpd with its own
+reactor, peers file and REST port on the loopback. The supervisor restarts
+the workers which exit and serves the REST API, forwarding the calls of a
+peer to its worker.
+"""
+
+import bisect
+import hashlib
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from oslo_config import cfg
+from twisted.internet import reactor
+from twisted.internet import task
+
+from yabgp.core.peers import peer_key
+
+LOG = logging.getLogger(__name__)
+
+CONF = cfg.CONF
+
+SUPERVISOR_OPTS = [
+    cfg.IntOpt('workers',
+               default=0,
+               help='The number of worker processes the BGP peers are spread over, '
+                    '0 means the peers run in this process'),
+    cfg.IntOpt('worker_base_port',
+               default=0,
+               help='The REST API port of the first worker, the next ones use the following ports, '
+                    '0 means the port after the API port'),
+]
+
+CONF.register_cli_opts(SUPERVISOR_OPTS)
+
+# a worker which lived longer than this is restarted at once
+WORKER_STABLE_TIME = 60
+WORKER_MAX_RESTART_DELAY = 60
+WORKER_STOP_TIMEOUT = 10
+
+_SUPERVISOR = None
+
+
+class HashRing(object):
+    """
+    Consistent hash ring, adding or removing a node only moves the keys
+    of that node.
+    """
+
+    def __init__(self, nodes, replicas=160):
+        """
+        :param nodes: node names
+        :param replicas: number of points of each node on the ring
+        """
+        points = sorted((self.hash('%s-%s' % (node, i)), node) for node in nodes for i in range(replicas))
+        self._hashes = [point[0] for point in points]
+        self._nodes = [point[1] for point in points]
+
+    @staticmethod
+    def hash(key):
+        return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+
+    def get(self, key):
+        """
+        :return: the node owning the key
+        """
+        index = bisect.bisect(self._hashes, self.hash(key)) % len(self._hashes)
+        return self._nodes[index]
+
+
+def run_worker(args, handler_cls, api_module, reactor_thread_size):
+    """
+    Entry of a worker process.
+    """
+    from yabgp.agent import prepare_service
+    handler = handler_cls() if handler_cls else None
+    api_hander = importlib.import_module(api_module) if api_module else None
+    prepare_service(args=args, handler=handler, api_hander=api_hander, reactor_thread_size=reactor_thread_size)
+
+
+class Worker(object):
+    """
+    One worker process and its peers.
+    """
+
+    def __init__(self, index, port, peers, config_file):
+        self.index = index
+        self.port = port
+        self.peers = peers
+        self.config_file = config_file
+        self.process = None
+        self.started = 0
+        self.restarts = 0
+        self.restart_delay = 0
+
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def stats(self):
+        return {
+            'index': self.index,
+            'pid': self.process.pid if self.process is not None else None,
+            'alive': self.alive(),
+            'port': self.port,
+            'peers': [peer['remote_addr'] for peer in self.peers],
+            'uptime': time.time() - self.started if self.alive() else 0,
+            'restarts': self.restarts
+        }
+
+
+class Supervisor(object):
+    """
+    Start the workers and restart them when they exit.
+    """
+
+    def __init__(self, peers, workers, args, handler_cls=None, api_module=None,
+                 base_port=None, reactor_thread_size=100):
+        """
+        :param peers: peer dicts in the format of the peers file
+        :param workers: number of worker processes
+        :param args: command line arguments of the workers
+        :param handler_cls: class of the handler of the workers
+        :param api_module: module name of the API handler of the workers
+        :param base_port: REST port of the first worker
+        :param reactor_thread_size: thread pool size of the workers
+        """
+        self.args = list(args)
+        self.handler_cls = handler_cls
+        self.api_module = api_module
+        self.reactor_thread_size = reactor_thread_size
+        self.ring = HashRing(range(workers))
+        self.peer_worker = {}
+        self.stopping = False
+        self._check = None
+        self.config_dir = tempfile.mkdtemp(prefix='yabgp-workers-')
+        shards = [[] for _ in range(workers)]
+        for peer in peers:
+            index = self.ring.get(peer_key(peer['remote_addr']))
+            shards[index].append(peer)
+        self.workers = []
+        for index, shard in enumerate(shards):
+            # a worker without peer is not started
+            if not shard:
+                continue
+            worker = Worker(index, base_port + index, shard, os.path.join(self.config_dir, 'worker-%s.json' % index))
+            with open(worker.config_file, 'w') as f:
+                json.dump(shard, f)
+            for peer in shard:
+                self.peer_worker[peer_key(peer['remote_addr'])] = worker
+            self.workers.append(worker)
+
+    def worker_args(self, worker):
+        # the last value of an option on the command line wins
+        return self.args + [
+            '--bgp-config_file', worker.config_file,
+            '--rest-bind_host', '127.0.0.1',
+            '--rest-bind_port', str(worker.port),
+            '--workers', '0']
+
+    def get_worker(self, peer_ip):
+        """
+        :return: the worker of a peer, None if the peer is unknown
+        """
+        return self.peer_worker.get(peer_key(peer_ip))
+
+    def spawn(self, worker):
+        if self.stopping:
+            return
+        context = multiprocessing.get_context('spawn')
+        worker.process = context.Process(
+            target=run_worker, name='yabgp-worker-%s' % worker.index,
+            args=(self.worker_args(worker), self.handler_cls, self.api_module, self.reactor_thread_size))
+        worker.process.start()
+        worker.started = time.time()
+        LOG.info('Start worker %s in PID %s for %s peers on port %s',
+                 worker.index, worker.process.pid, len(worker.peers), worker.port)
+
+    def start(self, check_interval=1):
+        for worker in self.workers:
+            self.spawn(worker)
+        self._check = task.LoopingCall(self.check)
+        self._check.start(check_interval, now=False)
+
+    def check(self):
+        """
+        Restart the workers which exited, again and again slower
+        if they exit soon after starting.
+        """
+        for worker in self.workers:
+            if worker.process is None or worker.process.is_alive() or self.stopping:
+                continue
+            exitcode = worker.process.exitcode
+            worker.process = None
+            if time.time() - worker.started > WORKER_STABLE_TIME:
+                worker.restart_delay = 0
+            else:
+                worker.restart_delay = min(max(1, worker.restart_delay * 2), WORKER_MAX_RESTART_DELAY)
+            worker.restarts += 1
+            LOG.error('Worker %s exited with code %s, restart it in %s seconds',
+                      worker.index, exitcode, worker.restart_delay)
+            reactor.callLater(worker.restart_delay, self.spawn, worker)
+
+    def stop(self):
+        LOG.info('Stop the workers')
+        self.stopping = True
+        if self._check is not None and self._check.running:
+            self._check.stop()
+        for worker in self.workers:
+            if worker.alive():
+                worker.process.terminate()
+        for worker in self.workers:
+            if worker.process is not None:
+                worker.process.join(WORKER_STOP_TIMEOUT)
+                if worker.process.is_alive():
+                    LOG.warning('Worker %s did not stop, kill it', worker.index)
+                    worker.process.kill()
+        shutil.rmtree(self.config_dir, ignore_errors=True)
+
+    def stats(self):
+        return {
+            'workers': [worker.stats() for worker in self.workers],
+            'peers': len(self.peer_worker)
+        }
+
+
+def get_supervisor():
+    """
+    Get the supervisor of this process, None if it is not a supervisor.
+    """
+    return _SUPERVISOR
+
+
+def set_supervisor(supervisor):
+    global _SUPERVISOR
+    _SUPERVISOR = supervisor
@@ -19,6 +19,7 @@
 import flask
 
 from yabgp.api import v1
+from yabgp.api import proxy
 from yabgp.api import config
 from oslo_config import cfg
 
@@ -26,6 +27,10 @@ app = flask.Flask('yabgp.api')
 app.config['SECRET_KEY'] = 'cisco123'
 app.register_blueprint(v1.blueprint, url_prefix='/v1')
 
+# API of the supervisor of the worker processes
+supervisor_app = flask.Flask('yabgp.api.supervisor')
+supervisor_app.register_blueprint(proxy.blueprint, url_prefix='/v1')
+
 cfg.CONF.register_cli_opts(config.rest_server_ops, group='rest')
 cfg.CONF.register_opts(config.keep_alive_ops, group='keep_alive')
 
@@ -0,0 +1,192 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""API of the supervisor, the calls of a peer are forwarded to its worker
+"""
+
+import base64
+import logging
+import time
+import urllib.error
+import urllib.request
+
+from flask_httpauth import HTTPBasicAuth
+from flask import Blueprint
+import flask
+from oslo_config import cfg
+import simplejson as json
+
+from yabgp.api import utils as api_utils
+
+LOG = logging.getLogger(__name__)
+blueprint = Blueprint('proxy', __name__)
+auth = HTTPBasicAuth()
+
+# request and response headers passed through
+FORWARD_REQUEST_HEADERS = ['Authorization', 'Content-Type', 'Accept', 'Accept-Encoding']
+FORWARD_RESPONSE_HEADERS = ['Content-Type', 'Content-Encoding', 'Retry-After', 'X-RIB-Version']
+CHUNK_SIZE = 65536
+FORWARD_TIMEOUT = 60
+
+
+@auth.get_password
+def get_pw(username):
+    if username == cfg.CONF.rest.username:
+        return cfg.CONF.rest.password
+    return None
+
+
+def get_supervisor():
+    # imported here as yabgp.agent imports the API app
+    from yabgp.agent.supervisor import get_supervisor as _get_supervisor
+    return _get_supervisor()
+
+
+def _open(worker, path, method='GET', data=None, headers=None):
+    """
+    call the API of a worker
+    :return: the response, error responses included
+    """
+    url = 'http://127.0.0.1:%s%s' % (worker.port, path)
+    req = urllib.request.Request(url, data=data, method=method, headers=headers or {})
+    try:
+        return urllib.request.urlopen(req, timeout=FORWARD_TIMEOUT)
+    except urllib.error.HTTPError as e:
+        return e
+
+
+def _get_json(worker, path):
+    """
+    get a JSON API of a worker, with the credentials of the API
+    :return: the decoded body, None if the worker does not answer
+    """
+    if not worker.alive():
+        return None
+    credentials = base64.b64encode(('%s:%s' % (cfg.CONF.rest.username, cfg.CONF.rest.password)).encode('utf-8'))
+    try:
+        response = _open(worker, path, headers={'Authorization': 'Basic %s' % credentials.decode('ascii')})
+        with response:
+            if response.status != 200:
+                LOG.error('worker %s: %s returns %s', worker.index, path, response.status)
+                return None
+            return json.loads(response.read())
+    except Exception as e:
+        LOG.error('worker %s: %s', worker.index, e)
+        return None
+
+
+def _worker_unavailable(worker):
+    response = flask.jsonify({
+        'status': False,
+        'code': 'worker %s is not available, please retry later' % worker.index
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+
+@blueprint.route('/')
+def root():
+    """
+    v1 api root. Get the api status.
+    """
+    intro = {
+        "status": "stable",
+        "updated": "2015-01-22T00:00:00Z",
+        "version": "v1"}
+    cfg.CONF.keep_alive.last_time = time.time()
+    return flask.jsonify(intro)
+
+
+@blueprint.route('/workers')
+@auth.login_required
+@api_utils.log_request
+def workers():
+    """
+    Get the worker processes and their peers.
+    """
+    return flask.jsonify(get_supervisor().stats())
+
+
+@blueprint.route('/peers')
+@auth.login_required
+@api_utils.log_request
+def peers():
+    """
+    Get all the peers' running information, from all the workers.
+    """
+    all_peers = []
+    for worker in get_supervisor().workers:
+        result = _get_json(worker, '/v1/peers')
+        if result:
+            all_peers.extend(result.get('peers', []))
+    return flask.jsonify({'peers': all_peers})
+
+
+@blueprint.route('/statistic')
+@auth.login_required
+@api_utils.log_request
+def statistic():
+    """
+    Get the message statistic of all the peers of all the workers.
+    """
+    total = {'peers': 0, 'established': 0, 'send': {}, 'receive': {}, 'workers': {}}
+    for worker in get_supervisor().workers:
+        result = _get_json(worker, '/v1/statistic')
+        total['workers'][worker.index] = result
+        if result:
+            total['peers'] += result.get('peers', 0)
+            total['established'] += result.get('established', 0)
+            api_utils.sum_msg_statistic(result, total)
+    return flask.jsonify(total)
+
+
+@blueprint.route('/peer/<peer_ip>/<path:path>', methods=['GET', 'POST', 'PUT', 'DELETE'])
+@api_utils.log_request
+def forward(peer_ip, path):
+    """
+    Forward the call to the worker of the peer, the worker checks the credentials.
+    """
+    worker = get_supervisor().get_worker(peer_ip)
+    if worker is None:
+        return flask.jsonify({
+            'status': False,
+            'code': 'peer %s not found' % peer_ip
+        })
+    if not worker.alive():
+        return _worker_unavailable(worker)
+    request = flask.request
+    headers = {key: request.headers[key] for key in FORWARD_REQUEST_HEADERS if key in request.headers}
+    try:
+        response = _open(
+            worker, request.full_path.rstrip('?'), method=request.method,
+            data=request.get_data() or None, headers=headers)
+    except Exception as e:
+        LOG.error('worker %s: %s', worker.index, e)
+        return _worker_unavailable(worker)
+
+    def generate():
+        try:
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            response.close()
+
+    return flask.Response(
+        generate(), status=response.status,
+        headers={key: response.headers[key] for key in FORWARD_RESPONSE_HEADERS if key in response.headers})
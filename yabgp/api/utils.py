@@ -15,13 +15,19 @@
 
 import time
 import logging
+import zlib
 from functools import wraps
 
 from oslo_config import cfg
 from flask import request
 import flask
+import simplejson as json
+from twisted.internet import reactor
+from twisted.internet import threads
 
 from yabgp.common import constants as common_cons
+from yabgp.core.peers import get_registry
+from yabgp.core.rib import IPAdjRIB
 
 LOG = logging.getLogger(__name__)
 
@@ -41,6 +47,36 @@ def log_request(f):
     return decorated_function
 
 
+def get_peering(peer_ip=None):
+    """
+    get the BGPPeering of a peer
+    :param peer_ip: peer ip address, None for the first peer
+    :return: BGPPeering, None if the peer is unknown
+    """
+    registry = get_registry()
+    if not len(registry):
+        # only one peer, not registered
+        return cfg.CONF.bgp.running_config.get('factory')
+    if peer_ip is None:
+        return registry.default
+    return registry.get(peer_ip)
+
+
+def makesure_peer_exist(f):
+    @wraps(f)
+    def decorator(*args, **kwargs):
+        value = kwargs['peer_ip']
+        if get_peering(value) is not None:
+            return f(*args, **kwargs)
+        else:
+            return flask.jsonify({
+                'status': False,
+                'code': 'peer %s not found' % value
+            })
+
+    return decorator
+
+
 def makesure_peer_establish(f):
     @wraps(f)
     def decorator(*args, **kwargs):
@@ -56,24 +92,63 @@ def makesure_peer_establish(f):
     return decorator
 
 
+def wait_peer_writable(f):
+    """
+    Wait until the messages waiting to be sent to the peer are under the
+    low watermark, or answer 503 with a Retry-After header.
+    """
+    @wraps(f)
+    def decorator(*args, **kwargs):
+        protocol = get_peering(kwargs['peer_ip']).fsm.protocol
+        if protocol.writer.wait_writable(cfg.CONF.bgp.write_block_timeout):
+            return f(*args, **kwargs)
+        LOG.info('peer %s is busy, %s bytes are waiting to be sent',
+                 kwargs['peer_ip'], protocol.writer.stats()['queued_bytes'])
+        response = flask.jsonify({
+            'status': False,
+            'code': 'peer is busy, please retry later'
+        })
+        response.status_code = 503
+        response.headers['Retry-After'] = str(max(1, cfg.CONF.bgp.write_block_timeout))
+        return response
+
+    return decorator
+
+
 def get_peer_conf_and_state(peer_ip=None):
     """
     get peer configuration and state
     :param peer_ip: peer ip address
     :return:
     """
-    one_peer_state = {key: cfg.CONF.bgp.running_config[key] for key in [
+    peering = get_peering(peer_ip)
+    if peering is None:
+        return {
+            'status': False,
+            'code': 'peer %s not found' % peer_ip
+        }
+    one_peer_state = {key: peering.running_config[key] for key in [
         'remote_as', 'remote_addr', 'local_as', 'local_addr', 'capability']}
-    fsm = cfg.CONF.bgp.running_config['factory'].fsm.state
+    fsm = peering.fsm.state
     one_peer_state['fsm'] = common_cons.stateDescr[fsm]
     if fsm == common_cons.ST_ESTABLISHED:
-        one_peer_state['uptime'] = time.time() - cfg.CONF.bgp.running_config['factory'].fsm.uptime
+        one_peer_state['uptime'] = time.time() - peering.fsm.uptime
     else:
         one_peer_state['uptime'] = 0
 
     return {'peer': one_peer_state}
 
 
+def get_peers_conf_and_state():
+    """
+    get the configuration and state of all the peers
+    :return:
+    """
+    peer_ips = [peering.peer_addr for peering in get_registry().peers()] or [None]
+    peers = [get_peer_conf_and_state(peer_ip).get('peer') for peer_ip in peer_ips]
+    return {'peers': [one_peer_state for one_peer_state in peers if one_peer_state]}
+
+
 def get_peer_version(action, peer_ip=None):
     """
     get version
@@ -83,11 +158,11 @@ def get_peer_version(action, peer_ip=None):
     """
     if action == "send":
         return {
-            'version': cfg.CONF.bgp.running_config['factory'].fsm.protocol.send_version
+            'version': get_peering(peer_ip).fsm.protocol.send_version
         }
     elif action == "received":
         return {
-            'version': cfg.CONF.bgp.running_config['factory'].fsm.protocol.receive_version,
+            'version': get_peering(peer_ip).fsm.protocol.receive_version,
         }
     else:
         return {
@@ -103,10 +178,64 @@ def get_peer_msg_statistic(peer_ip=None):
     :return:
     """
 
-    return {
-        'send': cfg.CONF.bgp.running_config['factory'].fsm.protocol.msg_sent_stat,
-        'receive': cfg.CONF.bgp.running_config['factory'].fsm.protocol.msg_recv_stat,
+    protocol = get_peering(peer_ip).fsm.protocol
+    statistic = {
+        'send': protocol.msg_sent_stat,
+        'receive': protocol.msg_recv_stat,
     }
+    if protocol.attr_cache is not None:
+        statistic['attr_cache'] = protocol.attr_cache.stats()
+    if protocol.send_attr_cache is not None:
+        statistic['send_attr_cache'] = protocol.send_attr_cache.stats()
+    writer = getattr(protocol.handler, 'writer', None)
+    if writer is not None:
+        statistic['writer'] = writer.stats()
+    statistic['transport'] = protocol.writer.stats()
+    statistic['inbound'] = {
+        'paused': protocol.reading_paused,
+        'pauses': protocol.read_pauses,
+        'backlog': protocol.handler.backlog()
+    }
+    if hasattr(protocol.handler.inter_mq, 'stats'):
+        statistic['outbound'] = protocol.handler.inter_mq.stats()
+    compressor = getattr(protocol.handler, 'compressor', None)
+    if compressor is not None:
+        statistic['compressor'] = compressor.stats()
+    return statistic
+
+
+def sum_msg_statistic(statistic, total):
+    """
+    add the send and receive message counts of a statistic to a total
+    :param statistic: {'send': {..}, 'receive': {..}}
+    :param total: the total, updated in place
+    :return:
+    """
+    for action in ('send', 'receive'):
+        counts = total.setdefault(action, {})
+        for msg_type, count in statistic.get(action, {}).items():
+            counts[msg_type] = counts.get(msg_type, 0) + count
+    return total
+
+
+def get_msg_statistic():
+    """
+    get the message statistic of all the peers together
+    :return:
+    """
+    statistic = {'peers': 0, 'established': 0, 'send': {}, 'receive': {}}
+    peerings = get_registry().peers() or [get_peering()]
+    for peering in peerings:
+        if peering is None:
+            continue
+        statistic['peers'] += 1
+        protocol = peering.fsm.protocol
+        if protocol is None:
+            continue
+        if peering.fsm.state == common_cons.ST_ESTABLISHED:
+            statistic['established'] += 1
+        sum_msg_statistic({'send': protocol.msg_sent_stat, 'receive': protocol.msg_recv_stat}, statistic)
+    return statistic
 
 
 def _ready_to_send_msg(peer_ip):
@@ -115,8 +244,8 @@ def _ready_to_send_msg(peer_ip):
     :param peer_ip:  peer ip address
     :return: if is ready, return is True, or False
     """
-    peer_state = get_peer_conf_and_state()
-    if peer_state.get('peer').get('fsm') == common_cons.stateDescr[common_cons.ST_ESTABLISHED]:
+    peer_state = get_peer_conf_and_state(peer_ip)
+    if peer_state.get('peer', {}).get('fsm') == common_cons.stateDescr[common_cons.ST_ESTABLISHED]:
         return True
     return False
 
@@ -128,7 +257,7 @@ def send_route_refresh(peer_ip, afi, safi, res):
     :return: the sending results
     """
     try:
-        if cfg.CONF.bgp.running_config['factory'].fsm.protocol.send_route_refresh(
+        if get_peering(peer_ip).fsm.protocol.send_route_refresh(
                 afi=afi, safi=safi, res=res):
             return {
                 'status': True
@@ -152,7 +281,7 @@ def send_update(peer_ip, attr, nlri, withdraw):
     :param peer_ip: peer ip address
     :return:
     """
-    if cfg.CONF.bgp.running_config['factory'].fsm.protocol.send_update(
+    if get_peering(peer_ip).fsm.protocol.send_update(
             {'attr': attr, 'nlri': nlri, 'withdraw': withdraw}):
         return {
             'status': True
@@ -164,13 +293,32 @@ def send_update(peer_ip, attr, nlri, withdraw):
         }
 
 
+def send_updates(peer_ip, msg_list):
+    """
+    send many update messages packed in as few messages as possible
+    :param peer_ip: peer ip address
+    :param msg_list: list of {'attr': .., 'nlri': .., 'withdraw': ..}
+    :return:
+    """
+    count = get_peering(peer_ip).fsm.protocol.send_updates(msg_list)
+    if count is None:
+        return {
+            'status': False,
+            'code': 'failed when send these messages out'
+        }
+    return {
+        'status': True,
+        'messages': count
+    }
+
+
 def construct_update_to_bin(peer_ip, attr, nlri, withdraw):
     """
     send update message to bin
     :param peer_ip: peer ip address
     :return:
     """
-    massage_bin = cfg.CONF.bgp.running_config['factory'].fsm.protocol.construct_update_to_bin({
+    massage_bin = get_peering(peer_ip).fsm.protocol.construct_update_to_bin({
         'attr': attr, 'nlri': nlri, 'withdraw': withdraw})
     return massage_bin
 
@@ -181,7 +329,7 @@ def send_bin_update(peer_ip, massage):
     :param peer_ip: peer ip address
     :return:
     """
-    if cfg.CONF.bgp.running_config['factory'].fsm.protocol.send_bin_update(massage):
+    if get_peering(peer_ip).fsm.protocol.send_bin_update(massage):
         return {
             'status': True
         }
@@ -200,7 +348,7 @@ def manual_start(peer_ip):
     '''
     try:
 
-        res = cfg.CONF.bgp.running_config['factory'].manual_start()
+        res = get_peering(peer_ip).manual_start()
         if res == 'EST':
             return {
                 'status': False,
@@ -230,7 +378,7 @@ def manual_stop(peer_ip):
     :return:
     '''
     try:
-        result = cfg.CONF.bgp.running_config['factory'].manual_stop()
+        result = get_peering(peer_ip).manual_stop()
         if result:
             return {
                 'status': True
@@ -248,8 +396,10 @@ def manual_stop(peer_ip):
         }
 
 
-def save_send_ipv4_policies(msg):
-    if cfg.CONF.bgp.running_config['factory'].fsm.protocol.update_rib_out_ipv4(msg):
+def save_send_ipv4_policies(msg, peer_ip=None):
+    # the RIBs are only changed by the reactor
+    protocol = get_peering(peer_ip).fsm.protocol
+    if threads.blockingCallFromThread(reactor, protocol.update_rib_out_ipv4, msg):
         return {
             'status': True
         }
@@ -260,15 +410,40 @@ def save_send_ipv4_policies(msg):
         }
 
 
-def get_adj_rib_in(prefix_list, afi_safi):
+def save_sent_updates(msg_list, peer_ip=None):
+    """
+    Save many update messages in Adj-RIB-Out and the send versions with
+    one call to the reactor, before sending them.
+    """
+    protocol = get_peering(peer_ip).fsm.protocol
+    if threads.blockingCallFromThread(reactor, protocol.save_sent_updates, msg_list):
+        return {
+            'status': True
+        }
+    else:
+        return {
+            'status': False,
+            'code': 'failed when save these messages'
+        }
+
+
+def get_adj_rib_in(prefix_list, afi_safi, peer_ip=None):
     try:
-        if afi_safi == 'ipv4':
-            data = {
-                prefix: cfg.CONF.bgp.running_config['factory'].fsm.protocol.ip_longest_match(prefix)
-                for prefix in prefix_list
+        snapshot = get_peering(peer_ip).fsm.protocol.rib_snapshot
+        rib = snapshot.adj_rib_in.get(afi_safi)
+        if rib is None:
+            return {
+                'status': False,
+                'code': 'address family %s has no adj rib in' % afi_safi
             }
+        if all(isinstance(prefix, str) for prefix in prefix_list):
+            data = {prefix: rib.lookup(prefix) for prefix in prefix_list}
+        else:
+            # NLRI objects like flowspec and evpn, results are in request order
+            data = [rib.lookup(nlri) for nlri in prefix_list]
         return {
             'status': True,
+            'version': snapshot.version,
             'data': data
         }
     except Exception as e:
@@ -279,15 +454,28 @@ def get_adj_rib_in(prefix_list, afi_safi):
         }
 
 
-def get_adj_rib_out(prefix_list, afi_safi):
+def batch_longest_match(addresses, afi_safi=None, attr=False, peer_ip=None):
+    try:
+        result = get_peering(peer_ip).fsm.protocol.batch_longest_match(addresses, afi_safi, attr)
+        result['status'] = True
+        return result
+    except Exception as e:
+        LOG.error(e)
+        return {
+            'status': False,
+            'code': e.__str__()
+        }
+
+
+def get_adj_rib_out(prefix_list, afi_safi, peer_ip=None):
     try:
         if afi_safi == 'ipv4':
-            data = {
-                prefix: cfg.CONF.bgp.running_config['factory'].fsm.protocol.adj_rib_out['ipv4'].get(prefix)
-                for prefix in prefix_list
-            }
+            snapshot = get_peering(peer_ip).fsm.protocol.rib_snapshot
+            rib = snapshot.adj_rib_out['ipv4']
+            data = {prefix: rib.lookup(prefix).get('attr') for prefix in prefix_list}
         return {
             'status': True,
+            'version': snapshot.version,
             'data': data
         }
     except Exception as e:
@@ -298,6 +486,121 @@ def get_adj_rib_out(prefix_list, afi_safi):
         }
 
 
+# routes between two cursor lines of a RIB dump
+DUMP_CHUNK_ROUTES = 1000
+
+
+def format_rib_cursor(version, position):
+    return '%s-%s-%s-%s' % ((version, ) + tuple(position))
+
+
+def parse_rib_cursor(cursor):
+    """
+    :return: (snapshot version, (table, bucket, offset))
+    """
+    fields = [int(field) for field in cursor.split('-')]
+    if len(fields) != 4 or min(fields) < 0:
+        raise ValueError('invalid cursor %s' % cursor)
+    return fields[0], tuple(fields[1:])
+
+
+def _dump_lines(rib, version, position, limit):
+    """
+    NDJSON lines of the routes of a RIB snapshot, with a cursor line after
+    every DUMP_CHUNK_ROUTES routes and at the end.
+    """
+    count = 0
+    lines = []
+    ip_rib = isinstance(rib, IPAdjRIB)
+    for next_position, nlri, attr in rib.walk(position):
+        if limit and count >= limit:
+            break
+        if not ip_rib:
+            route = {'nlri': nlri, 'attr': attr}
+        elif isinstance(nlri, dict):
+            route = dict(nlri, attr=attr)
+        else:
+            route = {'prefix': nlri, 'attr': attr}
+        lines.append(json.dumps(route))
+        position = next_position
+        count += 1
+        if count % DUMP_CHUNK_ROUTES == 0:
+            lines.append(json.dumps({'cursor': format_rib_cursor(version, position)}))
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    else:
+        # the whole RIB is dumped
+        position = None
+    lines.append(json.dumps({
+        'cursor': format_rib_cursor(version, position) if position is not None else None,
+        'version': version,
+        'count': count
+    }))
+    yield '\n'.join(lines) + '\n'
+
+
+def gzip_chunks(chunks):
+    """
+    Compress a stream, each chunk is flushed so that the client can
+    decompress the lines received so far.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        yield compressor.compress(chunk.encode('utf-8')) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def dump_adj_rib(direction, afi_safi, peer_ip=None, cursor=None, limit=0):
+    """
+    Dump the routes of the Adj-RIB-In or Adj-RIB-Out of an address family
+    from a snapshot. The routes are not copied, so the memory used does not
+    depend on the size of the RIB.
+
+    :param direction: 'in' or 'out'
+    :param afi_safi: address family name
+    :param peer_ip: peer ip address
+    :param cursor: cursor to resume a dump from
+    :param limit: max number of routes, 0 means all
+    :return: {'status': True, 'version': <snapshot version>, 'lines': <iterator of NDJSON lines>}
+    """
+    if not cfg.CONF.bgp.rib:
+        return {
+            'status': False,
+            'code': 'rib is not enabled'
+        }
+    try:
+        version, position = parse_rib_cursor(cursor) if cursor else (None, (0, 0, 0))
+    except ValueError:
+        return {
+            'status': False,
+            'code': 'invalid cursor %s' % cursor
+        }
+    protocol = get_peering(peer_ip).fsm.protocol
+    if protocol is None:
+        return {
+            'status': False,
+            'code': 'peer %s has no RIB' % peer_ip
+        }
+    snapshot = protocol.dump_rib_snapshot(version)
+    if snapshot is None:
+        return {
+            'status': False,
+            'code': 'cursor %s expired, please restart the dump' % cursor
+        }
+    ribs = snapshot.adj_rib_in if direction == 'in' else snapshot.adj_rib_out
+    rib = ribs.get(afi_safi)
+    if rib is None:
+        return {
+            'status': False,
+            'code': 'address family %s has no adj rib %s' % (afi_safi, direction)
+        }
+    return {
+        'status': True,
+        'version': snapshot.version,
+        'lines': _dump_lines(rib, snapshot.version, position, limit)
+    }
+
+
 def update_send_version(peer_ip, attr, nlri, withdraw):
     """
     update version when send update message
@@ -307,4 +610,4 @@ def update_send_version(peer_ip, attr, nlri, withdraw):
     :param withdraw:
     :return:
     """
-    cfg.CONF.bgp.running_config['factory'].fsm.protocol.update_send_version(peer_ip, attr, nlri, withdraw)
+    get_peering(peer_ip).fsm.protocol.update_send_version(peer_ip, attr, nlri, withdraw)
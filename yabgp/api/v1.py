@@ -57,9 +57,30 @@ def root():
     return flask.jsonify(intro)
 
 
+@blueprint.route('/peers')
+@auth.login_required
+@api_utils.log_request
+def peers():
+    """
+    Get all the peers' running information.
+    """
+    return flask.jsonify(api_utils.get_peers_conf_and_state())
+
+
+@blueprint.route('/statistic')
+@auth.login_required
+@api_utils.log_request
+def statistic():
+    """
+    Get the message statistic of all the peers together.
+    """
+    return flask.jsonify(api_utils.get_msg_statistic())
+
+
 @blueprint.route('/peer/<peer_ip>/state')
 @auth.login_required
 @api_utils.log_request
+@api_utils.makesure_peer_exist
 def peer(peer_ip):
     """
     Get one peer's running information, include basic configurations and fsm state.
@@ -70,6 +91,7 @@ def peer(peer_ip):
 @blueprint.route('/peer/<peer_ip>/version/<action>')
 @auth.login_required
 @api_utils.log_request
+@api_utils.makesure_peer_exist
 def get_peer_version(peer_ip, action):
     """
     Get one peer's message statistic, include sending and receiving.
@@ -80,6 +102,7 @@ def get_peer_version(peer_ip, action):
 @blueprint.route('/peer/<peer_ip>/statistic')
 @auth.login_required
 @api_utils.log_request
+@api_utils.makesure_peer_exist
 def get_peer_statistic(peer_ip):
     """
     Get one peer's message statistic, include sending and receiving.
@@ -111,20 +134,13 @@ def send_route_refresh(peer_ip):
     })
 
 
-@blueprint.route('/peer/<peer_ip>/send/update', methods=['POST'])
-@auth.login_required
-@api_utils.log_request
-@api_utils.makesure_peer_establish
-def send_update_message(peer_ip):
+def _json_to_attr(peer_ip, attr):
     """
-    Try to send BGP update message to the peer.
-    Both update nlri and withdraw nlri treated as Update.
+    convert the path attributes of an update message posted in json
+    :param peer_ip: peer ip address
+    :param attr: attributes with string type codes
+    :return: (attributes, error response or None)
     """
-    LOG.debug('Try to send update message to peer %s', peer_ip)
-    json_request = flask.request.get_json()
-    attr = json_request.get('attr') or {}
-    nlri = json_request.get('nlri') or []
-    withdraw = json_request.get('withdraw') or []
     if attr:
         attr = {int(k): v for k, v in attr.items()}
         res = api_utils.get_peer_conf_and_state(peer_ip)
@@ -149,17 +165,17 @@ def send_update_message(peer_ip):
                                 if res['peer']['capability']['remote']:
                                     four_bytes_as = res['peer']['capability']['remote']['four_bytes_as']
                                 else:
-                                    return flask.jsonify({
+                                    return None, {
                                         'status': False,
                                         'code': 'please check peer state'
-                                    })
+                                    }
                                 if int(nums[0].strip()) > 65535 and four_bytes_as:
                                     ext_community.append([514, vau.strip()])
                                 elif not four_bytes_as and int(nums[0].strip()) > 65535:
-                                    return flask.jsonify({
+                                    return None, {
                                         'status': False,
                                         'code': 'peer not support as num of greater than 65535'
-                                    })
+                                    }
                 elif key.strip().lower() == 'dmzlink-bw':
                     values = value.strip().split(',')
                     for vau in values:
@@ -173,18 +189,18 @@ def send_update_message(peer_ip):
                             if res['peer']['capability']['remote']:
                                 four_bytes_as = res['peer']['capability']['remote']['four_bytes_as']
                             else:
-                                return flask.jsonify({
+                                return None, {
                                     'status': False,
                                     'code': 'please check peer state'
-                                })
+                                }
                             nums = vau.strip().split(':', 1)
                             if int(nums[0].strip()) > 65535 and four_bytes_as:
                                 ext_community.append([515, vau.strip()])
                             elif not four_bytes_as and int(nums[0].strip()) > 65535:
-                                return flask.jsonify({
+                                return None, {
                                     'status': False,
                                     'code': 'peer not support as num of greater than 65535'
-                                })
+                                }
                             else:
                                 ext_community.append([3, vau.strip()])
                 elif key.strip().lower() == 'redirect-nexthop':
@@ -216,18 +232,39 @@ def send_update_message(peer_ip):
                             else:
                                 ext_community.append([key_num, vau.strip()])
                     else:
-                        return flask.jsonify({
+                        return None, {
                             'status': False,
                             'code': 'unexpected extended community "%s", please check your post data' % key
-                        })
+                        }
             attr[16] = ext_community
+    return attr, None
+
+
+@blueprint.route('/peer/<peer_ip>/send/update', methods=['POST'])
+@auth.login_required
+@api_utils.log_request
+@api_utils.makesure_peer_establish
+@api_utils.wait_peer_writable
+def send_update_message(peer_ip):
+    """
+    Try to send BGP update message to the peer.
+    Both update nlri and withdraw nlri treated as Update.
+    """
+    LOG.debug('Try to send update message to peer %s', peer_ip)
+    json_request = flask.request.get_json()
+    attr, error = _json_to_attr(peer_ip, json_request.get('attr') or {})
+    if error:
+        return flask.jsonify(error)
+    nlri = json_request.get('nlri') or []
+    withdraw = json_request.get('withdraw') or []
     if cfg.CONF.bgp.rib:
         result = api_utils.save_send_ipv4_policies(
             msg={
                 'attr': attr,
                 'nlri': nlri,
                 'withdraw': withdraw
-            }
+            },
+            peer_ip=peer_ip
         )
         if not result.get('status'):
             return flask.jsonify(result)
@@ -245,9 +282,55 @@ def send_update_message(peer_ip):
         })
 
 
+@blueprint.route('/peer/<peer_ip>/send/updates', methods=['POST'])
+@auth.login_required
+@api_utils.log_request
+@api_utils.makesure_peer_establish
+@api_utils.wait_peer_writable
+def send_updates_message(peer_ip):
+    """
+    Send many routes to the peer at once, the routes with the same
+    attributes are packed in as few update messages as possible.
+    """
+    LOG.debug('Try to send bulk update messages to peer %s', peer_ip)
+    updates = (flask.request.get_json() or {}).get('updates')
+    if not isinstance(updates, list):
+        return flask.jsonify({
+            'status': False,
+            'code': 'please check your post data'
+        })
+    msg_list = []
+    for update in updates:
+        if not isinstance(update, dict):
+            return flask.jsonify({
+                'status': False,
+                'code': 'please check your post data'
+            })
+        attr, error = _json_to_attr(peer_ip, update.get('attr') or {})
+        if error:
+            return flask.jsonify(error)
+        msg = {
+            'attr': attr,
+            'nlri': update.get('nlri') or [],
+            'withdraw': update.get('withdraw') or []
+        }
+        if not ((attr and msg['nlri']) or msg['withdraw'] or 14 in attr or 15 in attr):
+            return flask.jsonify({
+                'status': False,
+                'code': 'please check your post data'
+            })
+        msg_list.append(msg)
+    # nothing is saved before all the updates are checked
+    result = api_utils.save_sent_updates(msg_list, peer_ip=peer_ip)
+    if not result.get('status'):
+        return flask.jsonify(result)
+    return flask.jsonify(api_utils.send_updates(peer_ip, msg_list))
+
+
 @blueprint.route('/peer/<peer_ip>/manual-start')
 @auth.login_required
 @api_utils.log_request
+@api_utils.makesure_peer_exist
 def manual_start(peer_ip):
     """
     Try to manual start BGP session
@@ -259,6 +342,7 @@ def manual_start(peer_ip):
 @blueprint.route('/peer/<peer_ip>/manual-stop')
 @auth.login_required
 @api_utils.log_request
+@api_utils.makesure_peer_exist
 def manual_stop(peer_ip):
     """
     Try to manual stop BGP session
@@ -275,7 +359,21 @@ def search_adj_rib_in(peer_ip):
     json_request = flask.request.get_json()
     prefix_list = json_request.get('data')
     afi_safi = dict(request.args.items()).get('afi_safi') or 'ipv4'
-    return flask.jsonify(api_utils.get_adj_rib_in(prefix_list, afi_safi))
+    return flask.jsonify(api_utils.get_adj_rib_in(prefix_list, afi_safi, peer_ip))
+
+
+@blueprint.route('/peer/<peer_ip>/adj-rib-in/lpm', methods=['POST'])
+@auth.login_required
+@api_utils.log_request
+@api_utils.makesure_peer_establish
+def batch_longest_match(peer_ip):
+    """
+    Longest match of many IP addresses in Adj-RIB-In
+    """
+    json_request = flask.request.get_json()
+    addresses = json_request.get('data') or []
+    afi_safi = dict(request.args.items()).get('afi_safi')
+    return flask.jsonify(api_utils.batch_longest_match(addresses, afi_safi, bool(json_request.get('attr')), peer_ip))
 
 
 @blueprint.route('/peer/<peer_ip>/adj-rib-out', methods=['POST'])
@@ -286,7 +384,51 @@ def search_adj_rib_out(peer_ip):
     json_request = flask.request.get_json()
     prefix_list = json_request.get('data')
     afi_safi = dict(request.args.items()).get('afi_safi') or 'ipv4'
-    return flask.jsonify(api_utils.get_adj_rib_out(prefix_list, afi_safi))
+    return flask.jsonify(api_utils.get_adj_rib_out(prefix_list, afi_safi, peer_ip))
+
+
+def _dump_adj_rib(peer_ip, direction, afi_safi):
+    try:
+        limit = int(request.args.get('limit') or 0)
+    except ValueError:
+        limit = -1
+    if limit < 0:
+        return flask.jsonify({
+            'status': False,
+            'code': 'invalid limit %s' % request.args.get('limit')
+        })
+    result = api_utils.dump_adj_rib(direction, afi_safi, peer_ip, request.args.get('cursor'), limit)
+    if not result['status']:
+        return flask.jsonify(result)
+    chunks = result['lines']
+    headers = {'X-RIB-Version': str(result['version'])}
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        chunks = api_utils.gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    # no content length, the response is sent with chunked transfer encoding
+    return flask.Response(chunks, mimetype='application/x-ndjson', headers=headers)
+
+
+@blueprint.route('/peer/<peer_ip>/adj-rib-in/<afi_safi>')
+@auth.login_required
+@api_utils.log_request
+@api_utils.makesure_peer_exist
+def dump_adj_rib_in(peer_ip, afi_safi):
+    """
+    Stream all the routes of the Adj-RIB-In of an address family as NDJSON
+    """
+    return _dump_adj_rib(peer_ip, 'in', afi_safi)
+
+
+@blueprint.route('/peer/<peer_ip>/adj-rib-out/<afi_safi>')
+@auth.login_required
+@api_utils.log_request
+@api_utils.makesure_peer_exist
+def dump_adj_rib_out(peer_ip, afi_safi):
+    """
+    Stream all the routes of the Adj-RIB-Out of an address family as NDJSON
+    """
+    return _dump_adj_rib(peer_ip, 'out', afi_safi)
 
 
 @blueprint.route('/peer/<peer_ip>/json_to_bin', methods=['POST'])
@@ -426,6 +568,7 @@ def json_to_bin(peer_ip):
 @auth.login_required
 @api_utils.log_request
 @api_utils.makesure_peer_establish
+@api_utils.wait_peer_writable
 def send_bin_update(peer_ip):
     format = flask.request.args.get('format') or None
     json_request = flask.request.get_json()
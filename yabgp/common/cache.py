@@ -0,0 +1,116 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+""" Bounded LRU cache with statistic """
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Least recently used cache with a max number of entries, it counts
+    hits, misses and evictions.
+    """
+
+    def __init__(self, max_size):
+        """
+        :param max_size: max number of entries, 0 means cache nothing
+        """
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """
+        Get a value and mark it as the most recently used one.
+
+        :param key: cache key
+        :param default: returned when the key is not cached
+        """
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """
+        Add a value, the least recently used entry is evicted when the
+        cache is full.
+
+        :param key: cache key
+        :param value: cache value
+        """
+        if self.max_size <= 0:
+            return
+        if key in self._data:
+            self._data.pop(key)
+        elif len(self._data) >= self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+        self._data[key] = value
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def stats(self):
+        """
+        :return: cache statistic dictionary
+        """
+        return {
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+
+class LockedLRUCache(LRUCache):
+    """
+    LRU cache which can be used from several threads.
+    """
+
+    def __init__(self, max_size):
+        super(LockedLRUCache, self).__init__(max_size)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            return super(LockedLRUCache, self).get(key, default)
+
+    def put(self, key, value):
+        with self._lock:
+            super(LockedLRUCache, self).put(key, value)
+
+    def clear(self):
+        with self._lock:
+            super(LockedLRUCache, self).clear()
+
+    def stats(self):
+        with self._lock:
+            return super(LockedLRUCache, self).stats()
@@ -0,0 +1,149 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+""" MRT (RFC 6396) BGP4MP records """
+
+import os
+import socket
+import struct
+
+# MRT types
+MRT_BGP4MP = 16
+MRT_BGP4MP_ET = 17
+
+# BGP4MP subtypes
+BGP4MP_STATE_CHANGE = 0
+BGP4MP_MESSAGE = 1
+BGP4MP_MESSAGE_AS4 = 4
+BGP4MP_STATE_CHANGE_AS4 = 5
+BGP4MP_MESSAGE_LOCAL = 6
+BGP4MP_MESSAGE_AS4_LOCAL = 7
+
+AFI_IPV4 = 1
+AFI_IPV6 = 2
+
+# timestamp, type, subtype, length
+HEADER = struct.Struct('!IHHI')
+HEADER_LEN = HEADER.size
+MICROSECOND = struct.Struct('!I')
+# peer AS, local AS, interface index, AFI
+BGP4MP_AS4 = struct.Struct('!IIHH')
+
+
+def _peer_header(peer_as, local_as, peer_ip, local_ip):
+    if ':' in peer_ip:
+        afi, family = AFI_IPV6, socket.AF_INET6
+    else:
+        afi, family = AFI_IPV4, socket.AF_INET
+    if not local_ip:
+        local_ip = '::' if afi == AFI_IPV6 else '0.0.0.0'
+    return BGP4MP_AS4.pack(peer_as, local_as, 0, afi) + \
+        socket.inet_pton(family, peer_ip) + socket.inet_pton(family, local_ip)
+
+
+def pack_record(timestamp, subtype, body):
+    """
+    Pack one BGP4MP_ET record with microsecond timestamp.
+
+    :param timestamp: float timestamp
+    :param subtype: BGP4MP subtype
+    :param body: record body after the MRT header
+    """
+    seconds = int(timestamp)
+    return HEADER.pack(seconds, MRT_BGP4MP_ET, subtype, len(body) + MICROSECOND.size) + \
+        MICROSECOND.pack(int((timestamp - seconds) * 1000000)) + body
+
+
+def pack_message(timestamp, peer_as, local_as, peer_ip, local_ip, data, local=False):
+    """
+    Pack a BGP4MP_MESSAGE_AS4 record, or BGP4MP_MESSAGE_AS4_LOCAL for
+    messages sent by us.
+
+    :param data: full BGP message with the header
+    """
+    subtype = BGP4MP_MESSAGE_AS4_LOCAL if local else BGP4MP_MESSAGE_AS4
+    return pack_record(timestamp, subtype, _peer_header(peer_as, local_as, peer_ip, local_ip) + data)
+
+
+def pack_state_change(timestamp, peer_as, local_as, peer_ip, local_ip, old_state, new_state):
+    """
+    Pack a BGP4MP_STATE_CHANGE_AS4 record, the states are the FSM states
+    in `yabgp.common.constants` (ST_IDLE ... ST_ESTABLISHED).
+    """
+    return pack_record(
+        timestamp, BGP4MP_STATE_CHANGE_AS4,
+        _peer_header(peer_as, local_as, peer_ip, local_ip) + struct.pack('!HH', old_state, new_state))
+
+
+def read_records(fh):
+    """
+    Read MRT records from a binary file.
+
+    :param fh: file object opened in binary mode
+    :return: iterator of (timestamp, type, subtype, body), the microsecond
+        timestamp of _ET types is added to timestamp and removed from body,
+        an incomplete record at the end of the file is ignored
+    """
+    while True:
+        header = fh.read(HEADER_LEN)
+        if len(header) < HEADER_LEN:
+            return
+        seconds, mrt_type, subtype, length = HEADER.unpack(header)
+        body = fh.read(length)
+        if len(body) < length:
+            return
+        timestamp = float(seconds)
+        if mrt_type == MRT_BGP4MP_ET:
+            timestamp += MICROSECOND.unpack_from(body)[0] / 1000000.0
+            body = body[MICROSECOND.size:]
+        yield timestamp, mrt_type, subtype, body
+
+
+def count_records(fh):
+    """
+    Count the complete MRT records in a binary file, only the headers are read.
+
+    :param fh: file object opened in binary mode
+    :return: (number of records, length of the complete records)
+    """
+    count = 0
+    size = os.fstat(fh.fileno()).st_size
+    position = end = fh.tell()
+    while position + HEADER_LEN <= size:
+        fh.seek(position)
+        position += HEADER_LEN + HEADER.unpack(fh.read(HEADER_LEN))[3]
+        if position > size:
+            break
+        end = position
+        count += 1
+    return count, end
+
+
+def parse_message(subtype, body):
+    """
+    Split the body of a BGP4MP message record.
+
+    :return: (peer_as, local_as, peer_ip, local_ip, BGP message bytes)
+    """
+    if subtype in (BGP4MP_MESSAGE_AS4, BGP4MP_MESSAGE_AS4_LOCAL):
+        peer_as, local_as, _, afi = BGP4MP_AS4.unpack_from(body)
+        offset = BGP4MP_AS4.size
+    else:
+        peer_as, local_as, _, afi = struct.unpack_from('!HHHH', body)
+        offset = 8
+    family, size = (socket.AF_INET6, 16) if afi == AFI_IPV6 else (socket.AF_INET, 4)
+    peer_ip = socket.inet_ntop(family, body[offset:offset + size])
+    local_ip = socket.inet_ntop(family, body[offset + size:offset + 2 * size])
+    return peer_as, local_as, peer_ip, local_ip, body[offset + 2 * size:]
@@ -0,0 +1,180 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+""" Compressed message files
+
+A compressed message file <name>.gz or <name>.zst is a list of independent
+gzip members or zstd frames, one for the records between two entries of the
+message file index. The index of the compressed file has the same sequence
+numbers with the offsets of the compressed blocks, so reading can start at
+any indexed record without decompressing the blocks before it.
+"""
+
+import gzip
+import io
+import os
+
+import simplejson as json
+
+from yabgp.common import mrt
+from yabgp.common import msgindex
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESS_NONE = 'none'
+COMPRESS_GZIP = 'gzip'
+COMPRESS_ZSTD = 'zstd'
+
+SUFFIXES = {
+    COMPRESS_GZIP: '.gz',
+    COMPRESS_ZSTD: '.zst'
+}
+
+TMP_SUFFIX = '.tmp'
+
+
+def compress_method(file_name):
+    """
+    :return: compression method of a file found from its name
+    """
+    for method, suffix in SUFFIXES.items():
+        if file_name.endswith(suffix):
+            return method
+    return COMPRESS_NONE
+
+
+def base_name(file_name):
+    """
+    :return: file name without the compression suffix
+    """
+    method = compress_method(file_name)
+    if method == COMPRESS_NONE:
+        return file_name
+    return file_name[:-len(SUFFIXES[method])]
+
+
+def is_mrt(file_name):
+    return base_name(file_name).endswith('.mrt')
+
+
+def _compressor(method, level):
+    if method == COMPRESS_ZSTD:
+        if zstandard is None:
+            raise ImportError('zstd compression needs the zstandard package')
+        return zstandard.ZstdCompressor(level=level).compress
+    return lambda data: gzip.compress(data, compresslevel=level)
+
+
+def compress_file(file_name, method=COMPRESS_GZIP, level=6):
+    """
+    Compress a message file which is not written anymore, the file and its
+    index are replaced by <file name>.gz (or .zst) and its index.
+
+    :param file_name: message file path
+    :param method: 'gzip' or 'zstd'
+    :param level: compression level
+    :return: path of the compressed file
+    """
+    compress = _compressor(method, level)
+    new_name = file_name + SUFFIXES[method]
+    size = os.path.getsize(file_name)
+    entries = [(seq, offset) for seq, offset in msgindex.read_index(file_name) if offset < size]
+    # block boundaries, the records before the first indexed one are not indexed
+    starts = [offset for seq, offset in entries]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    new_entries = []
+    seqs = dict((offset, seq) for seq, offset in entries)
+    with open(file_name, 'rb') as src, open(new_name + TMP_SUFFIX, 'wb') as dst:
+        for start, end in zip(starts, starts[1:] + [size]):
+            if start in seqs:
+                new_entries.append(msgindex.ENTRY.pack(seqs[start], dst.tell()))
+            dst.write(compress(src.read(end - start)))
+        dst.flush()
+        os.fsync(dst.fileno())
+    index_name = msgindex.index_file_name(new_name)
+    if new_entries:
+        if not os.path.exists(os.path.dirname(index_name)):
+            os.makedirs(os.path.dirname(index_name))
+        with open(index_name + TMP_SUFFIX, 'wb') as fh:
+            fh.write(b''.join(new_entries))
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.rename(index_name + TMP_SUFFIX, index_name)
+    os.rename(new_name + TMP_SUFFIX, new_name)
+    os.remove(file_name)
+    if os.path.exists(msgindex.index_file_name(file_name)):
+        os.remove(msgindex.index_file_name(file_name))
+    return new_name
+
+
+def open_file(file_name, offset=0):
+    """
+    Open a message file for reading, compressed or not.
+
+    :param file_name: message file path
+    :param offset: offset in the file to start from, it must be the start
+        of a compressed block for compressed files
+    :return: binary file object of the uncompressed records
+    """
+    method = compress_method(file_name)
+    fh = open(file_name, 'rb')
+    fh.seek(offset)
+    if method == COMPRESS_GZIP:
+        return gzip.GzipFile(fileobj=fh, mode='rb')
+    if method == COMPRESS_ZSTD:
+        if zstandard is None:
+            fh.close()
+            raise ImportError('zstd compression needs the zstandard package')
+        return io.BufferedReader(
+            zstandard.ZstdDecompressor().stream_reader(fh, read_across_frames=True, closefd=True))
+    return fh
+
+
+def read_records(file_name, seq=None):
+    """
+    Stream the records of a message file, compressed or not. Only the
+    records from the last indexed one before `seq` are decompressed.
+
+    :param file_name: message file path, json (.msg) or MRT (.mrt)
+    :param seq: sequence number of the first record, default is the
+        first record of the file
+    :return: iterator of the json record dicts, or of (sequence number,
+        timestamp, type, subtype, body) for MRT files
+    """
+    entry = msgindex.find_offset(msgindex.read_index(file_name), seq) if seq is not None else None
+    fh = open_file(file_name, entry[1] if entry else 0)
+    try:
+        if is_mrt(file_name):
+            msg_seq = entry[0] if entry else int(base_name(file_name).rsplit('.', 2)[1])
+            for record in mrt.read_records(fh):
+                if seq is None or msg_seq >= seq:
+                    yield (msg_seq,) + record
+                msg_seq += 1
+        else:
+            for line in fh:
+                if not line.endswith(b'\n'):
+                    # being written
+                    break
+                if not line.startswith(b'{'):
+                    continue
+                record = json.loads(line)
+                if seq is None or record['seq'] >= seq:
+                    yield record
+    finally:
+        fh.close()
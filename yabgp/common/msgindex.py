@@ -0,0 +1,143 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+""" Sequence number to byte offset index of message files
+
+The index of <msg dir>/<name> is <msg dir>/index/<name>.idx, a list of
+(sequence number, offset) entries in increasing order. The first record of
+each message file and every record whose sequence number is a multiple of
+the index interval are indexed, so a record is found by reading the index
+and at most one interval of records.
+"""
+
+import bisect
+import os
+import struct
+
+INDEX_DIR = 'index'
+INDEX_SUFFIX = '.idx'
+
+# sequence number, byte offset of the record in the message file
+ENTRY = struct.Struct('!QQ')
+
+
+def index_file_name(msg_file_name):
+    """
+    :param msg_file_name: message file path
+    :return: path of the index file
+    """
+    msg_dir, name = os.path.split(msg_file_name)
+    return os.path.join(msg_dir, INDEX_DIR, name + INDEX_SUFFIX)
+
+
+def open_index(msg_file_name):
+    """
+    Open the index of a message file for appending. The entries pointing
+    beyond the end of the message file are dropped, they were written
+    before the records reached the disk.
+
+    :param msg_file_name: message file path
+    :return: index file object opened in binary append mode
+    """
+    index_name = index_file_name(msg_file_name)
+    index_dir = os.path.dirname(index_name)
+    if not os.path.exists(index_dir):
+        os.makedirs(index_dir)
+    size = os.path.getsize(msg_file_name) if os.path.exists(msg_file_name) else 0
+    index_file = open(index_name, 'ab')
+    count = index_file.tell() // ENTRY.size
+    with open(index_name, 'rb') as fh:
+        while count:
+            fh.seek((count - 1) * ENTRY.size)
+            if ENTRY.unpack(fh.read(ENTRY.size))[1] < size:
+                break
+            count -= 1
+    if count * ENTRY.size != index_file.tell():
+        index_file.truncate(count * ENTRY.size)
+        index_file.seek(0, os.SEEK_END)
+    return index_file
+
+
+def read_index(msg_file_name):
+    """
+    Read all the entries of the index of a message file.
+
+    :param msg_file_name: message file path
+    :return: list of (sequence number, offset), empty if there is no index
+    """
+    try:
+        with open(index_file_name(msg_file_name), 'rb') as fh:
+            data = fh.read()
+    except (IOError, OSError):
+        return []
+    return [ENTRY.unpack_from(data, offset)
+            for offset in range(0, len(data) - ENTRY.size + 1, ENTRY.size)]
+
+
+def last_entry(msg_file_name):
+    """
+    Read the last entry of the index which points into the message file,
+    only the end of the index is read.
+
+    :param msg_file_name: message file path
+    :return: (sequence number, offset) or None
+    """
+    try:
+        size = os.path.getsize(msg_file_name)
+        with open(index_file_name(msg_file_name), 'rb') as fh:
+            count = os.fstat(fh.fileno()).st_size // ENTRY.size
+            while count:
+                count -= 1
+                fh.seek(count * ENTRY.size)
+                entry = ENTRY.unpack(fh.read(ENTRY.size))
+                if entry[1] < size:
+                    return entry
+    except (IOError, OSError):
+        pass
+    return None
+
+
+def find_offset(entries, seq):
+    """
+    Find where to start reading a message file for a sequence number.
+
+    :param entries: entries returned by `read_index`
+    :param seq: sequence number
+    :return: (sequence number, offset) of the last indexed record not after
+        `seq`, or None if `seq` is before all the indexed records
+    """
+    position = bisect.bisect_right(entries, (seq, float('inf')))
+    if position:
+        return entries[position - 1]
+    return None
+
+
+def seek(fh, msg_file_name, seq):
+    """
+    Move a message file object to the last indexed record not after `seq`,
+    or to the beginning of the file.
+
+    :param fh: file object of the message file
+    :param msg_file_name: message file path
+    :param seq: sequence number
+    :return: sequence number of the record at the new position, or None at
+        the beginning of the file
+    """
+    entry = find_offset(read_index(msg_file_name), seq)
+    if entry:
+        fh.seek(entry[1])
+        return entry[0]
+    fh.seek(0)
+    return None
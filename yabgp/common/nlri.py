@@ -0,0 +1,36 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+""" Hashable keys of decoded NLRI """
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+
+def nlri_key(nlri):
+    """
+    Convert a decoded NLRI (dict, list and scalar values) to a hashable key,
+    dictionary keys are compared as strings so NLRI decoded from a BGP
+    message and NLRI loaded from JSON have the same key.
+
+    :param nlri: decoded NLRI
+    """
+    if isinstance(nlri, Mapping):
+        return tuple(sorted((str(k), nlri_key(v)) for k, v in nlri.items()))
+    if isinstance(nlri, (list, tuple)):
+        return tuple(nlri_key(v) for v in nlri)
+    return nlri
@@ -15,6 +15,7 @@
 
 """ basic config """
 
+import json
 import logging
 import sys
 
@@ -53,6 +54,58 @@ BGP_CONFIG_OPTS = [
     cfg.DictOpt('running_config',
                 default={},
                 help='The running configuration for BGP'),
+    cfg.ListOpt('peers_config',
+                default=[],
+                help='The running configuration of all the BGP peers'),
+    cfg.IntOpt('attr_cache_size',
+               default=0,
+               help='The max number of parsed path attribute sets cached for each peer, '
+                    'messages with the same attributes share one parsed dictionary, 0 means no cache'),
+    cfg.IntOpt('send_attr_cache_size',
+               default=1000,
+               help='The max number of encoded path attribute sets cached for each peer, '
+                    'updates sent with the same attributes encode them once, 0 means no cache'),
+    cfg.IntOpt('rib_snapshot_interval',
+               default=1000,
+               help='The min time in milliseconds between two snapshots of the RIBs read by the API, '
+                    'the API sees the changes of the RIBs after at most this time'),
+    cfg.IntOpt('rib_dump_snapshots',
+               default=2,
+               help='The max number of RIB snapshots kept for each peer so that the RIB dumps '
+                    'can be resumed from their cursor'),
+    cfg.IntOpt('update_batch_size',
+               default=1000,
+               help='The max number of received update messages delivered to the handler in one batch'),
+    cfg.IntOpt('update_batch_time',
+               default=100,
+               help='The max time in milliseconds that a received update message waits in a batch'),
+    cfg.IntOpt('parse_workers',
+               default=0,
+               help='The number of worker processes parsing received update messages, '
+                    '0 means parsing in the main process'),
+    cfg.IntOpt('parse_queue_depth',
+               default=1000,
+               help='The max number of update messages being parsed by the worker processes for one peer'),
+    cfg.IntOpt('receive_backlog_high',
+               default=50000,
+               help='The number of received messages waiting in the handler from which '
+                    'reading from the peer is paused, 0 means never pausing'),
+    cfg.IntOpt('receive_backlog_low',
+               default=10000,
+               help='The number of received messages waiting in the handler under which '
+                    'reading from the peer is resumed'),
+    cfg.IntOpt('write_high_watermark',
+               default=16777216,
+               help='The max number of bytes of the messages waiting to be sent to one peer, '
+                    'the senders wait when it is reached, 0 means no limit'),
+    cfg.IntOpt('write_low_watermark',
+               default=4194304,
+               help='The number of bytes of the messages waiting to be sent under which '
+                    'the senders go on'),
+    cfg.IntOpt('write_block_timeout',
+               default=10,
+               help='The max time in seconds that a send API call waits for the peer, '
+                    'it returns a retry-after response after it'),
     cfg.ListOpt('ext_nexthop',
                 default=[['ipv4', 'ipv6'], ['ipv4_mcast', 'ipv6'], ['vpnv4', 'ipv6']],
                 help='The ext_nexthop for BGP')
@@ -61,6 +114,9 @@ BGP_CONFIG_OPTS = [
 CONF.register_opts(BGP_CONFIG_OPTS, group='bgp')
 
 BGP_PEER_CONFIG_OPTS = [
+    cfg.StrOpt('config_file',
+               help='The JSON file of the BGP peers, when it is set the peer items '
+                    'of the [bgp] group are the defaults of the peers in it'),
     cfg.IntOpt('remote_as',
                help='The remote BGP peer AS number'),
     cfg.IntOpt('local_as',
@@ -111,44 +167,108 @@ CONF.register_cli_opts(BGP_PEER_TIME_OPTS, group='time')
 LOG = logging.getLogger(__name__)
 
 
+def peer_running_config(peer):
+    """
+    Build the running config of one peer, the items not in `peer`
+    are those of the [bgp] group.
+
+    :param peer: dict with remote_as, remote_addr and optionally local_as,
+        local_addr, md5, afi_safi and the capability items
+    :return:
+    """
+    afi_safi = peer.get('afi_safi', CONF.bgp.afi_safi)
+    running_config = {
+        'remote_as': peer['remote_as'],
+        'remote_addr': peer['remote_addr'],
+        'local_as': peer.get('local_as', CONF.bgp.local_as),
+        'local_addr': peer.get('local_addr', CONF.bgp.local_addr),
+        'md5': peer.get('md5', CONF.bgp.md5),
+        'afi_safi': afi_safi,
+        'capability': {
+            'local': {
+                key: peer.get(key, getattr(CONF.bgp, key)) for key in [
+                    'four_bytes_as', 'route_refresh', 'cisco_route_refresh', 'enhanced_route_refresh',
+                    'graceful_restart', 'cisco_multi_session', 'add_path']
+            },
+            'remote': {}
+        }
+    }
+    if ('vpnv4' in afi_safi) or ('vpnv6' in afi_safi):
+        ext_nexthop = []
+        for each in peer.get('ext_nexthop', CONF.bgp.ext_nexthop):
+            afi_safi_str, nexthop_afi = each
+            ext_nexthop.append({
+                'afi_safi': AFI_SAFI_STR_DICT[afi_safi_str],
+                'nexthop_afi': AFI_STR_DICT[nexthop_afi]
+            })
+        running_config['capability']['local']['ext_nexthop'] = ext_nexthop
+    return running_config
+
+
+def read_peers(config_file):
+    """
+    Read the peers from a JSON file, without the defaults of [bgp].
+
+    :param config_file: file path
+    :return: list of peer dicts
+    """
+    with open(config_file) as f:
+        return json.load(f)
+
+
+def load_peers_config(config_file):
+    """
+    Load the peers from a JSON file, a list of peers in the format
+    of `peer_running_config`.
+
+    :param config_file: file path
+    :return: list of running configs
+    """
+    peers_config = []
+    addrs = set()
+    for peer in read_peers(config_file):
+        running_config = peer_running_config(peer)
+        addr = running_config['remote_addr'].lower()
+        if addr in addrs:
+            raise ValueError('peer %s is configured more than once' % addr)
+        addrs.add(addr)
+        peers_config.append(running_config)
+    return peers_config
+
+
+def get_peers_config():
+    """
+    Get the running config of all the peers, the first one is
+    `CONF.bgp.running_config`.
+    """
+    return CONF.bgp.peers_config or [CONF.bgp.running_config]
+
+
 def get_bgp_config():
     """
     Get BGP running config
     :return:
     """
+    if CONF.bgp.config_file:
+        LOG.info('Try to load BGP configuration from %s', CONF.bgp.config_file)
+        try:
+            CONF.bgp.peers_config = load_peers_config(CONF.bgp.config_file)
+        except Exception as e:
+            LOG.error('Failed to load %s: %s', CONF.bgp.config_file, e)
+            sys.exit()
+        if not CONF.bgp.peers_config:
+            LOG.error('No peer in %s', CONF.bgp.config_file)
+            sys.exit()
+        CONF.bgp.running_config = CONF.bgp.peers_config[0]
+        return
     # check bgp configuration from CLI input
     LOG.info('Try to load BGP configuration from CLI input')
     if CONF.bgp.local_as and CONF.bgp.remote_as and CONF.bgp.local_addr and CONF.bgp.remote_addr:
-        CONF.bgp.running_config = {
+        CONF.bgp.running_config = peer_running_config({
             'remote_as': CONF.bgp.remote_as,
-            'remote_addr': CONF.bgp.remote_addr,
-            'local_as': CONF.bgp.local_as,
-            'local_addr': CONF.bgp.local_addr,
-            'md5': CONF.bgp.md5,
-            'afi_safi': CONF.bgp.afi_safi,
-            'capability': {
-                'local': {
-                    'four_bytes_as': CONF.bgp.four_bytes_as,
-                    'route_refresh': CONF.bgp.route_refresh,
-                    'cisco_route_refresh': CONF.bgp.cisco_route_refresh,
-                    'enhanced_route_refresh': CONF.bgp.enhanced_route_refresh,
-                    'graceful_restart': CONF.bgp.graceful_restart,
-                    'cisco_multi_session': CONF.bgp.cisco_multi_session,
-                    'add_path': CONF.bgp.add_path
-                },
-                'remote': {}
-            }
-        }
-        if ('vpnv4' in CONF.bgp.afi_safi) or ('vpnv6' in CONF.bgp.afi_safi):
-            ext_nexthop_from_cli = CONF.bgp.ext_nexthop
-            ext_nexthop = []
-            for each in ext_nexthop_from_cli:
-                afi_safi, nexthop_afi = each
-                ext_nexthop.append({
-                    'afi_safi': AFI_SAFI_STR_DICT[afi_safi],
-                    'nexthop_afi': AFI_STR_DICT[nexthop_afi]
-                })
-            CONF.bgp.running_config['capability']['local']['ext_nexthop'] = ext_nexthop
+            'remote_addr': CONF.bgp.remote_addr
+        })
+        CONF.bgp.peers_config = [CONF.bgp.running_config]
     else:
         LOG.error('Please provide enough parameters!')
         sys.exit()
@@ -72,7 +72,7 @@ class BGPPeering(BGPFactory):
     """
 
     def __init__(self, myasn=None, myaddr=None, peerasn=None, peeraddr=None,
-                 afisafi=None, md5=None, handler=None):
+                 afisafi=None, md5=None, handler=None, running_config=None):
         """Initial a BGPPeering instance.
 
         :param myasn: local bgp as number.
@@ -82,6 +82,9 @@ class BGPPeering(BGPFactory):
         :param msgpath: the path to store bgp message file.
         :param afisafi: afi and safi
         :param md5: TCP md5 string
+        :param handler: message handler
+        :param running_config: running config of this peer, with its capabilities,
+            default is `CONF.bgp.running_config`
         """
         LOG.info('Init BGPPeering for peer %s', peeraddr)
         self.my_asn = myasn
@@ -92,6 +95,7 @@ class BGPPeering(BGPFactory):
         self.peer_asn = peerasn
         self.afi_safi = afisafi
         self.md5 = md5
+        self.running_config = CONF.bgp.running_config if running_config is None else running_config
 
         self.status = False
         self.fsm = BGPFactory.FSM(self)
@@ -36,6 +36,9 @@ class FSM(object):
     protocol = None
     state = bgp_cons.ST_IDLE
     large_hold_time = bgp_cons.LARGER_HOLD_TIME
+    # times the hold timer is restarted in a row while reading from the
+    # peer is paused, so a dead peer is still found after a longer time
+    max_paused_hold_restarts = 1
 
     def __init__(self, bgp_peering=None, protocol=None):
 
@@ -56,6 +59,7 @@ class FSM(object):
         self.hold_time = CONF.time.hold_time
 
         self.hold_timer = BGPTimer(self.hold_time_event, 'hold timer')
+        self.paused_hold_restarts = 0
         # self.keep_alive_time = self.hold_time / 3
         self.keep_alive_time = CONF.time.keep_alive_time
         self.keep_alive_timer = BGPTimer(self.keep_alive_time_event, 'keep alive timer')
@@ -189,6 +193,14 @@ class FSM(object):
                     Code is sent and the BGP connection is closed
         Status:     Mandatory
         """
+        if self.protocol is not None and self.protocol.reading_paused and \
+                self.paused_hold_restarts < self.max_paused_hold_restarts:
+            # the messages of the peer wait in the socket buffer because
+            # we stopped reading, it may not be the peer which is silent
+            LOG.info('Hold Timer expires while reading is paused, restart it')
+            self.paused_hold_restarts += 1
+            self.hold_timer.reset(self.hold_time)
+            return
         LOG.info('Hold Timer expires')
         if self.state in (bgp_cons.ST_OPENSENT, bgp_cons.ST_OPENCONFIRM, bgp_cons.ST_ESTABLISHED):
             # States OpenSent, OpenConfirm, Established, event 10
@@ -460,6 +472,7 @@ class FSM(object):
         elif self.state == bgp_cons.ST_ESTABLISHED:
             # State Established, event 26
             self.hold_timer.reset(self.hold_time)
+            self.paused_hold_restarts = 0
         elif self.state in (bgp_cons.ST_CONNECT, bgp_cons.ST_ACTIVE):
             # States Connect, Active, event 26
             self._error_close()
@@ -476,6 +489,7 @@ class FSM(object):
             # State Established, event 27
             if self.hold_time != 0:
                 self.hold_timer.reset(self.hold_time)
+                self.paused_hold_restarts = 0
 
         elif self.state in (bgp_cons.ST_ACTIVE, bgp_cons.ST_CONNECT):
             # States Active, Connect, event 27
@@ -0,0 +1,202 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+""" Longest prefix match of many IP addresses at once
+
+The prefixes of an IP Adj-RIB cut the address space in intervals matched
+by one prefix each, and an address is matched by a binary search of the
+interval starts. The index is built from the RIB snapshots of the API and
+only the intervals of the prefixes changed since the last snapshot indexed
+are built again.
+"""
+
+import bisect
+import itertools
+import socket
+import threading
+
+from yabgp.core.rib import IPV6_AFI_SAFI
+
+# address families indexed, the VPN ones are not
+LPM_AFI_SAFI = ('ipv4', 'ipv4_mcast', 'ipv6', 'ipv4_lu', 'ipv6_lu')
+
+# the prefixes at least this long are indexed in small interval lists by
+# their first bits, the shorter ones in one more list
+PARTITION_LEN = {32: 16, 128: 32}
+
+
+def build_intervals(keys, max_len):
+    """
+    Cut the address space in intervals matched by one prefix each.
+
+    :param keys: sorted packed prefixes (address << 8 | length)
+    :param max_len: address length
+    :return: (starts, matches), the interval i holds the addresses from
+        starts[i] to starts[i + 1] excluded and is matched by the packed
+        prefix matches[i], or by no prefix if it is None
+    """
+    starts = []
+    matches = []
+    # (end, key) of the prefixes holding the current address, the most specific last
+    stack = []
+    end_of_space = 1 << max_len
+    for key in itertools.chain(keys, [end_of_space << 8]):
+        ip = key >> 8
+        # the address space after the prefixes ending here
+        while stack and stack[-1][0] <= ip:
+            end = stack.pop()[0]
+            match = stack[-1][1] if stack else None
+            if starts[-1] == end:
+                matches[-1] = match
+            elif matches[-1] != match:
+                starts.append(end)
+                matches.append(match)
+        if ip == end_of_space:
+            break
+        if starts and starts[-1] == ip:
+            matches[-1] = key
+        else:
+            starts.append(ip)
+            matches.append(key)
+        stack.append((ip + (1 << (max_len - (key & 0xff))), key))
+    return starts, matches
+
+
+class LPMIndex(object):
+    """
+    Longest prefix match index of the snapshots of an IP Adj-RIB, the
+    routes with a route distinguisher are not indexed. Add-path routes
+    of the same prefix are one prefix.
+    """
+
+    def __init__(self, afi_safi):
+        self.afi_safi = afi_safi
+        if afi_safi in IPV6_AFI_SAFI:
+            self.family, self.max_len = socket.AF_INET6, 128
+        else:
+            self.family, self.max_len = socket.AF_INET, 32
+        self.partition_len = PARTITION_LEN[self.max_len]
+        self.shift = self.max_len - self.partition_len
+        # partition: sorted packed prefixes
+        self.prefixes = {}
+        # partition: (starts, matches)
+        self.intervals = {}
+        self.short_prefixes = []
+        self.short_intervals = ([], [])
+        # version and {path id: table} of the RIB snapshot indexed
+        self.rib_version = None
+        self.tables = {}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.short_prefixes) + sum(len(prefixes) for prefixes in self.prefixes.values())
+
+    def refresh(self, rib):
+        """
+        Index a snapshot of the RIB from the changes since the snapshot
+        indexed before.
+
+        :param rib: IPAdjRIB snapshot
+        """
+        if rib.version == self.rib_version:
+            return
+        tables = {path_id: table for (rd, path_id), table in rib.tables.items() if rd is None}
+        added = set()
+        removed = set()
+        path_ids = set(tables) | set(self.tables)
+        for path_id in path_ids:
+            table, old_table = tables.get(path_id), self.tables.get(path_id)
+            if old_table is None:
+                added.update([key for key, _ in table.items()])
+            elif table is None:
+                removed.update([key for key, _ in old_table.items()])
+            else:
+                table_added, table_removed = table.diff(old_table)
+                added |= table_added
+                removed |= table_removed
+        removed -= added
+        if len(path_ids) > 1:
+            # the prefix is in the RIB while one of its add-path routes is
+            removed = {key for key in removed if not any(key in table for table in tables.values())}
+        # partition: ([added prefixes], [removed prefixes]), None for the short prefixes
+        partitions = {}
+        partition_len = self.partition_len
+        shift = self.shift + 8
+        for changes, keys in ((0, added), (1, removed)):
+            for key in keys:
+                partition = key >> shift if (key & 0xff) >= partition_len else None
+                if partition not in partitions:
+                    partitions[partition] = ([], [])
+                partitions[partition][changes].append(key)
+        for partition, (partition_added, partition_removed) in partitions.items():
+            old_prefixes = self.short_prefixes if partition is None else self.prefixes.get(partition, [])
+            prefixes = set(old_prefixes)
+            prefixes.difference_update(partition_removed)
+            prefixes.update(partition_added)
+            prefixes = sorted(prefixes)
+            if prefixes == old_prefixes:
+                continue
+            if partition is None:
+                self.short_prefixes = prefixes
+                self.short_intervals = build_intervals(prefixes, self.max_len)
+            elif prefixes:
+                self.prefixes[partition] = prefixes
+                self.intervals[partition] = build_intervals(prefixes, self.max_len)
+            else:
+                del self.prefixes[partition]
+                del self.intervals[partition]
+        self.tables = tables
+        self.rib_version = rib.version
+
+    def lookup(self, addresses):
+        """
+        :param addresses: IP address strings
+        :return: the packed prefix matching each address, None if no prefix matches
+        """
+        family = self.family
+        shift = self.shift
+        intervals = self.intervals
+        short_starts, short_matches = self.short_intervals
+        inet_pton = socket.inet_pton
+        from_bytes = int.from_bytes
+        bisect_right = bisect.bisect_right
+        results = []
+        append = results.append
+        for address in addresses:
+            try:
+                ip = from_bytes(inet_pton(family, address), 'big')
+            except (OSError, TypeError):
+                raise ValueError('invalid address %s' % address)
+            partition = intervals.get(ip >> shift)
+            if partition is not None:
+                index = bisect_right(partition[0], ip)
+                if index and partition[1][index - 1] is not None:
+                    append(partition[1][index - 1])
+                    continue
+            index = bisect_right(short_starts, ip)
+            append(short_matches[index - 1] if index else None)
+        return results
+
+    def match(self, rib, addresses):
+        """
+        Refresh the index and match addresses, called by the API threads.
+
+        :param rib: IPAdjRIB snapshot
+        :param addresses: IP address strings
+        :return: the packed prefix matching each address, None if no prefix matches
+        """
+        with self.lock:
+            self.refresh(rib)
+            return self.lookup(addresses)
@@ -0,0 +1,442 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Outbound message queue of the handlers"""
+
+import logging
+import threading
+import time
+import traceback
+from collections import deque
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from twisted.internet import reactor
+
+from yabgp.common import constants as bgp_cons
+from yabgp.core.rib import route_key
+
+LOG = logging.getLogger(__name__)
+
+# priorities, the lower is sent first
+PRIORITY_NOTIFICATION = 0
+PRIORITY_WITHDRAW = 1
+PRIORITY_UPDATE = 2
+
+# upper bounds (ms) of the enqueue to send latency histogram buckets
+LATENCY_BUCKETS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+def _nlri_list(value):
+    if not value:
+        return []
+    if isinstance(value, (list, tuple)):
+        return value
+    return [value]
+
+
+def classify(item):
+    """
+    Get the priority of a queued message.
+
+    :param item: {'type': 'update' or 'notification', 'msg': message dict}
+    :return: (priority, keys of the announced routes, keys of the withdrawn routes)
+    """
+    if item['type'] == 'notification':
+        return PRIORITY_NOTIFICATION, [], []
+    msg = item['msg']
+    attr = msg.get('attr') or {}
+    mp_reach = attr.get(bgp_cons.BGPTYPE_MP_REACH_NLRI) or attr.get(str(bgp_cons.BGPTYPE_MP_REACH_NLRI)) or {}
+    mp_unreach = attr.get(bgp_cons.BGPTYPE_MP_UNREACH_NLRI) or attr.get(str(bgp_cons.BGPTYPE_MP_UNREACH_NLRI)) or {}
+    announce = [route_key(nlri) for nlri in _nlri_list(msg.get('nlri')) + _nlri_list(mp_reach.get('nlri'))]
+    withdraw = [route_key(nlri) for nlri in _nlri_list(msg.get('withdraw')) + _nlri_list(mp_unreach.get('withdraw'))]
+    if withdraw and not announce:
+        return PRIORITY_WITHDRAW, announce, withdraw
+    return PRIORITY_UPDATE, announce, withdraw
+
+
+class OutboundQueue(object):
+    """
+    Messages pushed by the handler to the established peer. Pushing a
+    message wakes the reactor, which sends the queued messages in batches
+    of `batch_size`: notifications first, then withdrawals, then the other
+    updates, each class in pushed order. A withdrawal of a route which is
+    announced by a queued update is not moved before that update.
+    It can be used from any thread, with `put` like a `queue.Queue`.
+    """
+
+    batch_size = 1000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # one deque of (enqueue time, item, announced keys) for each priority
+        self._queues = (deque(), deque(), deque())
+        # {<route key>: <number of queued updates announcing it>}
+        self._announced = {}
+        self._scheduled = False
+        self.protocol = None
+        # statistic
+        self.enqueued = 0
+        self.sent = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.total_latency = 0
+        self.max_latency = 0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def put(self, item, block=True, timeout=None):
+        """
+        Queue one message for the peer.
+
+        :param item: {'type': 'update', 'msg': update message dict} or
+            {'type': 'notification', 'msg': {'error': .., 'sub_error': .., 'data': ..}}
+        """
+        priority, announce, withdraw = classify(item)
+        with self._lock:
+            if priority == PRIORITY_WITHDRAW and any(key in self._announced for key in withdraw):
+                priority = PRIORITY_UPDATE
+            for key in announce:
+                self._announced[key] = self._announced.get(key, 0) + 1
+            self._queues[priority].append((time.time(), item, announce))
+            self.enqueued += 1
+            depth = self._qsize()
+            if depth > self.max_depth:
+                self.max_depth = depth
+        self._schedule()
+
+    def get(self, block=False, timeout=None):
+        """
+        Take the next message to send without sending it.
+
+        :raise queue.Empty: no message is queued
+        """
+        with self._lock:
+            entry = self._pop()
+        if entry is None:
+            raise queue.Empty
+        return entry[1]
+
+    def _pop(self):
+        for messages in self._queues:
+            if messages:
+                entry = messages.popleft()
+                for key in entry[2]:
+                    count = self._announced.pop(key) - 1
+                    if count:
+                        self._announced[key] = count
+                return entry
+        return None
+
+    def _qsize(self):
+        return sum(len(messages) for messages in self._queues)
+
+    def qsize(self):
+        with self._lock:
+            return self._qsize()
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def attach(self, protocol):
+        """
+        Send the messages to this protocol, called when the session is established.
+        """
+        self.protocol = protocol
+        self._schedule()
+
+    def detach(self, protocol):
+        """
+        Keep the messages until the next session, called when the connection is lost.
+        """
+        if self.protocol is protocol:
+            self.protocol = None
+
+    def _schedule(self):
+        with self._lock:
+            if self._scheduled or self.protocol is None or not self._qsize():
+                return
+            self._scheduled = True
+        reactor.callFromThread(self.drain)
+
+    def drain(self):
+        """
+        Send one batch of queued messages, called in the reactor thread.
+        """
+        with self._lock:
+            self._scheduled = False
+        protocol = self.protocol
+        if protocol is None:
+            return
+        writer = getattr(protocol, 'writer', None)
+        if writer is not None and not writer.writable():
+            # the peer reads slowly, go on when the pending messages are written
+            writer.notify_writable(self._schedule)
+            return
+        for _ in range(self.batch_size):
+            with self._lock:
+                entry = self._pop()
+            if entry is None:
+                break
+            enqueue_time, item, _ = entry
+            LOG.debug('Get %s message %s from internal queue', item['type'], item['msg'])
+            try:
+                if item['type'] == 'notification':
+                    protocol.send_notification(item['msg']['error'], item['msg']['sub_error'], item['msg']['data'])
+                elif item['type'] == 'update':
+                    if not protocol.send_update(item['msg']):
+                        self.errors += 1
+            except Exception as e:
+                self.errors += 1
+                LOG.error(e)
+                error_str = traceback.format_exc()
+                LOG.debug(error_str)
+            self.sent += 1
+            self._observe((time.time() - enqueue_time) * 1000)
+        # let the reactor do other work before the next batch
+        self._schedule()
+
+    def _observe(self, latency):
+        self.total_latency += latency
+        if latency > self.max_latency:
+            self.max_latency = latency
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                self.histogram[index] += 1
+                return
+        self.histogram[-1] += 1
+
+    def stats(self):
+        """
+        :return: queue statistic dictionary, latency is in milliseconds, the
+            histogram keys are the upper bounds of the buckets
+        """
+        histogram = dict(('%s' % bound, count) for bound, count in zip(LATENCY_BUCKETS, self.histogram))
+        histogram['inf'] = self.histogram[-1]
+        with self._lock:
+            depth = [len(messages) for messages in self._queues]
+        return {
+            'queue_depth': sum(depth),
+            'notification_depth': depth[PRIORITY_NOTIFICATION],
+            'withdraw_depth': depth[PRIORITY_WITHDRAW],
+            'update_depth': depth[PRIORITY_UPDATE],
+            'max_queue_depth': self.max_depth,
+            'enqueued': self.enqueued,
+            'sent': self.sent,
+            'errors': self.errors,
+            'avg_latency': self.total_latency / self.sent if self.sent else 0,
+            'max_latency': self.max_latency,
+            'latency_histogram': histogram
+        }
+
+
+class OutboundWriter(object):
+    """
+    Encoded messages written to the transport of a protocol. Any thread
+    can append messages, the reactor writes all the pending messages with
+    one `writeSequence` in a single callback, so a burst of messages from
+    the API threads costs one wakeup of the reactor and one write.
+
+    The writer is registered as the streaming producer of the transport.
+    While the transport is paused (its send buffer is full because the peer
+    reads slowly) the messages stay pending here. When the pending bytes
+    reach `high_watermark` the writer is busy: `wait_writable` blocks the
+    senders until they are back under `low_watermark`.
+    """
+
+    # bytes given to the transport at once when it is resumed
+    chunk_size = 65536
+
+    def __init__(self, protocol, high_watermark=0, low_watermark=0):
+        """
+        :param protocol: the protocol of the transport
+        :param high_watermark: pending bytes from which the writer is busy, 0 means never
+        :param low_watermark: pending bytes under which the writer is not busy anymore
+        """
+        self.protocol = protocol
+        self.high_watermark = high_watermark
+        self.low_watermark = min(low_watermark, high_watermark)
+        self._lock = threading.Lock()
+        self._writable = threading.Condition(self._lock)
+        self._pending = deque()
+        self._pending_bytes = 0
+        self._scheduled = False
+        self._paused = False
+        self._busy = False
+        # called in the reactor thread when the writer is not busy anymore
+        self._callbacks = []
+        # statistic
+        self.batches = 0
+        self.messages = 0
+        self.bytes = 0
+        self.max_batch = 0
+        self.max_queued_bytes = 0
+        self.pauses = 0
+        self.busy_count = 0
+
+    def write(self, data):
+        """
+        Queue encoded messages for the transport, called from any thread.
+
+        :param data: bytes of one or more encoded messages
+        """
+        with self._lock:
+            self._pending.append(data)
+            self._pending_bytes += len(data)
+            if self._pending_bytes > self.max_queued_bytes:
+                self.max_queued_bytes = self._pending_bytes
+            if self.high_watermark and not self._busy and self._pending_bytes >= self.high_watermark:
+                self._busy = True
+                self.busy_count += 1
+            if self._scheduled or self._paused:
+                return
+            self._scheduled = True
+        reactor.callFromThread(self.flush)
+
+    def flush(self):
+        """
+        Write the pending messages, called in the reactor thread. It is
+        also called before a KEEPALIVE or NOTIFICATION is written directly
+        to the transport, so it follows the messages written so far. Writing
+        stops when the transport pauses the writer, the control message
+        then goes before the messages still pending here: a KEEPALIVE must
+        not wait for a peer which reads slowly to keep the session up, and
+        the updates after a NOTIFICATION are dropped with the session.
+        """
+        with self._lock:
+            self._scheduled = False
+        transport = self.protocol.transport
+        while transport is not None and not self._paused:
+            with self._lock:
+                if not self._pending:
+                    break
+                if not self.high_watermark:
+                    batch = list(self._pending)
+                    self._pending.clear()
+                else:
+                    # in chunks, so the pending bytes fall gradually as the peer reads
+                    batch = []
+                    size = 0
+                    while self._pending and size < self.chunk_size:
+                        batch.append(self._pending.popleft())
+                        size += len(batch[-1])
+                size = sum(len(data) for data in batch)
+                self._pending_bytes -= size
+                callbacks = self._check_writable()
+            self.batches += 1
+            self.messages += len(batch)
+            self.bytes += size
+            if len(batch) > self.max_batch:
+                self.max_batch = len(batch)
+            # the transport calls pauseProducing in it if its buffer is full
+            transport.writeSequence(batch)
+            for callback in callbacks:
+                callback()
+
+    def _check_writable(self):
+        # called with the lock held
+        if self._busy and self._pending_bytes <= self.low_watermark:
+            self._busy = False
+            self._writable.notify_all()
+            callbacks, self._callbacks = self._callbacks, []
+            return callbacks
+        return []
+
+    def writable(self):
+        """
+        :return: False if the pending bytes reached the high watermark
+        """
+        return not self._busy
+
+    def wait_writable(self, timeout):
+        """
+        Wait until the writer is not busy, called from the sending threads.
+
+        :param timeout: max seconds to wait
+        :return: True if the writer is not busy
+        """
+        with self._lock:
+            if self._busy and timeout > 0:
+                self._writable.wait(timeout)
+            return not self._busy
+
+    def notify_writable(self, callback):
+        """
+        Call `callback` in the reactor thread when the writer is not busy,
+        at once if it is not busy now.
+        """
+        with self._lock:
+            if self._busy:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def pauseProducing(self):
+        """
+        Called by the transport when its send buffer is full.
+        """
+        self._paused = True
+        self.pauses += 1
+
+    def resumeProducing(self):
+        """
+        Called by the transport when its send buffer is empty.
+        """
+        self._paused = False
+        self.flush()
+
+    def stopProducing(self):
+        """
+        Called by the transport when the connection is lost.
+        """
+        self.clear()
+
+    def clear(self):
+        """
+        Drop the pending messages, called when the connection is lost.
+        """
+        with self._lock:
+            self._pending.clear()
+            self._pending_bytes = 0
+            self._paused = False
+            callbacks = self._check_writable()
+        for callback in callbacks:
+            callback()
+
+    def stats(self):
+        """
+        :return: writer statistic dictionary
+        """
+        with self._lock:
+            pending = len(self._pending)
+            queued_bytes = self._pending_bytes
+        return {
+            'pending': pending,
+            'queued_bytes': queued_bytes,
+            'max_queued_bytes': self.max_queued_bytes,
+            'high_watermark': self.high_watermark,
+            'low_watermark': self.low_watermark,
+            'paused': self._paused,
+            'pauses': self.pauses,
+            'busy': self._busy,
+            'busy_count': self.busy_count,
+            'batches': self.batches,
+            'messages': self.messages,
+            'bytes': self.bytes,
+            'avg_batch': float(self.messages) / self.batches if self.batches else 0,
+            'max_batch': self.max_batch
+        }
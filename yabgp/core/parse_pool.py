@@ -0,0 +1,90 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Worker process pool for parsing BGP Update messages"""
+
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from oslo_config import cfg
+
+from yabgp.message.update import Update
+
+LOG = logging.getLogger(__name__)
+
+CONF = cfg.CONF
+
+_POOL = None
+
+
+def parse_updates(msgs, asn4, afi_add_path):
+    """
+    Parse a batch of update messages in a worker process.
+
+    :param msgs: raw update messages without header
+    :param asn4: support 4 bytes AS or not
+    :param afi_add_path: support add-path or not in each afi/safi
+    :return: `Update.parse` results in the order of the messages
+    """
+    return [Update.parse(None, msg, asn4, afi_add_path) for msg in msgs]
+
+
+class UpdateParsePool(object):
+    """
+    Pool of worker processes parsing Update messages. The messages are
+    sent in batches, one pickled task and one result for many messages,
+    and the results are returned as futures, the caller keeps them in
+    received order.
+    """
+
+    def __init__(self, size, queue_depth):
+        """
+        :param size: number of worker processes
+        :param queue_depth: max number of messages being parsed for one peer
+        """
+        self.size = size
+        self.queue_depth = queue_depth
+        # a full queue of one peer is spread over all the workers
+        self.batch_size = max(1, queue_depth // size)
+        kwargs = {}
+        if 'forkserver' in multiprocessing.get_all_start_methods():
+            # do not fork the process which is running the reactor threads
+            kwargs['mp_context'] = multiprocessing.get_context('forkserver')
+        self.executor = ProcessPoolExecutor(max_workers=size, **kwargs)
+        LOG.info('Start update parse pool with %s workers', size)
+
+    def submit(self, msgs, asn4=False, afi_add_path=None):
+        """
+        Send a batch of messages to the workers.
+
+        :param msgs: raw update messages without header
+        :return: future of the list of `Update.parse` results
+        """
+        return self.executor.submit(parse_updates, msgs, asn4, afi_add_path)
+
+    def shutdown(self):
+        LOG.info('Stop update parse pool')
+        self.executor.shutdown(wait=False)
+
+
+def get_parse_pool():
+    """
+    Get the process wide parse pool, None if `parse_workers` is 0.
+    """
+    global _POOL
+    if _POOL is None and CONF.bgp.parse_workers > 0:
+        _POOL = UpdateParsePool(CONF.bgp.parse_workers, CONF.bgp.parse_queue_depth)
+    return _POOL
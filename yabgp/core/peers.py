@@ -0,0 +1,100 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+""" Registry of the BGP peers
+
+All the `BGPPeering` of the process run on the same reactor, each with
+its own running config, capabilities and RIBs. The API threads find the
+session of a peer by its address here.
+"""
+
+import logging
+import threading
+
+import netaddr
+
+LOG = logging.getLogger(__name__)
+
+_REGISTRY = None
+
+
+def peer_key(peer_addr):
+    """
+    Normalize a peer address, '2001:DB8::1' and '2001:db8:0::1' are the same peer.
+    """
+    try:
+        return str(netaddr.IPAddress(peer_addr))
+    except (netaddr.AddrFormatError, ValueError, TypeError):
+        return str(peer_addr).lower()
+
+
+class PeerRegistry(object):
+    """
+    BGPPeering instances by peer address, in the order they are added.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._peers = {}
+
+    def __len__(self):
+        return len(self._peers)
+
+    def __contains__(self, peer_addr):
+        return peer_key(peer_addr) in self._peers
+
+    def add(self, peering):
+        key = peer_key(peering.peer_addr)
+        with self._lock:
+            if key in self._peers:
+                raise ValueError('peer %s already exists' % key)
+            self._peers[key] = peering
+        LOG.info('Add peer %s, %s peers', key, len(self._peers))
+
+    def remove(self, peer_addr):
+        with self._lock:
+            return self._peers.pop(peer_key(peer_addr), None)
+
+    def get(self, peer_addr):
+        """
+        :return: the BGPPeering of the peer, None if unknown
+        """
+        return self._peers.get(peer_key(peer_addr))
+
+    def peers(self):
+        with self._lock:
+            return list(self._peers.values())
+
+    @property
+    def default(self):
+        """
+        The first peer, the one of `CONF.bgp.running_config`.
+        """
+        with self._lock:
+            return next(iter(self._peers.values()), None)
+
+    def clear(self):
+        with self._lock:
+            self._peers.clear()
+
+
+def get_registry():
+    """
+    Get the process wide peer registry.
+    """
+    global _REGISTRY
+    if _REGISTRY is None:
+        _REGISTRY = PeerRegistry()
+    return _REGISTRY
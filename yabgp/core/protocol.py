@@ -19,18 +19,33 @@ import logging
 import traceback
 import struct
 import time
+from collections import OrderedDict
+from collections import deque
 
 import netaddr
 from oslo_config import cfg
 from twisted.internet import protocol
 from twisted.internet import reactor
-from radix import Radix
-import copy
 
 from yabgp.common import constants as bgp_cons
+from yabgp.common.cache import LockedLRUCache
+from yabgp.common.cache import LRUCache
+from yabgp.common.nlri import nlri_key
+from yabgp.core.lpm import LPM_AFI_SAFI
+from yabgp.core.lpm import LPMIndex
+from yabgp.core.outbound import OutboundWriter
+from yabgp.core.parse_pool import get_parse_pool
+from yabgp.core.peers import get_registry
+from yabgp.core.rib import AttrTable
+from yabgp.core.rib import RIBSnapshot
+from yabgp.core.rib import attr_fingerprint
+from yabgp.core.rib import new_adj_rib
+from yabgp.core.rib import route_attr
+from yabgp.core.rib import route_key
 from yabgp.message.open import Open
 from yabgp.message.keepalive import KeepAlive
 from yabgp.message.update import Update
+from yabgp.message.update import UpdateView
 from yabgp.message.notification import Notification
 from yabgp.message.route_refresh import RouteRefresh
 from yabgp.common import exception as excep
@@ -39,10 +54,82 @@ LOG = logging.getLogger(__name__)
 
 CONF = cfg.CONF
 
+# address families with route versions, and the name prefix of their dicts
+VERSION_AFI_SAFI = {(1, 133): 'flowspec', (1, 73): 'sr_policy', (1, 128): 'mpls_vpn'}
+VERSION_DICT_PREFIX = {'flowspec': 'flowspec', 'sr_policy': 'sr', 'mpls_vpn': 'mpls_vpn'}
+
+
+def group_updates(msg_list):
+    """
+    Merge update messages for sending: the announced routes are grouped by
+    their path attributes, the withdrawn routes by address family. The
+    messages are grouped until a route of a message was already announced
+    or withdrawn by the messages before, so each route keeps its order.
+
+    :param msg_list: list of update message dictionaries
+    :return: list of update message dictionaries
+    """
+    result = []
+    # {<attributes fingerprint>: message}
+    announce = OrderedDict()
+    # {<afi_safi>: message}
+    mp_withdraw = OrderedDict()
+    withdraw = []
+    routes = set()
+
+    def flush():
+        if withdraw:
+            result.append({'attr': {}, 'nlri': [], 'withdraw': list(withdraw)})
+        result.extend(mp_withdraw.values())
+        result.extend(announce.values())
+        announce.clear()
+        mp_withdraw.clear()
+        del withdraw[:]
+        routes.clear()
+
+    for msg in msg_list:
+        attr = msg.get('attr') or {}
+        mp_reach = attr.get(bgp_cons.BGPTYPE_MP_REACH_NLRI)
+        mp_unreach = attr.get(bgp_cons.BGPTYPE_MP_UNREACH_NLRI)
+        if (mp_reach and not isinstance(mp_reach.get('nlri'), list)) or \
+                (mp_unreach and not isinstance(mp_unreach.get('withdraw'), list)) or \
+                not (msg.get('nlri') or msg.get('withdraw') or mp_reach or mp_unreach):
+            # can not be merged, like SR policy or End-of-RIB
+            flush()
+            result.append(msg)
+            continue
+        keys = [route_key(nlri) for nlri in (msg.get('nlri') or []) + (msg.get('withdraw') or []) +
+                (mp_reach or {}).get('nlri', []) + (mp_unreach or {}).get('withdraw', [])]
+        if any(key in routes for key in keys):
+            flush()
+        routes.update(keys)
+        withdraw.extend(msg.get('withdraw') or [])
+        if mp_unreach:
+            afi_safi = tuple(mp_unreach['afi_safi'])
+            if afi_safi not in mp_withdraw:
+                mp_withdraw[afi_safi] = {'attr': {bgp_cons.BGPTYPE_MP_UNREACH_NLRI: {
+                    'afi_safi': mp_unreach['afi_safi'], 'withdraw': []}}, 'nlri': [], 'withdraw': []}
+            mp_withdraw[afi_safi]['attr'][bgp_cons.BGPTYPE_MP_UNREACH_NLRI]['withdraw'].extend(mp_unreach['withdraw'])
+        if msg.get('nlri') or mp_reach:
+            fingerprint = attr_fingerprint(attr)
+            if fingerprint not in announce:
+                group_attr = dict((k, v) for k, v in attr.items() if k != bgp_cons.BGPTYPE_MP_UNREACH_NLRI)
+                if mp_reach:
+                    group_attr[bgp_cons.BGPTYPE_MP_REACH_NLRI] = dict(mp_reach, nlri=[])
+                announce[fingerprint] = {'attr': group_attr, 'nlri': [], 'withdraw': []}
+            announce[fingerprint]['nlri'].extend(msg.get('nlri') or [])
+            if mp_reach:
+                announce[fingerprint]['attr'][bgp_cons.BGPTYPE_MP_REACH_NLRI]['nlri'].extend(mp_reach['nlri'])
+    flush()
+    return result
+
 
 class BGP(protocol.Protocol):
     """Protocol class for BGP 4"""
 
+    # seconds between two checks of the handler backlog while reading is paused
+    backlog_check_interval = 0.1
+
     def __init__(self):
 
         """Create a BGP protocol.
@@ -51,13 +138,42 @@ class BGP(protocol.Protocol):
         self.peer_id = None
 
         self.disconnected = False
-        self._receive_buffer = b''
+        # received bytes are appended to a bytearray and consumed by
+        # moving a read offset, the consumed head is dropped once per
+        # TCP read instead of once per BGP message.
+        self._receive_buffer = bytearray()
+        self._receive_offset = 0
+        # update messages being parsed by the worker processes, the
+        # messages of one read are sent as one batch
+        self.parse_pool = get_parse_pool()
+        self._parse_queue = deque()
+        self._parse_batch = []
+        self._parse_queued = 0
+        # reasons why reading from the peer is paused, 'parse' or 'backlog'
+        self._read_paused = set()
+        self._backlog_check = None
+        self.read_pauses = 0
+        # parsed update messages waiting to be delivered to the handler
+        self._update_batch = []
+        self._update_batch_start = 0
+        # encoded messages written by the other threads
+        self.writer = OutboundWriter(self, CONF.bgp.write_high_watermark, CONF.bgp.write_low_watermark)
         self.fourbytesas = False
         self.add_path_ipv4_receive = False
         self.add_path_ipv4_send = False
-        self.adj_rib_in = {k: {} for k in CONF.bgp.afi_safi}
-        self.adj_rib_out = {k: {} for k in CONF.bgp.afi_safi}
-        self.adj_rib_in_ipv4_tree = Radix()
+        # read-only copy of the RIBs for the API threads, published by the reactor
+        self.rib_snapshot = None
+        self.rib_snapshot_version = 0
+        self._rib_publish = None
+        self._rib_published = 0
+        # snapshots of the RIB dumps, kept for the dumps to be resumed
+        self.rib_dump_snapshots = LockedLRUCache(CONF.bgp.rib_dump_snapshots)
+        self.init_rib()
+        # parsed path attributes shared by updates with the same raw attributes
+        self.attr_cache = LRUCache(CONF.bgp.attr_cache_size) if CONF.bgp.attr_cache_size > 0 else None
+        # encoded path attributes of the sent updates, used by the API threads
+        self.send_attr_cache = LockedLRUCache(CONF.bgp.send_attr_cache_size) \
+            if CONF.bgp.send_attr_cache_size > 0 else None
 
         # statistic
         self.msg_sent_stat = {
@@ -99,9 +215,66 @@ class BGP(protocol.Protocol):
         # this is due to self.factory is assigned at runtime
         return self.factory.handler
 
+    @property
+    def running_config(self):
+        """
+        running config of the peer of this session, the global one until
+        the protocol is bound to its BGPPeering
+        """
+        running_config = getattr(self.factory, 'running_config', None)
+        if isinstance(running_config, dict):
+            return running_config
+        return CONF.bgp.running_config
+
     def init_rib(self):
-        self.adj_rib_in = {k: {} for k in CONF.bgp.afi_safi}
-        self.adj_rib_out = {k: {} for k in CONF.bgp.afi_safi}
+        # the address families of the peer, names or (afi, safi) once the peering is started
+        afi_safi_list = [
+            k if isinstance(k, str) else bgp_cons.AFI_SAFI_DICT[tuple(k)]
+            for k in self.running_config.get('afi_safi', CONF.bgp.afi_safi)]
+        # path attributes are interned once for all the RIBs of this peer
+        self.rib_attr_table = AttrTable()
+        self.adj_rib_in = {k: new_adj_rib(k, self.rib_attr_table) for k in afi_safi_list}
+        self.adj_rib_out = {k: new_adj_rib(k, self.rib_attr_table) for k in afi_safi_list}
+        # built from the Adj-RIB-In snapshots at the first batch longest match
+        self.lpm_indexes = {k: LPMIndex(k) for k in afi_safi_list if k in LPM_AFI_SAFI}
+        self.publish_rib()
+
+    def publish_rib(self):
+        """
+        Publish a snapshot of the RIBs for the API threads, it replaces
+        the previous one at once.
+        """
+        if self._rib_publish is not None and self._rib_publish.active():
+            self._rib_publish.cancel()
+        self._rib_publish = None
+        self._rib_published = time.time()
+        self.rib_snapshot_version += 1
+        self.rib_snapshot = RIBSnapshot.take(
+            self.rib_attr_table, self.adj_rib_in, self.adj_rib_out, self.rib_snapshot_version)
+
+    def dump_rib_snapshot(self, version=None):
+        """
+        Get the snapshot of a RIB dump, called by the API threads. The
+        snapshot is kept for the dump to be resumed from a cursor.
+
+        :param version: snapshot version of the dump to resume, None to start a dump
+        :return: the snapshot, None if it is not kept anymore
+        """
+        snapshot = self.rib_snapshot
+        if version is not None and version != snapshot.version:
+            return self.rib_dump_snapshots.get(version)
+        self.rib_dump_snapshots.put(snapshot.version, snapshot)
+        return snapshot
+
+    def rib_changed(self):
+        """
+        Publish the changes of the RIBs, at most every rib_snapshot_interval
+        milliseconds.
+        """
+        if self._rib_publish is not None:
+            return
+        delay = self._rib_published + CONF.bgp.rib_snapshot_interval / 1000.0 - time.time()
+        self._rib_publish = reactor.callLater(max(0, delay), self.publish_rib)
 
     def connectionMade(self):
 
@@ -111,6 +284,8 @@ class BGP(protocol.Protocol):
         self.init_rib()
         # Set transport socket options
         self.transport.setTcpNoDelay(True)
+        # pause the writer when the send buffer is full
+        self.transport.registerProducer(self.writer, True)
         # set tcp option if you want
         #  self.transport.getHandle().setsockopt(socket.IPPROTO_TCP, TCP_MD5SIG, md5sig)
 
@@ -141,7 +316,16 @@ class BGP(protocol.Protocol):
         :param reason: the reason of lost connection.
         """
         LOG.debug('Called connectionLost')
+        self.handler.inter_mq.detach(self)
+        self.writer.clear()
+        if self._backlog_check is not None and self._backlog_check.active():
+            self._backlog_check.cancel()
+        self._backlog_check = None
+        self._read_paused.clear()
+        self._drop_parsed_updates()
         self.init_rib()
+        if self.attr_cache is not None:
+            self.attr_cache.clear()
         self.handler.on_connection_lost(self)
 
         # Don't do anything if we closed the connection explicitly ourselves
@@ -169,9 +353,84 @@ class BGP(protocol.Protocol):
         """
 
         # Buffer possibly incomplete data first
-        self._receive_buffer += data
+        self._receive_buffer.extend(data)
+        self._parse_received()
+
+    def _parse_received(self):
+        """
+        Parse all the complete messages in the receive buffer.
+        """
         while self.parse_buffer():
             pass
+        self._submit_parse_batch()
+        self.flush_update_batch()
+        if 'backlog' not in self._read_paused:
+            self._check_receive_backlog()
+        # Drop the parsed messages from the head of the buffer
+        if self._receive_offset:
+            del self._receive_buffer[:self._receive_offset]
+            self._receive_offset = 0
+
+    @property
+    def reading_paused(self):
+        """
+        True while reading from the peer is paused by us, the messages of
+        the peer (keepalives too) wait in the socket buffer meanwhile.
+        """
+        return bool(self._read_paused)
+
+    def _pause_reading(self, reason):
+        if not self._read_paused:
+            self.read_pauses += 1
+            self.transport.pauseProducing()
+        self._read_paused.add(reason)
+
+    def _resume_reading(self, reason):
+        self._read_paused.discard(reason)
+        if not self._read_paused and self.transport.connected:
+            self.transport.resumeProducing()
+
+    def _check_receive_backlog(self):
+        """
+        Stop reading from the peer when the handler has too many received
+        messages to process, TCP flow control then slows down the peer.
+        """
+        if not CONF.bgp.receive_backlog_high:
+            return
+        backlog = self.handler.backlog()
+        if backlog >= CONF.bgp.receive_backlog_high:
+            LOG.info('[%s]Handler backlog is %s messages, pause reading from the peer',
+                     self.factory.peer_addr, backlog)
+            self._pause_reading('backlog')
+            self._backlog_check = reactor.callLater(self.backlog_check_interval, self._poll_receive_backlog)
+
+    def _poll_receive_backlog(self):
+        """
+        Resume reading from the peer when the handler backlog is under
+        `receive_backlog_low`, called by a timer while it is paused.
+        """
+        backlog = self.handler.backlog()
+        if backlog > CONF.bgp.receive_backlog_low:
+            self._backlog_check = reactor.callLater(self.backlog_check_interval, self._poll_receive_backlog)
+            return
+        self._backlog_check = None
+        LOG.info('[%s]Handler backlog is %s messages, resume reading from the peer',
+                 self.factory.peer_addr, backlog)
+        self._resume_reading('backlog')
+        self._parse_received()
+
+    def _buffer_slice(self, start, end):
+        """
+        Copy one region of the receive buffer out as bytes.
+
+        :param start: start position relative to the read offset
+        :param end: end position relative to the read offset
+        """
+        view = memoryview(self._receive_buffer)
+        try:
+            return view[self._receive_offset + start:self._receive_offset + end].tobytes()
+        finally:
+            view.release()
 
     def parse_buffer(self):
         """
@@ -180,20 +439,21 @@ class BGP(protocol.Protocol):
         :return: True or False
         """
         buf = self._receive_buffer
+        offset = self._receive_offset
 
-        if len(buf) < bgp_cons.HDR_LEN:
+        if len(buf) - offset < bgp_cons.HDR_LEN:
             # Every BGP message is at least 19 octets. Maybe the rest
             # hasn't arrived yet.
             return False
 
         # Check whether the first 16 octets of the buffer consist of
         # the BGP marker (all bits one)
-        if buf[:16] != 16 * b'\xff':
+        if buf[offset:offset + 16] != 16 * b'\xff':
             self.fsm.header_error(bgp_cons.ERR_MSG_HDR_CONN_NOT_SYNC)
             return False
             # Parse the BGP header
         try:
-            marker, length, msg_type = struct.unpack('!16sHB', buf[:bgp_cons.HDR_LEN])
+            marker, length, msg_type = struct.unpack_from('!16sHB', buf, offset)
         except Exception as e:
             LOG.error(e)
             error_str = traceback.format_exc()
@@ -204,10 +464,21 @@ class BGP(protocol.Protocol):
         if length < bgp_cons.HDR_LEN or length > bgp_cons.MAX_LEN:
             self.fsm.header_error(bgp_cons.ERR_MSG_HDR_BAD_MSG_LEN, struct.pack('!H', length))
             # Check whether the entire message is already available
-        if len(buf) < length:
+        if len(buf) - offset < length:
             return False
-        msg = buf[bgp_cons.HDR_LEN:length]
+        if msg_type == bgp_cons.MSG_UPDATE and self.parse_pool is not None and \
+                self._parse_queued >= self.parse_pool.queue_depth:
+            # too many messages being parsed, stop reading from the
+            # peer until the parse pool catches up
+            self._pause_reading('parse')
+            return False
+        msg = self._buffer_slice(bgp_cons.HDR_LEN, length)
         t = time.time()  # the time when received that packet.
+        if self.handler.raw_msg:
+            self.handler.raw_msg_received(self, t, self._buffer_slice(0, length))
+        if msg_type != bgp_cons.MSG_UPDATE:
+            # keep the handler seeing messages in the received order
+            self.flush_update_batch()
         try:
             if msg_type == bgp_cons.MSG_OPEN:
                 try:
@@ -245,7 +516,7 @@ class BGP(protocol.Protocol):
             LOG.error(e)
             error_str = traceback.format_exc()
             LOG.debug(error_str)
-        self._receive_buffer = self._receive_buffer[length:]
+        self._receive_offset += length
         return True
 
     def closeConnection(self):
@@ -263,7 +534,108 @@ class BGP(protocol.Protocol):
         """Called when a BGP Update message was received."""
         # TODO: Need to convert `self.add_path_ipv4_receive` and `self.add_path_ipv4_send` into a unified
         #  `afi_add_path` format.
-        result = Update().parse(timestamp, msg, self.fourbytesas, afi_add_path={})
+        if self.parse_pool is not None:
+            # parse in the worker processes, the results are processed
+            # in received order by `_process_parsed_updates`
+            self._parse_batch.append((timestamp, msg))
+            self._parse_queued += 1
+            if len(self._parse_batch) >= self.parse_pool.batch_size:
+                self._submit_parse_batch()
+        else:
+            if self.handler.lazy_update:
+                view = UpdateView(timestamp, msg, self.fourbytesas, afi_add_path={})
+                if view.sub_error:
+                    # the decoded attributes of a malformed message
+                    result = view.to_dict()
+                else:
+                    result = {
+                        'attr': view.attr,
+                        'nlri': view.nlri,
+                        'withdraw': view.withdraw,
+                        'hex': msg,
+                        'sub_error': None,
+                        'err_data': None
+                    }
+            else:
+                result = Update().parse(
+                    timestamp, msg, self.fourbytesas, afi_add_path={}, attr_cache=self.attr_cache)
+            self._process_update(timestamp, result)
+
+        self.msg_recv_stat['Updates'] += 1
+        self.fsm.update_received()
+
+    def _submit_parse_batch(self):
+        """
+        Send the update messages received since the last batch to the
+        parse pool, with one callback for the whole batch.
+        """
+        if not self._parse_batch:
+            return
+        timestamps = [timestamp for timestamp, _ in self._parse_batch]
+        future = self.parse_pool.submit(
+            [msg for _, msg in self._parse_batch], self.fourbytesas, afi_add_path={})
+        self._parse_batch = []
+        self._parse_queue.append((timestamps, future))
+        future.add_done_callback(lambda f: reactor.callFromThread(self._process_parsed_updates))
+
+    def _process_parsed_updates(self):
+        """
+        Process the updates parsed by the worker processes in received order.
+        """
+        while self._parse_queue and self._parse_queue[0][1].done():
+            timestamps, future = self._parse_queue.popleft()
+            self._parse_queued -= len(timestamps)
+            try:
+                results = future.result()
+            except Exception as e:
+                LOG.error(e)
+                error_str = traceback.format_exc()
+                LOG.debug(error_str)
+                continue
+            for timestamp, result in zip(timestamps, results):
+                try:
+                    result['time'] = timestamp
+                    self._process_update(timestamp, result)
+                except Exception as e:
+                    LOG.error(e)
+                    error_str = traceback.format_exc()
+                    LOG.debug(error_str)
+        self.flush_update_batch()
+        if 'parse' in self._read_paused and self._parse_queued < self.parse_pool.queue_depth:
+            self._resume_reading('parse')
+            self._parse_received()
+
+    def _drop_parsed_updates(self):
+        """
+        Drop the updates not parsed or not processed yet when the connection
+        is lost, without waiting for the parse pool in the reactor. The RIB
+        of the session is cleared anyway, the callbacks of the batches being
+        parsed find an empty queue.
+        """
+        for timestamps, future in self._parse_queue:
+            future.cancel()
+        if self._parse_queued:
+            LOG.info('[%s] Drop %s update messages not parsed yet', self.factory.peer_addr, self._parse_queued)
+        self._parse_queue.clear()
+        self._parse_batch = []
+        self._parse_queued = 0
+
+    def _process_update(self, timestamp, result):
+        """
+        Update version, RIB and deliver a parsed update message to the handler.
+
+        :param timestamp: the time when received the message
+        :param result: `Update.parse` result
+        """
+        afi_safi = None
+        if not result['sub_error']:
+            try:
+                afi_safi = self.get_afi_safi(result)
+                self.update_receive_verion(result['attr'], result['nlri'], result['withdraw'])
+            except excep.UpdateMessageError as e:
+                # lazy attributes which failed when they were decoded
+                result['sub_error'] = e.sub_error
+                result['err_data'] = e.data
         if result['sub_error']:
             msg = {
                 'attr': result['attr'],
@@ -272,22 +644,12 @@ class BGP(protocol.Protocol):
                 'hex': repr(result['hex'])
             }
 
+            self.flush_update_batch()
             self.handler.on_update_error(self, timestamp, msg)
 
             LOG.error('[%s] Update message error: sub error=%s', self.factory.peer_addr, result['sub_error'])
-            self.msg_recv_stat['Updates'] += 1
-            self.fsm.update_received()
             return
 
-        afi_safi = None
-        # process messages
-        if result['nlri'] or result['withdraw']:
-            afi_safi = 'ipv4'
-        elif result['attr'].get(14):
-            afi_safi = bgp_cons.AFI_SAFI_DICT[result['attr'][14]['afi_safi']]
-        elif result['attr'].get(15):
-            afi_safi = bgp_cons.AFI_SAFI_DICT[result['attr'][15]['afi_safi']]
-
         msg = {
             'attr': result['attr'],
             'nlri': result['nlri'],
@@ -295,17 +657,46 @@ class BGP(protocol.Protocol):
             'afi_safi': afi_safi
         }
 
-        self.update_receive_verion(result['attr'], result['nlri'], result['withdraw'])
-
         if CONF.bgp.rib:
             # try to update bgp rib in
-            if msg.get('afi_safi') == 'ipv4':
-                self.update_rib_in_ipv4(msg)
-                # LOG.info(msg)
-        self.handler.update_received(self, timestamp, msg)
+            self.update_rib_in(msg)
+            self.rib_changed()
+        if not self._update_batch:
+            self._update_batch_start = time.time()
+        self._update_batch.append((timestamp, msg))
+        if len(self._update_batch) >= CONF.bgp.update_batch_size or \
+                (time.time() - self._update_batch_start) * 1000 >= CONF.bgp.update_batch_time:
+            self.flush_update_batch()
+
+    @staticmethod
+    def get_afi_safi(result):
+        """
+        Get the address family name of a parsed update message.
 
-        self.msg_recv_stat['Updates'] += 1
-        self.fsm.update_received()
+        :param result: `Update.parse` result
+        :return: name like 'ipv4' or None for End-of-RIB of IPv4
+        """
+        if result['nlri'] or result['withdraw']:
+            return 'ipv4'
+        elif result['attr'].get(14):
+            return bgp_cons.AFI_SAFI_DICT[result['attr'][14]['afi_safi']]
+        elif result['attr'].get(15):
+            return bgp_cons.AFI_SAFI_DICT[result['attr'][15]['afi_safi']]
+        return None
+
+    def flush_update_batch(self):
+        """
+        Deliver the batched update messages to the handler.
+        """
+        if not self._update_batch:
+            return
+        batch, self._update_batch = self._update_batch, []
+        try:
+            self.handler.update_batch_received(self, batch)
+        except Exception as e:
+            LOG.error(e)
+            error_str = traceback.format_exc()
+            LOG.debug(error_str)
 
     def send_update(self, msg):
         """
@@ -314,8 +705,8 @@ class BGP(protocol.Protocol):
         :return:
         """
         try:
-            msg_update = Update().construct(msg, self.fourbytesas, self.add_path_ipv4_send)
-            reactor.callFromThread(self.write_tcp_thread, msg_update)
+            msg_update = Update().construct(msg, self.fourbytesas, self.add_path_ipv4_send, self.send_attr_cache)
+            self.writer.write(msg_update)
             self.msg_sent_stat['Updates'] += 1
 
             return True
@@ -323,6 +714,29 @@ class BGP(protocol.Protocol):
             LOG.error(e)
             return False
 
+    def send_updates(self, msg_list):
+        """
+        send many update messages to the peer, the routes with the same path
+        attributes are packed in as few messages as possible and all the
+        messages are written at once
+        :param msg_list: list of message dictionaries
+        :return: number of update messages sent, None if failed
+        """
+        try:
+            messages = []
+            for msg in group_updates(msg_list):
+                messages.extend(Update.construct_split(
+                    msg, self.fourbytesas, self.add_path_ipv4_send, attr_cache=self.send_attr_cache))
+            if messages:
+                self.writer.write(b''.join(messages))
+            self.msg_sent_stat['Updates'] += len(messages)
+            return len(messages)
+        except Exception as e:
+            LOG.error(e)
+            error_str = traceback.format_exc()
+            LOG.debug(error_str)
+            return None
+
     def construct_update_to_bin(self, msg):
         """
         construct update message to binary
@@ -330,7 +744,7 @@ class BGP(protocol.Protocol):
         :return:
         """
         try:
-            msg_update = Update().construct(msg, self.fourbytesas, self.add_path_ipv4_send)
+            msg_update = Update().construct(msg, self.fourbytesas, self.add_path_ipv4_send, self.send_attr_cache)
             return msg_update
         except Exception as e:
             LOG.error(e)
@@ -343,15 +757,12 @@ class BGP(protocol.Protocol):
         :return:
         """
         try:
-            reactor.callFromThread(self.write_tcp_thread, msg)
+            self.writer.write(msg)
             return True
         except Exception as e:
             LOG.error(e)
             return False
 
-    def write_tcp_thread(self, msg):
-        self.transport.write(msg)
-
     def send_notification(self, error, sub_error, data=b''):
         """
         send BGP notification message
@@ -370,7 +781,9 @@ class BGP(protocol.Protocol):
         self.msg_sent_stat['Notifications'] += 1
         # construct message
         msg_notification = Notification().construct(error, sub_error, data)
-        # send message
+        # send message after the queued updates the transport accepts,
+        # not after the updates pending in the paused writer
+        self.writer.flush()
         self.transport.write(msg_notification)
 
     def _notification_received(self, msg):
@@ -405,7 +818,9 @@ class BGP(protocol.Protocol):
         # self.msg_sent_stat['Keepalives'] += 1
         # construct message
         msg_keepalive = KeepAlive().construct()
-        # send message
+        # send message after the queued updates the transport accepts,
+        # not after the updates pending in the paused writer
+        self.writer.flush()
         self.transport.write(msg_keepalive)
 
     def _keepalive_received(self, timestamp, msg):
@@ -416,19 +831,6 @@ class BGP(protocol.Protocol):
             :param msg:
             :return:
         """
-
-        # deal with all request in internal message queue
-        # until the queue is empty
-        while not self.handler.inter_mq.empty() and self.msg_recv_stat['Keepalives'] > 0:
-            inter_msg = self.handler.inter_mq.get()
-            LOG.debug('Get %s message %s from internal queue', inter_msg['type'], inter_msg['msg'])
-            if inter_msg['type'] == 'notification':
-                self.send_notification(inter_msg['msg']['error'],
-                                       inter_msg['msg']['sub_error'],
-                                       inter_msg['msg']['data'])
-            elif inter_msg['type'] == 'update':
-                self.send_update(inter_msg['msg'])
-
         self.msg_recv_stat['Keepalives'] += 1
 
         self.handler.keepalive_received(self, timestamp)
@@ -437,6 +839,10 @@ class BGP(protocol.Protocol):
         KeepAlive().parse(msg)
 
         self.fsm.keep_alive_received()
+        if self.fsm.state == bgp_cons.ST_ESTABLISHED and get_registry().default in (None, self.factory):
+            # messages in the internal queue are sent as soon as they are pushed,
+            # to the first peer when there are many
+            self.handler.inter_mq.attach(self)
 
     def capability_negotiate(self):
         """
@@ -446,13 +852,13 @@ class BGP(protocol.Protocol):
         # if received open message from remote peer firstly
         # then copy peer's capability to local according to the
         # local support. best effort support.
-        if cfg.CONF.bgp.running_config['capability']['remote']:
+        if self.running_config['capability']['remote']:
             unsupport_cap = []
-            for capability in cfg.CONF.bgp.running_config['capability']['local']:
-                if capability not in cfg.CONF.bgp.running_config['capability']['remote']:
+            for capability in self.running_config['capability']['local']:
+                if capability not in self.running_config['capability']['remote']:
                     unsupport_cap.append(capability)
             for capability in unsupport_cap:
-                cfg.CONF.bgp.running_config['capability']['local'].pop(capability)
+                self.running_config['capability']['local'].pop(capability)
 
     def send_open(self):
         """
@@ -465,14 +871,14 @@ class BGP(protocol.Protocol):
         open_msg = Open(
             version=bgp_cons.VERSION, asn=self.factory.my_asn, hold_time=self.fsm.hold_time,
             bgp_id=self.factory.bgp_id). \
-            construct(cfg.CONF.bgp.running_config['capability']['local'])
-        if 'add_path' in cfg.CONF.bgp.running_config['capability']['local']:
+            construct(self.running_config['capability']['local'])
+        if 'add_path' in self.running_config['capability']['local']:
             # check add path feature, send add path condition:
             # local support send or both
             # remote support receive or both
-            if cfg.CONF.bgp.running_config['capability']['local']['add_path'] in \
+            if self.running_config['capability']['local']['add_path'] in \
                     ['ipv4_send', 'ipv4_both']:
-                if cfg.CONF.bgp.running_config['capability']['remote'].get('add_path') in \
+                if self.running_config['capability']['remote'].get('add_path') in \
                         ['ipv4_receive', 'ipv4_both']:
                     self.add_path_ipv4_send = True
         # send message
@@ -480,16 +886,18 @@ class BGP(protocol.Protocol):
         self.msg_sent_stat['Opens'] += 1
         LOG.info("[%s]Send a BGP Open message to the peer.", self.factory.peer_addr)
         LOG.info("[%s]Probe's Capabilities:", self.factory.peer_addr)
-        for key in cfg.CONF.bgp.running_config['capability']['local']:
-            LOG.info("--%s = %s", key, cfg.CONF.bgp.running_config['capability']['local'][key])
+        for key in self.running_config['capability']['local']:
+            LOG.info("--%s = %s", key, self.running_config['capability']['local'][key])
         open_msg_dict = {
             "version": bgp_cons.VERSION,
             "asn": self.factory.my_asn,
             "hold_time": self.fsm.hold_time,
             "bgp_id": str(netaddr.IPAddress(self.factory.bgp_id)),
-            "capabilities": cfg.CONF.bgp.running_config['capability']['local']
+            "capabilities": self.running_config['capability']['local']
         }
         timestamp = time.time()
+        if self.handler.raw_msg:
+            self.handler.raw_msg_received(self, timestamp, open_msg, local=True)
         self.handler.send_open(self, timestamp, open_msg_dict)
 
     def _open_received(self, timestamp, msg):
@@ -508,24 +916,24 @@ class BGP(protocol.Protocol):
             raise excep.OpenMessageError(sub_error=bgp_cons.ERR_MSG_OPEN_BAD_PEER_AS)
 
         # Open message Capabilities negotiation
-        cfg.CONF.bgp.running_config['capability']['remote'] = open_msg.capa_dict
+        self.running_config['capability']['remote'] = open_msg.capa_dict
         LOG.info("[%s]A BGP Open message was received", self.factory.peer_addr)
         LOG.info('--version = %s', open_msg.version)
         LOG.info('--ASN = %s', open_msg.asn)
         LOG.info('--hold time = %s', open_msg.hold_time)
         LOG.info('--id = %s', open_msg.bgp_id)
         LOG.info("[%s]Neighbor's Capabilities:", self.factory.peer_addr)
-        for key in cfg.CONF.bgp.running_config['capability']['remote']:
+        for key in self.running_config['capability']['remote']:
             if key == 'four_bytes_as':
                 self.fourbytesas = True
             elif key == 'add_path':
-                if cfg.CONF.bgp.running_config['capability']['remote']['add_path'] in \
+                if self.running_config['capability']['remote']['add_path'] in \
                         ['ipv4_send', 'ipv4_both']:
-                    if cfg.CONF.bgp.running_config['capability']['local']['add_path'] in \
+                    if self.running_config['capability']['local']['add_path'] in \
                             ['ipv4_receive', 'ipv4_both']:
                         self.add_path_ipv4_receive = True
 
-            LOG.info("--%s = %s", key, cfg.CONF.bgp.running_config['capability']['remote'][key])
+            LOG.info("--%s = %s", key, self.running_config['capability']['remote'][key])
 
         self.peer_id = open_msg.bgp_id
         self.bgp_peering.set_peer_id(open_msg.bgp_id)
@@ -543,19 +951,19 @@ class BGP(protocol.Protocol):
         :param res: reserve, default is 0
         """
         # check if the peer support route refresh
-        if 'cisco_route_refresh' in cfg.CONF.bgp.running_config['capability']['remote']:
+        if 'cisco_route_refresh' in self.running_config['capability']['remote']:
             type_code = bgp_cons.MSG_CISCOROUTEREFRESH
-        elif 'route_refresh' in cfg.CONF.bgp.running_config['capability']['remote']:
+        elif 'route_refresh' in self.running_config['capability']['remote']:
             type_code = bgp_cons.MSG_ROUTEREFRESH
         else:
             return False
         # check if the peer support this address family
-        if (afi, safi) not in cfg.CONF.bgp.running_config['capability']['remote']['afi_safi']:
+        if (afi, safi) not in self.running_config['capability']['remote']['afi_safi']:
             return False
         # construct message
         msg_routerefresh = RouteRefresh(afi, safi, res).construct(type_code)
-        # send message
-        self.transport.write(msg_routerefresh)
+        # send message, it is called from the API threads
+        self.writer.write(msg_routerefresh)
         self.msg_sent_stat['RouteRefresh'] += 1
         LOG.info("[%s]Send BGP RouteRefresh message to the peer.", self.factory.peer_addr)
         return True
@@ -589,267 +997,188 @@ class BGP(protocol.Protocol):
             self.fsm.hold_time, self.fsm.keep_alive_time)
 
     def update_rib_out_ipv4(self, msg):
+        """
+        Update Adj-RIB-Out with a sent update message, called by the reactor.
+
+        :param msg: {'attr': .., 'nlri': .., 'withdraw': ..}
+        """
         try:
             for prefix in msg['withdraw']:
-                if prefix in self.adj_rib_out['ipv4']:
+                if self.adj_rib_out['ipv4'].withdraw(prefix):
                     self.send_version['ipv4'] += 1
-                    self.adj_rib_out['ipv4'].pop(prefix)
             for prefix in msg['nlri']:
-                if prefix not in self.adj_rib_out['ipv4'].keys():
+                if self.adj_rib_out['ipv4'].update(prefix, msg['attr']):
                     self.send_version['ipv4'] += 1
-                else:
-                    if msg['attr'] == self.adj_rib_out['ipv4'][prefix]:
-                        pass
-                    else:
-                        self.send_version['ipv4'] += 1
-                self.adj_rib_out['ipv4'][prefix] = msg['attr']
+            self.rib_changed()
             return True
         except Exception as e:
             LOG.error(e)
             return False
 
-    def update_rib_in_ipv4(self, msg):
+    def save_sent_updates(self, msg_list):
+        """
+        Update Adj-RIB-Out and the send versions with update messages
+        about to be sent, called by the reactor once for all of them.
+
+        All the routes are checked before Adj-RIB-Out is changed, so
+        nothing is saved if one of them is invalid.
+
+        :param msg_list: list of {'attr': .., 'nlri': .., 'withdraw': ..}
+        :return: True or False if Adj-RIB-Out could not be updated
+        """
+        if CONF.bgp.rib:
+            try:
+                for msg in msg_list:
+                    for prefix in msg['withdraw']:
+                        self.adj_rib_out['ipv4'].check(prefix)
+                    for prefix in msg['nlri']:
+                        self.adj_rib_out['ipv4'].check(prefix)
+            except Exception as e:
+                LOG.error(e)
+                return False
+            for msg in msg_list:
+                if not self.update_rib_out_ipv4(msg):
+                    return False
+        for msg in msg_list:
+            self.update_send_version(self.factory.peer_addr, msg['attr'], msg['nlri'], msg['withdraw'])
+        return True
+
+    def update_rib_in(self, msg):
+        """
+        Update Adj-RIB-In with an update message, IPv4 unicast routes come
+        from NLRI and withdrawn routes, other address families come from
+        MP_REACH_NLRI and MP_UNREACH_NLRI.
+
+        :param msg: parsed update message
+        """
         try:
-            for prefix in msg['withdraw']:
-                if prefix in self.adj_rib_in['ipv4']:
-                    self.receive_version['ipv4'] += 1
-                    self.adj_rib_in['ipv4'].pop(prefix)
-                    if self.adj_rib_in_ipv4_tree.search_exact(prefix):
-                        self.adj_rib_in_ipv4_tree.delete(prefix)
-            for prefix in msg['nlri']:
-                if prefix not in self.adj_rib_in['ipv4'].keys():
-                    self.receive_version['ipv4'] += 1
-                else:
-                    if msg['attr'] == self.adj_rib_in['ipv4'][prefix]:
-                        pass
-                    else:
+            attr = msg['attr']
+            ipv4_rib = self.adj_rib_in.get('ipv4')
+            if ipv4_rib is not None:
+                for prefix in msg['withdraw']:
+                    if ipv4_rib.withdraw(prefix):
                         self.receive_version['ipv4'] += 1
-                self.adj_rib_in['ipv4'][prefix] = msg['attr']
-                self.adj_rib_in_ipv4_tree.add(prefix)
+                for prefix in msg['nlri']:
+                    if ipv4_rib.update(prefix, attr):
+                        self.receive_version['ipv4'] += 1
+            mp_unreach = attr.get(bgp_cons.BGPTYPE_MP_UNREACH_NLRI)
+            if mp_unreach:
+                rib = self.adj_rib_in.get(bgp_cons.AFI_SAFI_DICT.get(tuple(mp_unreach['afi_safi'])))
+                if rib is not None:
+                    withdraw = mp_unreach.get('withdraw') or []
+                    for nlri in withdraw if isinstance(withdraw, list) else [withdraw]:
+                        rib.withdraw(nlri)
+            mp_reach = attr.get(bgp_cons.BGPTYPE_MP_REACH_NLRI)
+            if mp_reach:
+                rib = self.adj_rib_in.get(bgp_cons.AFI_SAFI_DICT.get(tuple(mp_reach['afi_safi'])))
+                if rib is not None:
+                    value = route_attr(attr)
+                    nlri_list = mp_reach.get('nlri') or []
+                    for nlri in nlri_list if isinstance(nlri_list, list) else [nlri_list]:
+                        rib.update(nlri, value)
             return True
         except Exception as e:
             LOG.error(e)
             LOG.debug(traceback.format_exc())
             return False
 
-    def ip_longest_match(self, prefix_ip):
-        results = {}
-        if '/' in prefix_ip:
-            if self.adj_rib_in['ipv4'].get(prefix_ip):
-                return {
-                    'prefix': prefix_ip,
-                    'attr': self.adj_rib_in['ipv4'].get(prefix_ip)
-                }
-        if prefix_ip in self.adj_rib_in_ipv4_tree:
-            prefix_node = self.adj_rib_in_ipv4_tree.search_best(prefix_ip)
-            if prefix_node:
-                if self.adj_rib_in['ipv4'].get(prefix_node.prefix):
-                    return {
-                        'prefix': prefix_node.prefix,
-                        'attr': self.adj_rib_in['ipv4'].get(prefix_node.prefix)
-                    }
-        return results
+    def ip_longest_match(self, prefix_ip, afi_safi='ipv4'):
+        """
+        Search Adj-RIB-In, prefix is exactly matched and IP address is
+        longest matched.
 
-    def update_send_version(self, peer_ip, attr, nlri, withdraw):
-        if 14 in attr:
-            if attr[14]['afi_safi'] == [1, 133]:
-                LOG.info("send flowspec")
-                for prefix in attr[14]['nlri']:
-                    value = copy.deepcopy(attr)
-                    value14 = value[14]
-                    del value14['nlri']
-                    key = "{"
-                    for k in sorted(prefix.keys()):
-                        key += '"' + k + '"'
-                        key += ':'
-                        key += '"' + str(prefix[k]) + '"'
-                        key += ','
-                    key = key[:-1]
-                    key += "}"
-                    if str(key) not in self.flowspec_send_dict:
-                        self.send_version['flowspec'] += 1
-                        self.flowspec_send_dict[str(key)] = value
-                    else:
-                        if value == self.flowspec_send_dict[str(key)]:
-                            pass
-                        else:
-                            self.send_version['flowspec'] += 1
-                            self.flowspec_send_dict[str(key)] = value
-            elif attr[14]['afi_safi'] == [1, 73]:
-                LOG.info('send sr')
-                key = "{"
-                for k in sorted(attr[14]['nlri'].keys()):
-                    key += '"' + k + '"'
-                    key += ':'
-                    key += '"' + str(attr[14]['nlri'][k]) + '"'
-                    key += ','
-                key = key[:-1]
-                key += "}"
-                if str(key) not in self.sr_send_dict:
-                    self.send_version['sr_policy'] += 1
-                    self.sr_send_dict[str(key)] = attr
-                else:
-                    if attr == self.sr_send_dict[str(key)]:
-                        pass
-                    else:
-                        self.send_version['sr_policy'] += 1
-                        self.sr_send_dict[str(key)] = attr
-            elif attr[14]['afi_safi'] == [1, 128]:
-                LOG.info("send mpls_vpn")
-                for prefix in attr[14]['nlri']:
-                    value = copy.deepcopy(attr)
-                    value14 = value[14]
-                    del value14['nlri']
-                    key = "{"
-                    for k in sorted(prefix.keys()):
-                        key += '"' + k + '"'
-                        key += ':'
-                        key += '"' + str(prefix[k]) + '"'
-                        key += ','
-                    key = key[:-1]
-                    key += "}"
-                    if str(key) not in self.mpls_vpn_send_dict:
-                        self.send_version['mpls_vpn'] += 1
-                        self.mpls_vpn_send_dict[str(key)] = value
-                    else:
-                        if value == self.mpls_vpn_send_dict[str(key)]:
-                            pass
-                        else:
-                            self.send_version['mpls_vpn'] += 1
-                            self.mpls_vpn_send_dict[str(key)] = value
-        # flowspec sr mpls_vpn withdraw
-        if 15 in attr:
-            if attr[15]['afi_safi'] == [1, 133]:
-                LOG.info("withdraw flowspec")
-                for prefix in attr[15]['withdraw']:
-                    key = "{"
-                    for k in sorted(prefix.keys()):
-                        key += '"' + k + '"'
-                        key += ':'
-                        key += '"' + str(prefix[k]) + '"'
-                        key += ','
-                    key = key[:-1]
-                    key += "}"
-                    if str(key) in self.flowspec_send_dict:
-                        self.send_version['flowspec'] += 1
-                        del self.flowspec_send_dict[str(key)]
-                    else:
-                        LOG.info("Do not have %s in send flowspec dict" % key)
-            elif attr[15]['afi_safi'] == [1, 73]:
-                LOG.info('withdraw sr')
-                key = "{"
-                for k in sorted(attr[15]['withdraw'].keys()):
-                    key += '"' + k + '"'
-                    key += ':'
-                    key += '"' + str(attr[15]['withdraw'][k]) + '"'
-                    key += ','
-                key = key[:-1]
-                key += "}"
-                if str(key) in self.sr_send_dict:
-                    self.send_version['sr_policy'] += 1
-                    del self.sr_send_dict[str(key)]
-                else:
-                    LOG.info("Do not have %s in send flowspec dict" % key)
-            elif attr[15]['afi_safi'] == [1, 128]:
-                LOG.info("withdraw mpls_vpn")
-                for prefix in attr[15]['withdraw']:
-                    key = "{"
-                    for k in sorted(prefix.keys()):
-                        key += '"' + k + '"'
-                        key += ':'
-                        key += '"' + str(prefix[k]) + '"'
-                        key += ','
-                    key = key[:-1]
-                    key += "}"
-                    if str(key) in self.mpls_vpn_send_dict:
-                        self.send_version['mpls_vpn'] += 1
-                        del self.mpls_vpn_send_dict[str(key)]
+        :param prefix_ip: prefix or IP address
+        :param afi_safi: address family name
+        """
+        rib = self.adj_rib_in.get(afi_safi)
+        if rib is None:
+            return {}
+        return rib.lookup(prefix_ip)
+
+    def batch_longest_match(self, addresses, afi_safi=None, attr=False):
+        """
+        Longest match of many IP addresses in the Adj-RIB-In snapshot,
+        called by the API threads.
+
+        :param addresses: IP address strings
+        :param afi_safi: address family name, by default the IPv4 addresses
+            are matched in 'ipv4' and the IPv6 addresses in 'ipv6'
+        :param attr: return the path attributes of the matched prefixes
+        :return: {'version': <snapshot version>, 'prefixes': <matched prefixes>,
+            'data': <index in prefixes of the prefix matching each address, -1 if none>}
+        """
+        snapshot = self.rib_snapshot
+        if afi_safi:
+            if afi_safi not in self.lpm_indexes:
+                raise ValueError('address family %s has no longest match index' % afi_safi)
+            groups = {afi_safi: list(range(len(addresses)))}
+        else:
+            groups = {'ipv4': [], 'ipv6': []}
+            for position, address in enumerate(addresses):
+                groups['ipv6' if ':' in address else 'ipv4'].append(position)
+        data = [-1] * len(addresses)
+        prefixes = []
+        attrs = []
+        for group_afi_safi, positions in groups.items():
+            index = self.lpm_indexes.get(group_afi_safi)
+            if not positions or index is None:
+                continue
+            rib = snapshot.adj_rib_in[group_afi_safi]
+            ids = {}
+            for position, key in zip(positions, index.match(rib, [addresses[i] for i in positions])):
+                if key is None:
+                    continue
+                prefix_id = ids.get(key)
+                if prefix_id is None:
+                    prefix_id = ids[key] = len(prefixes)
+                    prefixes.append(rib.unpack(key))
+                    if attr:
+                        attrs.append(rib.lookup(prefixes[-1]).get('attr'))
+                data[position] = prefix_id
+        result = {'version': snapshot.version, 'prefixes': prefixes, 'data': data}
+        if attr:
+            result['attr'] = attrs
+        return result
+
+    def _update_version(self, direction, attr):
+        """
+        Track flowspec, SR policy and MPLS VPN routes of an update message
+        in the send or receive dict of the address family. The dicts map
+        the canonical NLRI key to the path attribute fingerprint, and the
+        version is increased when a route is added, changed or withdrawn.
+
+        :param direction: 'send' or 'receive'
+        :param attr: path attributes with MP_REACH_NLRI or MP_UNREACH_NLRI
+        """
+        version = getattr(self, '%s_version' % direction)
+        mp_reach = attr.get(bgp_cons.BGPTYPE_MP_REACH_NLRI)
+        if mp_reach:
+            family = VERSION_AFI_SAFI.get(tuple(mp_reach['afi_safi']))
+            if family:
+                LOG.debug('%s %s update', direction, family)
+                store = getattr(self, '%s_%s_dict' % (VERSION_DICT_PREFIX[family], direction))
+                fingerprint = attr_fingerprint(attr)
+                nlri_list = mp_reach['nlri']
+                for nlri in nlri_list if isinstance(nlri_list, list) else [nlri_list]:
+                    key = nlri_key(nlri)
+                    if store.get(key) != fingerprint:
+                        version[family] += 1
+                        store[key] = fingerprint
+        mp_unreach = attr.get(bgp_cons.BGPTYPE_MP_UNREACH_NLRI)
+        if mp_unreach:
+            family = VERSION_AFI_SAFI.get(tuple(mp_unreach['afi_safi']))
+            if family:
+                LOG.debug('%s %s withdraw', direction, family)
+                store = getattr(self, '%s_%s_dict' % (VERSION_DICT_PREFIX[family], direction))
+                withdraw_list = mp_unreach['withdraw']
+                for nlri in withdraw_list if isinstance(withdraw_list, list) else [withdraw_list]:
+                    if store.pop(nlri_key(nlri), None) is not None:
+                        version[family] += 1
                     else:
-                        LOG.info("Do not have %s in send flowspec dict" % key)
+                        LOG.info("Do not have %s in %s %s dict", nlri, direction, family)
+
+    def update_send_version(self, peer_ip, attr, nlri, withdraw):
+        self._update_version('send', attr)
 
     def update_receive_verion(self, attr, nlri, withdraw):
-        if 14 in attr:
-            if attr[14]['afi_safi'] == [1, 133]:
-                LOG.info("recieve flowspec send")
-                for prefix in attr[14]['nlri']:
-                    value = copy.deepcopy(attr)
-                    value14 = value[14]
-                    del value14['nlri']
-                    key = "{"
-                    for k in sorted(prefix.keys()):
-                        key += '"' + k + '"'
-                        key += ':'
-                        key += '"' + str(prefix[k]) + '"'
-                        key += ','
-                    key = key[:-1]
-                    key += "}"
-                    if str(key) not in self.flowspec_receive_dict:
-                        self.receive_version['flowspec'] += 1
-                        self.flowspec_receive_dict[str(key)] = value
-                    else:
-                        if value == self.flowspec_receive_dict[str(key)]:
-                            pass
-                        else:
-                            self.receive_version['flowspec'] += 1
-                            self.flowspec_receive_dict[str(key)] = value
-            elif attr[14]['afi_safi'] == [1, 73]:
-                LOG.info('recieve sr send')
-            elif attr[14]['afi_safi'] == [1, 128]:
-                LOG.info("receive send mpls_vpn")
-                for prefix in attr[14]['nlri']:
-                    value = copy.deepcopy(attr)
-                    value14 = value[14]
-                    del value14['nlri']
-                    key = "{"
-                    for k in sorted(prefix.keys()):
-                        key += '"' + k + '"'
-                        key += ':'
-                        key += '"' + str(prefix[k]) + '"'
-                        key += ','
-                    key = key[:-1]
-                    key += "}"
-                    if str(key) not in self.mpls_vpn_receive_dict:
-                        self.receive_version['mpls_vpn'] += 1
-                        self.mpls_vpn_receive_dict[str(key)] = value
-                    else:
-                        if value == self.mpls_vpn_receive_dict[str(key)]:
-                            pass
-                        else:
-                            self.receive_version['mpls_vpn'] += 1
-                            self.mpls_vpn_receive_dict[str(key)] = value
-        # receive flowspec sr mpls withdraw
-        if 15 in attr:
-            if attr[15]['afi_safi'] == [1, 133]:
-                LOG.info("recieve flowspec withdraw")
-                for prefix in attr[15]['withdraw']:
-                    key = "{"
-                    for k in sorted(prefix.keys()):
-                        key += '"' + k + '"'
-                        key += ':'
-                        key += '"' + str(prefix[k]) + '"'
-                        key += ','
-                    key = key[:-1]
-                    key += "}"
-                    if str(key) in self.flowspec_receive_dict:
-                        self.receive_version['flowspec'] += 1
-                        del self.flowspec_receive_dict[str(key)]
-                    else:
-                        LOG.info("Do not have %s in receive flowspec dict" % prefix)
-            elif attr[15]['afi_safi'] == [1, 73]:
-                LOG.info('recieve sr withdraw')
-            elif attr[15]['afi_safi'] == [1, 128]:
-                LOG.info("recieve withdraw mpls_vpn")
-                for prefix in attr[15]['withdraw']:
-                    key = "{"
-                    for k in sorted(prefix.keys()):
-                        key += '"' + k + '"'
-                        key += ':'
-                        key += '"' + str(prefix[k]) + '"'
-                        key += ','
-                    key = key[:-1]
-                    key += "}"
-                    if str(key) in self.mpls_vpn_receive_dict:
-                        self.receive_version['mpls_vpn'] += 1
-                        del self.mpls_vpn_receive_dict[str(key)]
-                    else:
-                        LOG.info("Do not have %s in receive mpls_vpn dict" % key)
+        self._update_version('receive', attr)
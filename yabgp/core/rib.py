@@ -0,0 +1,696 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Adj-RIB tables for each address family
+
+The RIBs are changed by the reactor only. The API threads read snapshots,
+read-only copies taken by the reactor which share the tables with the RIB
+until the RIB changes them (copy-on-write).
+"""
+
+import copy
+import itertools
+import logging
+import socket
+import time
+import types
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+from yabgp.common import constants as bgp_cons
+from yabgp.common.nlri import nlri_key
+
+LOG = logging.getLogger(__name__)
+
+# address families whose NLRI is an IP prefix, maybe with RD and label
+IP_AFI_SAFI = ('ipv4', 'ipv4_mcast', 'ipv6', 'ipv4_lu', 'ipv6_lu', 'vpnv4', 'vpnv6')
+IPV6_AFI_SAFI = ('ipv6', 'ipv6_lu', 'vpnv6')
+
+
+def route_key(nlri):
+    """
+    Key of the route of a NLRI, the label is not part of it because a
+    withdrawn route may not have the label of the announced one.
+
+    :param nlri: decoded NLRI
+    """
+    if isinstance(nlri, Mapping):
+        return nlri_key(dict((k, v) for k, v in nlri.items() if k != 'label'))
+    return nlri_key(nlri)
+
+
+def route_attr(attr):
+    """
+    The path attributes stored with MP_REACH_NLRI routes, the NLRI list
+    is removed from MP_REACH_NLRI and MP_UNREACH_NLRI is dropped.
+
+    :param attr: attributes of the update message
+    """
+    if hasattr(attr, 'route_attributes'):
+        # lazy attributes are not decoded
+        return attr.route_attributes()
+    value = dict(attr)
+    value.pop(bgp_cons.BGPTYPE_MP_UNREACH_NLRI, None)
+    if bgp_cons.BGPTYPE_MP_REACH_NLRI in value:
+        value[bgp_cons.BGPTYPE_MP_REACH_NLRI] = {
+            k: v for k, v in value[bgp_cons.BGPTYPE_MP_REACH_NLRI].items() if k != 'nlri'}
+    return value
+
+
+def attr_fingerprint(attr):
+    """
+    Hashable fingerprint of the path attributes of an update message, the
+    NLRI in MP_REACH_NLRI and the MP_UNREACH_NLRI attribute are excluded,
+    so all the routes of one message have the same fingerprint.
+
+    :param attr: attributes of the update message
+    """
+    if hasattr(attr, 'route_attributes'):
+        return attr.route_attributes().raw_key
+    items = []
+    for k, v in attr.items():
+        if k == bgp_cons.BGPTYPE_MP_UNREACH_NLRI:
+            continue
+        if k == bgp_cons.BGPTYPE_MP_REACH_NLRI:
+            v = {mp_k: mp_v for mp_k, mp_v in v.items() if mp_k != 'nlri'}
+        items.append((str(k), nlri_key(v)))
+    return tuple(sorted(items))
+
+
+class CowDict(object):
+    """
+    Dictionary for copy-on-write snapshots. The items are spread over
+    buckets, `snapshot` gives a read-only copy sharing the buckets, and a
+    bucket is copied the first time it is written after a snapshot, so a
+    snapshot costs one flag per bucket and a change copies one bucket.
+    The buckets are doubled when they hold `max_load` items on average,
+    so a change copies about the same number of items in a full table.
+    """
+
+    # average number of items of a bucket from which the buckets are doubled
+    max_load = 128
+
+    def __init__(self, buckets=16):
+        """
+        :param buckets: initial number of buckets, a power of 2
+        """
+        self._buckets = [{} for _ in range(buckets)]
+        self._mask = buckets - 1
+        # the buckets shared with a snapshot
+        self._shared = [False] * buckets
+        self._len = 0
+        self.frozen = False
+
+    def _index(self, key):
+        h = hash(key)
+        # packed prefixes have the length in the low bits
+        return (h ^ (h >> 8) ^ (h >> 16) ^ (h >> 24)) & self._mask
+
+    def _writable(self, index):
+        if self.frozen:
+            raise TypeError('snapshot is read-only')
+        if self._shared[index]:
+            self._buckets[index] = dict(self._buckets[index])
+            self._shared[index] = False
+        return self._buckets[index]
+
+    def get(self, key, default=None):
+        return self._buckets[self._index(key)].get(key, default)
+
+    def __getitem__(self, key):
+        return self._buckets[self._index(key)][key]
+
+    def __contains__(self, key):
+        return key in self._buckets[self._index(key)]
+
+    def __setitem__(self, key, value):
+        bucket = self._writable(self._index(key))
+        if key in bucket:
+            bucket[key] = value
+            return
+        bucket[key] = value
+        self._len += 1
+        if self._len > self.max_load * len(self._buckets):
+            self._grow()
+
+    def _grow(self):
+        """
+        Double the buckets, the snapshots keep the buckets they share.
+        """
+        count = len(self._buckets) * 2
+        old_buckets = self._buckets
+        self._buckets = [{} for _ in range(count)]
+        self._mask = count - 1
+        self._shared = [False] * count
+        for old_bucket in old_buckets:
+            for key, value in old_bucket.items():
+                self._buckets[self._index(key)][key] = value
+
+    def pop(self, key, default=None):
+        index = self._index(key)
+        if key not in self._buckets[index]:
+            return default
+        bucket = self._writable(index)
+        self._len -= 1
+        return bucket.pop(key)
+
+    def __delitem__(self, key):
+        index = self._index(key)
+        if key not in self._buckets[index]:
+            raise KeyError(key)
+        bucket = self._writable(index)
+        self._len -= 1
+        del bucket[key]
+
+    def __len__(self):
+        return self._len
+
+    def __bool__(self):
+        return self._len > 0
+
+    __nonzero__ = __bool__
+
+    def items(self):
+        """
+        Iterate over the items, the RIB must not change during the
+        iteration unless it is over a snapshot.
+        """
+        for bucket in self._buckets:
+            for item in bucket.items():
+                yield item
+
+    def values(self):
+        for bucket in self._buckets:
+            for value in bucket.values():
+                yield value
+
+    def walk(self, start=(0, 0)):
+        """
+        Iterate over the items of a snapshot from a position, the items are
+        yielded as ((bucket, offset), key, value) where (bucket, offset) is
+        the position of the next item. The buckets of a snapshot never
+        change, so a position stays valid as long as the snapshot lives.
+
+        :param start: (bucket, offset) to start from
+        """
+        if not self.frozen:
+            raise TypeError('only a snapshot can be walked')
+        first, skip = start
+        for index in range(first, len(self._buckets)):
+            offset = skip if index == first else 0
+            for key, value in itertools.islice(self._buckets[index].items(), offset, None):
+                offset += 1
+                yield (index, offset), key, value
+
+    def diff(self, old):
+        """
+        Keys added and removed since an older snapshot of the same
+        dictionary, only the buckets copied since then are compared.
+
+        :param old: older snapshot
+        :return: (added keys, removed keys)
+        """
+        added = set()
+        removed = set()
+        if len(self._buckets) != len(old._buckets):
+            # the buckets were doubled since then, all the keys are compared
+            added.update([key for key, _ in self.items() if key not in old])
+            removed.update([key for key, _ in old.items() if key not in self])
+            return added, removed
+        for bucket, old_bucket in zip(self._buckets, old._buckets):
+            if bucket is not old_bucket:
+                # faster than a set operation, which hashes all the keys again
+                added.update([key for key in bucket if key not in old_bucket])
+                removed.update([key for key in old_bucket if key not in bucket])
+        return added, removed
+
+    def snapshot(self):
+        """
+        :return: read-only copy
+        """
+        if self.frozen:
+            return self
+        snap = CowDict.__new__(CowDict)
+        snap._buckets = list(self._buckets)
+        snap._mask = self._mask
+        snap._shared = None
+        snap._len = self._len
+        snap.frozen = True
+        self._shared = [True] * len(self._buckets)
+        return snap
+
+
+class AttrTable(object):
+    """
+    Interned path attribute sets. Routes keep the integer id of their
+    attributes, equal attribute sets share one id and one dictionary, and
+    an attribute set is dropped when its last route is removed.
+
+    The attribute dictionaries must not be changed after they are interned.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        # id: [attr, key, refcount]
+        self._entries = CowDict()
+        self._next_id = 0
+        # most routes of one update message share the same attr object
+        self._last = (None, None)
+
+    def intern(self, attr):
+        """
+        Add a reference to an attribute set. Lazy attributes are keyed on
+        their raw value, so they are not decoded.
+
+        :param attr: path attributes
+        :return: attribute set id
+        """
+        if self._last[0] is attr:
+            attr_id = self._last[1]
+        else:
+            key = getattr(attr, 'raw_key', None)
+            if key is None:
+                key = nlri_key(attr)
+            attr_id = self._ids.get(key)
+            if attr_id is None:
+                attr_id = self._next_id
+                self._next_id += 1
+                self._ids[key] = attr_id
+                self._entries[attr_id] = [attr, key, 0]
+            self._last = (attr, attr_id)
+        self._entries[attr_id][2] += 1
+        return attr_id
+
+    def release(self, attr_id):
+        """
+        Remove a reference to an attribute set.
+
+        :param attr_id: attribute set id
+        """
+        entry = self._entries[attr_id]
+        entry[2] -= 1
+        if entry[2] == 0:
+            del self._entries[attr_id]
+            del self._ids[entry[1]]
+            if self._last[1] == attr_id:
+                self._last = (None, None)
+
+    def get(self, attr_id):
+        return self._entries[attr_id][0]
+
+    def refcount(self, attr_id):
+        entry = self._entries.get(attr_id)
+        return entry[2] if entry else 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def snapshot(self):
+        """
+        :return: read-only copy, only `get` can be used
+        """
+        snap = AttrTable.__new__(AttrTable)
+        # read-only, interning fails
+        snap._ids = types.MappingProxyType({})
+        snap._entries = self._entries.snapshot()
+        snap._next_id = self._next_id
+        snap._last = (None, None)
+        return snap
+
+
+class AdjRIB(object):
+    """
+    Adj-RIB of one address family. Routes refer to their path attributes
+    by id in an `AttrTable`, which can be shared by the RIBs of a peer.
+    """
+
+    def __init__(self, afi_safi, attr_table=None):
+        self.afi_safi = afi_safi
+        self.attr_table = attr_table if attr_table is not None else AttrTable()
+        self.version = 0
+
+    def update(self, nlri, attr):
+        """
+        Add or replace a route.
+
+        :return: True if the RIB changed
+        """
+        raise NotImplementedError
+
+    def withdraw(self, nlri):
+        """
+        Remove a route.
+
+        :return: True if the RIB changed
+        """
+        raise NotImplementedError
+
+    def check(self, nlri):
+        """
+        Raise an error if the NLRI can not be stored in this RIB, the RIB is
+        not changed.
+        """
+        raise NotImplementedError
+
+    def lookup(self, query):
+        """
+        Search a route.
+
+        :param query: NLRI or IP address
+        :return: route dictionary or {}
+        """
+        raise NotImplementedError
+
+    def routes(self):
+        """
+        Iterate over all the (nlri, attr) in this RIB.
+        """
+        raise NotImplementedError
+
+    def walk(self, position=(0, 0, 0)):
+        """
+        Iterate over the routes of a snapshot from a position, for dumps
+        which can be resumed.
+
+        :param position: (table, bucket, offset) to start from
+        :return: iterator of (position of the next route, nlri, attr)
+        """
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def snapshot(self, attr_table=None):
+        """
+        Read-only copy of this RIB, taken by the reactor.
+
+        :param attr_table: snapshot of the `AttrTable`, for the RIBs sharing it
+        """
+        snap = copy.copy(self)
+        snap.attr_table = attr_table if attr_table is not None else self.attr_table.snapshot()
+        return snap
+
+
+class IPAdjRIB(AdjRIB):
+    """
+    Adj-RIB of IP prefixes. There is one table for each route distinguisher
+    and add-path id, the key is the prefix packed in an integer as
+    (address << 8 | length) and the value is the attribute set id, or
+    (attribute set id, other NLRI fields like label) for labeled routes.
+    IP addresses are matched by looking up the prefix lengths in the
+    table from the longest one.
+    """
+
+    def __init__(self, afi_safi, attr_table=None):
+        super(IPAdjRIB, self).__init__(afi_safi, attr_table)
+        if afi_safi in IPV6_AFI_SAFI:
+            self.family, self.max_len = socket.AF_INET6, 128
+        else:
+            self.family, self.max_len = socket.AF_INET, 32
+        # (rd, path id): {packed prefix: value}
+        self.tables = {}
+        # (rd, path id): {prefix length: number of prefixes}
+        self.lengths = {}
+        self.count = 0
+
+    @staticmethod
+    def _split(nlri):
+        if isinstance(nlri, dict):
+            return nlri.get('rd'), nlri['prefix'], nlri.get('path_id')
+        return None, nlri, None
+
+    def pack(self, prefix):
+        """
+        Pack a prefix or IP address, host bits are cleared.
+
+        :param prefix: string like '10.0.0.0/8' or '10.0.0.1'
+        """
+        if '/' in prefix:
+            addr, length = prefix.split('/')
+            length = int(length)
+        else:
+            addr, length = prefix, self.max_len
+        ip = int.from_bytes(socket.inet_pton(self.family, addr), 'big')
+        ip &= ~((1 << (self.max_len - length)) - 1)
+        return ip << 8 | length
+
+    def unpack(self, key):
+        addr = (key >> 8).to_bytes(self.max_len // 8, 'big')
+        return '%s/%s' % (socket.inet_ntop(self.family, addr), key & 0xff)
+
+    def check(self, nlri):
+        self.pack(self._split(nlri)[1])
+
+    def update(self, nlri, attr):
+        rd, prefix, path_id = self._split(nlri)
+        key = self.pack(prefix)
+        attr_id = self.attr_table.intern(attr)
+        if isinstance(nlri, dict):
+            extra = {k: v for k, v in nlri.items() if k not in ('prefix', 'rd', 'path_id')}
+            value = (attr_id, extra) if extra else attr_id
+        else:
+            value = attr_id
+        table = self.tables.get((rd, path_id))
+        if table is None:
+            table = self.tables[(rd, path_id)] = CowDict()
+            self.lengths[(rd, path_id)] = {}
+        old = table.get(key)
+        table[key] = value
+        if old is None:
+            self.count += 1
+            lengths = self.lengths[(rd, path_id)]
+            lengths[key & 0xff] = lengths.get(key & 0xff, 0) + 1
+        else:
+            self.attr_table.release(old[0] if isinstance(old, tuple) else old)
+            if old == value:
+                return False
+        self.version += 1
+        return True
+
+    def withdraw(self, nlri):
+        rd, prefix, path_id = self._split(nlri)
+        table = self.tables.get((rd, path_id))
+        if table is None:
+            return False
+        key = self.pack(prefix)
+        old = table.pop(key, None)
+        if old is None:
+            return False
+        self.attr_table.release(old[0] if isinstance(old, tuple) else old)
+        lengths = self.lengths[(rd, path_id)]
+        lengths[key & 0xff] -= 1
+        if not lengths[key & 0xff]:
+            del lengths[key & 0xff]
+        if not table:
+            del self.tables[(rd, path_id)]
+            del self.lengths[(rd, path_id)]
+        self.count -= 1
+        self.version += 1
+        return True
+
+    def _match(self, table_key, query, exact):
+        """
+        :return: (packed prefix, value) of the best match or None
+        """
+        table = self.tables[table_key]
+        if exact:
+            value = table.get(query)
+            return (query, value) if value is not None else None
+        ip = query >> 8
+        for length in sorted(self.lengths[table_key], reverse=True):
+            key = (ip & ~((1 << (self.max_len - length)) - 1)) << 8 | length
+            value = table.get(key)
+            if value is not None:
+                return key, value
+        return None
+
+    def _route(self, table_key, key, value):
+        rd, path_id = table_key
+        if isinstance(value, tuple):
+            attr_id, extra = value
+        else:
+            attr_id, extra = value, None
+        route = {'prefix': self.unpack(key), 'attr': self.attr_table.get(attr_id)}
+        if rd is not None:
+            route['rd'] = rd
+        if path_id is not None:
+            route['path_id'] = path_id
+        if extra:
+            route.update(extra)
+        return route
+
+    def lookup(self, query):
+        """
+        Prefix (with '/') is exactly matched, IP address is longest
+        matched. Use {"rd": <rd>, "prefix": <prefix>} for VPN routes.
+        """
+        rd, prefix, path_id = self._split(query)
+        exact = '/' in prefix
+        packed = self.pack(prefix)
+        if (rd, path_id) in self.tables:
+            table_keys = [(rd, path_id)]
+        else:
+            table_keys = sorted((k for k in self.tables if k[0] == rd), key=lambda k: str(k[1]))
+        best = None
+        for table_key in table_keys:
+            match = self._match(table_key, packed, exact)
+            if match and (best is None or (match[0] & 0xff) > (best[1] & 0xff)):
+                best = (table_key, ) + match
+        if best is None:
+            return {}
+        return self._route(*best)
+
+    def _nlri(self, table_key, key, value):
+        """
+        :return: (nlri, attr) with the prefix string as NLRI when it has no other field
+        """
+        route = self._route(table_key, key, value)
+        attr = route.pop('attr')
+        if len(route) == 1:
+            return route['prefix'], attr
+        return route, attr
+
+    def routes(self):
+        for table_key, table in list(self.tables.items()):
+            for key, value in (table.items() if table.frozen else list(table.items())):
+                yield self._nlri(table_key, key, value)
+
+    def walk(self, position=(0, 0, 0)):
+        first = position[0]
+        table_keys = sorted(self.tables, key=str)
+        for index in range(first, len(table_keys)):
+            table_key = table_keys[index]
+            start = position[1:] if index == first else (0, 0)
+            for (bucket, offset), key, value in self.tables[table_key].walk(start):
+                nlri, attr = self._nlri(table_key, key, value)
+                yield (index, bucket, offset), nlri, attr
+
+    def __len__(self):
+        return self.count
+
+    def snapshot(self, attr_table=None):
+        snap = super(IPAdjRIB, self).snapshot(attr_table)
+        snap.tables = {k: table.snapshot() for k, table in self.tables.items()}
+        snap.lengths = {k: dict(lengths) for k, lengths in self.lengths.items()}
+        return snap
+
+
+class HashedAdjRIB(AdjRIB):
+    """
+    Adj-RIB of NLRI which are not IP prefixes (flowspec, EVPN, BGP-LS,
+    SR policy) in a dictionary keyed by the canonical NLRI, the value is
+    (nlri, attribute set id).
+    """
+
+    def __init__(self, afi_safi, attr_table=None):
+        super(HashedAdjRIB, self).__init__(afi_safi, attr_table)
+        self.table = CowDict()
+
+    def key(self, nlri):
+        if self.afi_safi == 'evpn' and isinstance(nlri, dict) and isinstance(nlri.get('value'), dict):
+            # the label is not part of an EVPN route key (RFC7432)
+            nlri = dict(nlri, value={k: v for k, v in nlri['value'].items() if k != 'label'})
+        return nlri_key(nlri)
+
+    def check(self, nlri):
+        self.key(nlri)
+
+    def update(self, nlri, attr):
+        key = self.key(nlri)
+        attr_id = self.attr_table.intern(attr)
+        old = self.table.get(key)
+        self.table[key] = (nlri, attr_id)
+        if old is not None:
+            self.attr_table.release(old[1])
+            if old[1] == attr_id:
+                return False
+        self.version += 1
+        return True
+
+    def withdraw(self, nlri):
+        old = self.table.pop(self.key(nlri), None)
+        if old is None:
+            return False
+        self.attr_table.release(old[1])
+        self.version += 1
+        return True
+
+    def lookup(self, query):
+        route = self.table.get(self.key(query))
+        if route is None:
+            return {}
+        return {'nlri': route[0], 'attr': self.attr_table.get(route[1])}
+
+    def routes(self):
+        for nlri, attr_id in (self.table.values() if self.table.frozen else list(self.table.values())):
+            yield nlri, self.attr_table.get(attr_id)
+
+    def walk(self, position=(0, 0, 0)):
+        if position[0]:
+            return
+        for (bucket, offset), _key, (nlri, attr_id) in self.table.walk(position[1:]):
+            yield (0, bucket, offset), nlri, self.attr_table.get(attr_id)
+
+    def __len__(self):
+        return len(self.table)
+
+    def snapshot(self, attr_table=None):
+        snap = super(HashedAdjRIB, self).snapshot(attr_table)
+        snap.table = self.table.snapshot()
+        return snap
+
+
+def new_adj_rib(afi_safi, attr_table=None):
+    """
+    Create the Adj-RIB for an address family name like 'ipv4' or 'evpn'.
+
+    :param afi_safi: address family name
+    :param attr_table: `AttrTable` shared with other RIBs, optional
+    """
+    if afi_safi in IP_AFI_SAFI:
+        return IPAdjRIB(afi_safi, attr_table)
+    return HashedAdjRIB(afi_safi, attr_table)
+
+
+class RIBSnapshot(object):
+    """
+    Read-only Adj-RIB-In and Adj-RIB-Out of a peer at one time, the API
+    threads read it without lock while the reactor changes the RIBs.
+    """
+
+    def __init__(self, adj_rib_in, adj_rib_out, version=0):
+        self.adj_rib_in = adj_rib_in
+        self.adj_rib_out = adj_rib_out
+        self.version = version
+        self.timestamp = time.time()
+
+    @classmethod
+    def take(cls, attr_table, adj_rib_in, adj_rib_out, version=0):
+        """
+        Take the snapshot of the RIBs of a peer, called by the reactor.
+
+        :param attr_table: `AttrTable` of the RIBs
+        :param adj_rib_in: {address family name: AdjRIB}
+        :param adj_rib_out: {address family name: AdjRIB}
+        :param version: snapshot version
+        """
+        attr_snapshot = attr_table.snapshot()
+        return cls(
+            {k: rib.snapshot(attr_snapshot) for k, rib in adj_rib_in.items()},
+            {k: rib.snapshot(attr_snapshot) for k, rib in adj_rib_out.items()},
+            version)
@@ -2,7 +2,8 @@
 # -*- coding: utf-8 -*-
 import abc
 import logging
-from queue import Queue
+
+from yabgp.core.outbound import OutboundQueue
 
 
 LOG = logging.getLogger(__name__)
@@ -11,13 +12,23 @@ LOG = logging.getLogger(__name__)
 class BaseHandler(object):
     __metaclass__ = abc.ABCMeta
 
+    # set to True if the handler only reads a few path attributes,
+    # then `msg['attr']` in `update_received` is a lazy mapping that
+    # decodes each attribute when it is accessed. Malformed attributes
+    # are still reported to `on_update_error` when the message is received.
+    lazy_update = False
+
+    # set `raw_msg = True` in your handler class to get the wire bytes
+    # of every received BGP message through `raw_msg_received`.
+    raw_msg = False
+
     def __init__(self):
         """
         internal message queue:
         push message in custom handler
-        pop message when keep alive received
+        sent by the reactor as soon as the session is established
         """
-        self.inter_mq = Queue()
+        self.inter_mq = OutboundQueue()
         pass
 
     @abc.abstractmethod
@@ -32,6 +43,38 @@ class BaseHandler(object):
     def update_received(self, peer, timestamp, msg):
         raise NotImplemented
 
+    def update_batch_received(self, peer, batch):
+        """
+        called with the update messages received from one TCP read in order,
+        override it to process many messages at once.
+
+        :param peer: BGP protocol
+        :param batch: list of (timestamp, msg)
+        """
+        for timestamp, msg in batch:
+            self.update_received(peer, timestamp, msg)
+
+    def backlog(self):
+        """
+        number of received messages which are not processed yet, for
+        handlers processing them in another thread. Reading from the peer
+        is paused while it is over `receive_backlog_high` in [bgp].
+        """
+        return 0
+
+    def raw_msg_received(self, peer, timestamp, data, local=False):
+        """
+        called with each BGP message (with the 19 bytes header) received from
+        the peer before it is parsed, and with the OPEN message we sent
+        (local is True), only when `raw_msg` is True.
+
+        :param peer: BGP protocol
+        :param timestamp: the time when the message was received or sent
+        :param data: BGP message bytes
+        :param local: the message is sent by us
+        """
+        pass
+
     @abc.abstractmethod
     def keepalive_received(self, peer, timestamp):
         raise NotImplemented
@@ -14,12 +14,27 @@ import sys
 from oslo_config import cfg
 
 from yabgp.common import constants as bgp_cons
+from yabgp.common import mrt
+from yabgp.common import msgfile
+from yabgp.common import msgindex
+from yabgp.config import get_peers_config
 from yabgp.handler import BaseHandler
+from yabgp.handler.writer import FileCompressor
+from yabgp.handler.writer import MessageWriter
 
 CONF = cfg.CONF
 
 LOG = logging.getLogger(__name__)
 
+# fsync policies of the message files
+FSYNC_ALWAYS = 'always'
+FSYNC_INTERVAL = 'interval'
+FSYNC_ROTATE = 'rotate'
+
+# message file formats
+FORMAT_JSON = 'json'
+FORMAT_MRT = 'mrt'
+
 
 MSG_PROCESS_OPTS = [
     cfg.BoolOpt('write_disk',
@@ -33,7 +48,36 @@ MSG_PROCESS_OPTS = [
                help='The Max size of one BGP message file, the unit is MB'),
     cfg.BoolOpt('write_keepalive',
                 default=False,
-                help='Whether write keepalive message to disk')
+                help='Whether write keepalive message to disk'),
+    cfg.IntOpt('write_queue_size',
+               default=100000,
+               help='The max number of messages queued for the writer thread, '
+                    '0 means writing messages in the reactor thread'),
+    cfg.StrOpt('write_fsync',
+               default=FSYNC_ROTATE,
+               choices=[FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_ROTATE],
+               help='When the message file is synced to disk, always (after each write), '
+                    'interval (every write_fsync_interval ms) or rotate (when the file is rotated)'),
+    cfg.IntOpt('write_fsync_interval',
+               default=1000,
+               help='The interval of syncing message file to disk, the unit is ms'),
+    cfg.StrOpt('format',
+               default=FORMAT_JSON,
+               choices=[FORMAT_JSON, FORMAT_MRT],
+               help='The format of message files, json (one decoded message per line) or '
+                    'mrt (RFC 6396 BGP4MP_MESSAGE_AS4 records of the raw messages)'),
+    cfg.IntOpt('write_index_interval',
+               default=1000,
+               help='Index the offset of every Nth message of the message files in '
+                    '<write_dir>/<peer>/msg/index/, 0 means no index'),
+    cfg.StrOpt('compress',
+               default=msgfile.COMPRESS_NONE,
+               choices=[msgfile.COMPRESS_NONE, msgfile.COMPRESS_GZIP, msgfile.COMPRESS_ZSTD],
+               help='Compress the rotated message files in a background thread, none, gzip or '
+                    'zstd (needs the zstandard package)'),
+    cfg.IntOpt('compress_level',
+               default=6,
+               help='The compression level of the rotated message files')
 ]
 
 CONF.register_opts(MSG_PROCESS_OPTS, group='message')
@@ -50,10 +94,48 @@ class DefaultHandler(BaseHandler):
             {<peer>: <seq number>}
         '''
         self.msg_sequence = {}
+        '''
+            {<peer>: (<peer as>, <local as>, <peer ip>, <local ip>)} for MRT records
+        '''
+        self.peer_info = {}
+        '''
+            {<peer>: (<index file>, <size of current message file>)}
+        '''
+        self.peer_index = {}
+        self.mrt = False
+        self.writer = None
+        self.compressor = None
+        '''
+            {<peer>: <time of the last sync of the message file>}
+        '''
+        self.last_sync = {}
+        # peers with written records not synced to disk yet
+        self.unsynced = set()
 
     def init(self):
         if CONF.message.write_disk:
-            self.init_msg_file(CONF.bgp.running_config['remote_addr'].lower())
+            self.mrt = CONF.message.format == FORMAT_MRT
+            # MRT records are written from the raw messages
+            self.raw_msg = self.mrt
+            for running_config in get_peers_config():
+                peer_addr = running_config['remote_addr'].lower()
+                self.peer_info[peer_addr] = (
+                    running_config['remote_as'], running_config['local_as'],
+                    running_config['remote_addr'], running_config['local_addr'])
+                self.init_msg_file(peer_addr)
+            if CONF.message.write_queue_size > 0:
+                sync_interval = None
+                if CONF.message.write_fsync == FSYNC_INTERVAL:
+                    sync_interval = CONF.message.write_fsync_interval / 1000.0
+                self.writer = MessageWriter(
+                    self.write_records, CONF.message.write_queue_size, self.sync_msg_files, sync_interval)
+            if CONF.message.compress != msgfile.COMPRESS_NONE:
+                if CONF.message.compress == msgfile.COMPRESS_ZSTD and msgfile.zstandard is None:
+                    LOG.error('zstandard package is not installed, rotated message files are not compressed')
+                else:
+                    self.compressor = FileCompressor(self.compress_file)
+                    for peer_addr in self.peer_info:
+                        self.compress_rotated_files(peer_addr)
 
     def init_msg_file(self, peer_addr):
         msg_file_path_for_peer = os.path.join(
@@ -73,35 +155,64 @@ class DefaultHandler(BaseHandler):
             # try get latest file and msg sequence if any
             last_msg_seq, msg_file_name = DefaultHandler.get_last_seq_and_file(msg_path)
 
-            if not msg_file_name:
-                msg_file_name = "%s.msg" % time.time()
             # store the message sequence
             self.msg_sequence[peer_addr] = last_msg_seq + 1
-            msg_file = open(os.path.join(msg_path, msg_file_name), 'a')
+            if not msg_file_name or msg_file_name.endswith('.mrt') != self.mrt or \
+                    msgfile.compress_method(msg_file_name) != msgfile.COMPRESS_NONE:
+                msg_file_name = self.new_msg_file_name(peer_addr)
+            elif self.mrt:
+                # drop the incomplete record at the end of the file if any
+                with open(os.path.join(msg_path, msg_file_name), 'r+b') as fh:
+                    entry = msgindex.last_entry(fh.name)
+                    if entry:
+                        fh.seek(entry[1])
+                    fh.truncate(mrt.count_records(fh)[1])
+            msg_file = open(os.path.join(msg_path, msg_file_name), 'ab' if self.mrt else 'a')
             msg_file.flush()
             self.peer_files[peer_addr] = (msg_path, msg_file)
+            self.last_sync[peer_addr] = time.time()
+            self.open_index(peer_addr)
             LOG.info('BGP message file %s', msg_file_name)
             LOG.info('The last bgp message seq number is %s', last_msg_seq)
 
     @staticmethod
     def get_last_seq_and_file(msg_path):
         """
-        Get the last sequence number in the latest log file.
+        Get the last sequence number in the latest log file. The name of a MRT
+        file is <time>.<sequence number of the first record>.mrt. Only the
+        records after the last indexed one are read if the file has an index.
         """
         LOG.info('get the last bgp message seq for this peer')
         last_seq = 0
         # first get the last file
-        file_list = os.listdir(msg_path)
+        file_list = [name for name in os.listdir(msg_path)
+                     if os.path.isfile(os.path.join(msg_path, name)) and not name.endswith(msgfile.TMP_SUFFIX)]
         if not file_list:
             return last_seq, None
         file_list.sort()
         msg_file_name = file_list[-1]
         try:
-            with open(msg_path + msg_file_name, 'r') as fh:
+            entry = msgindex.last_entry(msg_path + msg_file_name)
+            if msgfile.compress_method(msg_file_name) != msgfile.COMPRESS_NONE:
+                for record in msgfile.read_records(msg_path + msg_file_name, entry[0] if entry else None):
+                    last_seq = record[0] if msgfile.is_mrt(msg_file_name) else record['seq']
+                return last_seq, msg_file_name
+            if msg_file_name.endswith('.mrt'):
+                with open(msg_path + msg_file_name, 'rb') as fh:
+                    if entry:
+                        first_seq = entry[0]
+                        fh.seek(entry[1])
+                    else:
+                        first_seq = int(msg_file_name.rsplit('.', 2)[1])
+                    last_seq = first_seq + mrt.count_records(fh)[0] - 1
+                return last_seq, msg_file_name
+            with open(msg_path + msg_file_name, 'rb') as fh:
+                if entry:
+                    fh.seek(entry[1])
                 line = None
                 for line in fh:
                     pass
-                last = line
+                last = line.decode('utf-8') if line else None
                 if line:
                     if last.startswith('['):
                         last_seq = eval(last)[1]
@@ -116,51 +227,260 @@ class DefaultHandler(BaseHandler):
 
         return last_seq, msg_file_name
 
-    def write_msg(self, peer, timestamp, msg_type, msg):
+    def write_msg(self, peer, timestamp, msg_type, msg, flush=True):
         """
-        write bgp message into local disk file
+        write bgp message into local disk file, or queue it for the writer thread
         :param peer: peer address
         :param timestamp: timestamp
         :param msg_type: message type (0,1,2,3,4,5,6)
         :param msg: message dict
-        :param msg_path: path to store messages on disk
+        :param flush: flush and sync the file to disk (following `write_fsync`) or not,
+            not used with the writer thread
         :return:
         """
-        msg_path, msg_file = self.peer_files.get(peer.lower(), (None, None))
-        if msg_path:
-            msg_seq = self.msg_sequence[peer.lower()]
-
+        if self.mrt:
+            # BGP messages are written by raw_msg_received in MRT format
+            return
+        peer = peer.lower()
+        if peer in self.peer_files:
             msg_record = {
                 't': timestamp,
-                'seq': msg_seq,
+                'seq': self.msg_sequence[peer],
                 'type': msg_type
             }
             msg_record.update(msg)
-            try:
-                json.dump(msg_record, msg_file)
-            except Exception as e:
-                LOG.error(e)
-                LOG.info('raw message %s', msg)
-            msg_file.write('\n')
-            self.msg_sequence[peer.lower()] += 1
+            self.msg_sequence[peer] += 1
+            if self.writer:
+                self.writer.put(peer, msg_record)
+            else:
+                self.write_records(peer, [msg_record], sync=None if flush else False)
+
+    def raw_msg_received(self, peer, timestamp, data, local=False):
+        """
+        write the raw BGP message as a MRT record
+        """
+        peer_addr = peer.factory.peer_addr.lower()
+        if peer_addr not in self.peer_files:
+            return
+        if data[18] == bgp_cons.MSG_KEEPALIVE and not CONF.message.write_keepalive:
+            return
+        try:
+            local_ip = peer.transport.getHost().host
+        except Exception:
+            local_ip = peer.factory.my_addr
+        self.peer_info[peer_addr] = (peer.factory.peer_asn, peer.factory.my_asn, peer.factory.peer_addr, local_ip)
+        peer_as, local_as, peer_ip, local_ip = self.peer_info[peer_addr]
+        self.write_mrt(peer_addr, mrt.pack_message(timestamp, peer_as, local_as, peer_ip, local_ip, data, local))
+
+    def write_state_change(self, peer, old_state, new_state):
+        """
+        write a MRT state change record
+        :param peer: peer address
+        :param old_state: old FSM state
+        :param new_state: new FSM state
+        """
+        peer = peer.lower()
+        if peer in self.peer_files and peer in self.peer_info:
+            peer_as, local_as, peer_ip, local_ip = self.peer_info[peer]
+            self.write_mrt(peer, mrt.pack_state_change(
+                time.time(), peer_as, local_as, peer_ip, local_ip, old_state, new_state))
+
+    def write_mrt(self, peer, record):
+        """
+        write one MRT record into local disk file, or queue it for the writer thread
+        :param peer: peer address
+        :param record: MRT record bytes
+        """
+        msg_seq = self.msg_sequence[peer]
+        self.msg_sequence[peer] += 1
+        if self.writer:
+            self.writer.put(peer, (msg_seq, record))
+        else:
+            self.write_records(peer, [(msg_seq, record)])
+
+    def write_records(self, peer, records, sync=None):
+        """
+        write message records into the message file of the peer, and rotate the
+        file if it is too big
+        :param peer: peer address
+        :param records: list of message record dicts, or (seq, MRT record) in MRT format
+        :param sync: sync the file to disk or not, None means following `write_fsync`
+        """
+        msg_path, msg_file = self.peer_files[peer]
+        index_file, offset = self.peer_index.get(peer, (None, 0))
+        entries = []
+        if self.mrt:
+            for msg_seq, record in records:
+                if self.need_index(msg_seq, offset):
+                    entries.append(msgindex.ENTRY.pack(msg_seq, offset))
+                offset += len(record)
+            msg_file.write(b''.join(record for msg_seq, record in records))
+            next_seq = records[-1][0] + 1
+        else:
+            lines = []
+            for msg_record in records:
+                try:
+                    line = json.dumps(msg_record)
+                except Exception as e:
+                    LOG.error(e)
+                    LOG.info('raw message %s', msg_record)
+                    continue
+                if self.need_index(msg_record['seq'], offset):
+                    entries.append(msgindex.ENTRY.pack(msg_record['seq'], offset))
+                # the json lines are ascii, one character is one byte
+                offset += len(line) + 1
+                lines.append(line)
+            lines.append('')
+            msg_file.write('\n'.join(lines))
+            next_seq = records[-1]['seq'] + 1
+        msg_file.flush()
+        if index_file:
+            # the index is written after the records it points to
+            if entries:
+                index_file.write(b''.join(entries))
+                index_file.flush()
+            self.peer_index[peer] = (index_file, offset)
+        if sync is None:
+            sync = self.need_sync(peer)
+        if sync:
+            self.sync_msg_file(peer)
+        else:
+            self.unsynced.add(peer)
+        self.check_file_size(peer, next_seq)
+
+    @staticmethod
+    def need_index(msg_seq, offset):
+        """
+        whether a record is indexed, the first record of each file and every
+        `write_index_interval` sequence numbers
+        """
+        interval = CONF.message.write_index_interval
+        return interval > 0 and (offset == 0 or msg_seq % interval == 0)
+
+    def open_index(self, peer):
+        """
+        open the index file of the current message file of the peer
+        :param peer: peer address
+        """
+        if CONF.message.write_index_interval <= 0:
+            return
+        msg_path, msg_file = self.peer_files[peer]
+        index_file = msgindex.open_index(msg_file.name)
+        self.peer_index[peer] = (index_file, os.path.getsize(msg_file.name))
+
+    def need_sync(self, peer):
+        """
+        whether the message file of the peer should be synced to disk now
+        :param peer: peer address
+        """
+        if CONF.message.write_fsync == FSYNC_ALWAYS:
+            return True
+        if CONF.message.write_fsync == FSYNC_INTERVAL and \
+                time.time() - self.last_sync.get(peer, 0) >= CONF.message.write_fsync_interval / 1000.0:
+            return True
+        return False
+
+    def sync_msg_file(self, peer):
+        """
+        sync the message file of the peer and its index to disk
+        :param peer: peer address
+        """
+        msg_path, msg_file = self.peer_files[peer]
+        index_file = self.peer_index.get(peer, (None, 0))[0]
+        os.fsync(msg_file.fileno())
+        if index_file:
+            os.fsync(index_file.fileno())
+        self.last_sync[peer] = time.time()
+        self.unsynced.discard(peer)
+
+    def sync_msg_files(self):
+        """
+        sync the message files with records written since their last sync
+        once `write_fsync_interval` passed, called by the writer thread even
+        when no record comes
+        """
+        for peer in list(self.unsynced):
+            if self.need_sync(peer):
+                self.sync_msg_file(peer)
+
+    def flush_msg(self, peer):
+        """
+        flush and sync the message file of the peer to disk following `write_fsync`
+        :param peer: peer address
+        """
+        if self.writer:
+            return
+        msg_path, msg_file = self.peer_files.get(peer.lower(), (None, None))
+        if msg_path:
             msg_file.flush()
-            os.fsync(msg_file.fileno())
+            if self.need_sync(peer.lower()):
+                self.sync_msg_file(peer.lower())
+            else:
+                self.unsynced.add(peer.lower())
 
-    def check_file_size(self, peer):
+    def new_msg_file_name(self, peer, next_seq=None):
+        """
+        name of a new message file, MRT file names have the sequence number of
+        the first record in the file
+        :param peer: peer address
+        :param next_seq: sequence number of the next record written, default is
+            the next one assigned
+        """
+        if self.mrt:
+            return "%s.%s.mrt" % (time.time(), self.msg_sequence[peer] if next_seq is None else next_seq)
+        return "%s.msg" % time.time()
+
+    def check_file_size(self, peer, next_seq=None):
         """if the size of the msg file is bigger than 'max_msg_file_size',
         then save as and re-open a new file.
         """
         msg_path, cur_file = self.peer_files.get(peer.lower(), (None, None))
         if msg_path:
             if os.path.getsize(cur_file.name) >= CONF.message.write_msg_max_size:
+                cur_file.flush()
+                os.fsync(cur_file.fileno())
                 cur_file.close()
-                msg_file_name = "%s.msg" % time.time()
+                msg_file_name = self.new_msg_file_name(peer.lower(), next_seq)
                 LOG.info('Open a new message file %s', msg_file_name)
-                msg_file = open(os.path.join(msg_path + msg_file_name), 'a')
+                msg_file = open(os.path.join(msg_path + msg_file_name), 'ab' if self.mrt else 'a')
                 self.peer_files[peer.lower()] = (msg_path, msg_file)
+                index_file = self.peer_index.pop(peer.lower(), (None, 0))[0]
+                if index_file:
+                    os.fsync(index_file.fileno())
+                    index_file.close()
+                self.open_index(peer.lower())
+                self.last_sync[peer.lower()] = time.time()
+                self.unsynced.discard(peer.lower())
+                if self.compressor:
+                    self.compressor.put(cur_file.name)
                 return True
         return False
 
+    def compress_file(self, file_name):
+        """
+        compress one rotated message file, called in the compressor thread
+        :param file_name: message file path
+        :return: compressed file path
+        """
+        return msgfile.compress_file(file_name, CONF.message.compress, CONF.message.compress_level)
+
+    def compress_rotated_files(self, peer):
+        """
+        queue the rotated message files of the peer which are not compressed
+        yet, like the ones rotated before the last stop
+        :param peer: peer address
+        """
+        msg_path, cur_file = self.peer_files[peer]
+        for name in sorted(os.listdir(msg_path)):
+            file_name = os.path.join(msg_path, name)
+            if not os.path.isfile(file_name) or file_name == cur_file.name:
+                continue
+            if name.endswith(msgfile.TMP_SUFFIX):
+                # compression stopped before the end
+                os.remove(file_name)
+            elif msgfile.compress_method(name) == msgfile.COMPRESS_NONE:
+                self.compressor.put(file_name)
+
     def on_update_error(self, peer, timestamp, msg):
         self.write_msg(
             peer=peer.factory.peer_addr,
@@ -177,7 +497,24 @@ class DefaultHandler(BaseHandler):
             msg_type=bgp_cons.MSG_UPDATE,
             msg={"msg": msg}
         )
-        self.check_file_size(peer.factory.peer_addr)
+
+    def update_batch_received(self, peer, batch):
+        # write all messages and sync the file only once
+        for timestamp, msg in batch:
+            self.write_msg(
+                peer=peer.factory.peer_addr,
+                timestamp=timestamp,
+                msg_type=bgp_cons.MSG_UPDATE,
+                msg={"msg": msg},
+                flush=False
+            )
+        self.flush_msg(peer.factory.peer_addr)
+
+    def backlog(self):
+        # records waiting for the writer thread
+        if self.writer:
+            return self.writer.queue.qsize()
+        return 0
 
     def keepalive_received(self, peer, timestamp):
         """
@@ -235,6 +572,9 @@ class DefaultHandler(BaseHandler):
         )
 
     def on_connection_lost(self, peer):
+        if self.mrt:
+            self.write_state_change(peer.factory.peer_addr, bgp_cons.ST_ESTABLISHED, bgp_cons.ST_IDLE)
+            return
         self.write_msg(
             peer=peer.factory.peer_addr,
             timestamp=time.time(),
@@ -243,6 +583,9 @@ class DefaultHandler(BaseHandler):
         )
 
     def on_connection_failed(self, peer, msg):
+        if self.mrt:
+            self.write_state_change(peer, bgp_cons.ST_CONNECT, bgp_cons.ST_IDLE)
+            return
         self.write_msg(
             peer=peer,
             timestamp=time.time(),
@@ -0,0 +1,239 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+""" Message file writer and compressor threads """
+
+import logging
+import os
+import threading
+import time
+import traceback
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+LOG = logging.getLogger(__name__)
+
+
+class MessageWriter(object):
+    """
+    Write message records in a dedicated thread. Records are put in a
+    bounded queue, the thread takes all the queued records at once and
+    hands them to `write_func` in one call for each peer (group commit).
+    `put` blocks when the queue is full. With a sync interval, the thread
+    also wakes up when no record comes to call `sync_func`.
+    """
+
+    # max number of records written in one batch
+    max_batch = 10000
+
+    def __init__(self, write_func, queue_size, sync_func=None, sync_interval=None):
+        """
+        :param write_func: function(peer, records) doing the writes and
+            syncs, it is only called in the writer thread
+        :param queue_size: max number of queued records
+        :param sync_func: function() syncing the files written since their
+            last sync, called after each batch and every `sync_interval`
+        :param sync_interval: max seconds waiting for a record before
+            calling `sync_func`, None means waiting forever
+        """
+        self.write_func = write_func
+        self.sync_func = sync_func
+        self.sync_interval = sync_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        # statistic
+        self.records = 0
+        self.batches = 0
+        self.max_depth = 0
+        self.last_latency = 0
+        self.max_latency = 0
+        self.total_latency = 0
+        self._thread = threading.Thread(target=self.run, name='msg-writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, peer, record):
+        """
+        Queue one record of the peer.
+
+        :param peer: peer address
+        :param record: message record dict
+        """
+        self.queue.put((peer, record))
+
+    def run(self):
+        stop = False
+        while not stop:
+            try:
+                items = [self.queue.get(timeout=self.sync_interval)]
+            except queue.Empty:
+                self.sync()
+                continue
+            depth = self.queue.qsize() + 1
+            if depth > self.max_depth:
+                self.max_depth = depth
+            while len(items) < self.max_batch:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            # keep the record order of each peer
+            batch = {}
+            for item in items:
+                if item is None:
+                    stop = True
+                    continue
+                batch.setdefault(item[0], []).append(item[1])
+            start = time.time()
+            for peer, records in batch.items():
+                self.records += len(records)
+                try:
+                    self.write_func(peer, records)
+                except Exception as e:
+                    LOG.error(e)
+                    error_str = traceback.format_exc()
+                    LOG.debug(error_str)
+            latency = (time.time() - start) * 1000
+            self.batches += 1
+            self.last_latency = latency
+            self.total_latency += latency
+            if latency > self.max_latency:
+                self.max_latency = latency
+            # the peers not in this batch may have unsynced records too
+            self.sync()
+            for _ in items:
+                self.queue.task_done()
+
+    def sync(self):
+        """
+        Call `sync_func` in the writer thread.
+        """
+        if self.sync_func is None:
+            return
+        try:
+            self.sync_func()
+        except Exception as e:
+            LOG.error(e)
+            error_str = traceback.format_exc()
+            LOG.debug(error_str)
+
+    def flush(self):
+        """
+        Wait until all the queued records are written.
+        """
+        self.queue.join()
+
+    def stop(self):
+        """
+        Write the queued records and stop the thread.
+        """
+        if self._thread.is_alive():
+            self.queue.put(None)
+            self._thread.join()
+
+    def stats(self):
+        """
+        :return: writer statistic dictionary, latency is in milliseconds
+        """
+        return {
+            'queue_depth': self.queue.qsize(),
+            'queue_size': self.queue.maxsize,
+            'max_queue_depth': self.max_depth,
+            'records': self.records,
+            'batches': self.batches,
+            'last_write_latency': self.last_latency,
+            'max_write_latency': self.max_latency,
+            'avg_write_latency': self.total_latency / self.batches if self.batches else 0
+        }
+
+
+class FileCompressor(object):
+    """
+    Compress the rotated message files in a dedicated thread, so neither
+    the reactor nor the writer thread waits for the compression.
+    """
+
+    def __init__(self, compress_func):
+        """
+        :param compress_func: function(file name) returning the compressed
+            file name, it is only called in the compressor thread
+        """
+        self.compress_func = compress_func
+        self.queue = queue.Queue()
+        # statistic
+        self.files = 0
+        self.errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._stop = False
+        self._thread = threading.Thread(target=self.run, name='msg-compressor')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, file_name):
+        """
+        Queue one message file which is not written anymore.
+        """
+        self.queue.put(file_name)
+
+    def run(self):
+        while True:
+            file_name = self.queue.get()
+            try:
+                if file_name is None or self._stop:
+                    return
+                size = os.path.getsize(file_name)
+                new_name = self.compress_func(file_name)
+                self.files += 1
+                self.bytes_in += size
+                self.bytes_out += os.path.getsize(new_name)
+                LOG.info('Compressed message file %s', new_name)
+            except Exception as e:
+                self.errors += 1
+                LOG.error(e)
+                error_str = traceback.format_exc()
+                LOG.debug(error_str)
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        """
+        Wait until all the queued files are compressed.
+        """
+        self.queue.join()
+
+    def stop(self):
+        """
+        Stop the thread after the file being compressed, the queued files
+        are left as they are.
+        """
+        if self._thread.is_alive():
+            self._stop = True
+            self.queue.put(None)
+            self._thread.join()
+
+    def stats(self):
+        """
+        :return: compressor statistic dictionary
+        """
+        return {
+            'queue_depth': self.queue.qsize(),
+            'files': self.files,
+            'errors': self.errors,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out
+        }
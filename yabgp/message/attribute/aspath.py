@@ -21,6 +21,12 @@ from yabgp.message.attribute import AttributeFlag
 from yabgp.common import exception as excep
 from yabgp.common import constants as bgp_cons
 
+# flags, type code, length
+HEADER = struct.Struct('!BBB')
+EXTENDED_HEADER = struct.Struct('!BBH')
+# segment type, number of ASes
+SEGMENT_HEADER = struct.Struct('!BB')
+
 
 class ASPath(Attribute):
     """
@@ -98,36 +104,21 @@ class ASPath(Attribute):
         # value example
         # [(2, [3257, 31027, 34848, 21465])], or [(3, [64606]), (2, [64624, 65515])]
 
-        as_path_raw = b''
+        as_path_raw = bytearray()
+        asn_format = '!%dI' if asn4 else '!%dH'
         for segment in value:
-            as_seg_raw = b''
             seg_type = segment[0]
             as_path_list = segment[1]
             if seg_type not in [cls.AS_SET, cls.AS_SEQUENCE, cls.AS_CONFED_SET, cls.AS_CONFED_SEQUENCE]:
                 assert excep.UpdateMessageError(
                     sub_error=bgp_cons.ERR_MSG_UPDATE_MALFORMED_ASPATH,
                     data='')
-
-            if asn4:
-                #  4 bytes asn encode
-                as_count = 0
-                for asn in as_path_list:
-                    as_count += 1
-                    as_seg_raw += struct.pack('!I', asn)
-            else:
-                # 2 bytes asn encode
-                as_count = 0
-                for asn in as_path_list:
-                    as_count += 1
-                    as_seg_raw += struct.pack('!H', asn)
-
-            as_path_raw += struct.pack('!B', seg_type) + struct.pack('!B', as_count) + as_seg_raw
+            as_path_raw += SEGMENT_HEADER.pack(seg_type, len(as_path_list))
+            as_path_raw += struct.pack(asn_format % len(as_path_list), *as_path_list)
 
         flags = cls.FLAG
         if len(as_path_raw) > 255:
             flags += AttributeFlag.EXTENDED_LENGTH
-            return struct.pack('!B', flags) + struct.pack('!B', cls.ID) \
-                + struct.pack('!H', len(as_path_raw)) + as_path_raw
+            return EXTENDED_HEADER.pack(flags, cls.ID, len(as_path_raw)) + as_path_raw
         else:
-            return struct.pack('!B', flags) + struct.pack('!B', cls.ID) \
-                + struct.pack('!B', len(as_path_raw)) + as_path_raw
+            return HEADER.pack(flags, cls.ID, len(as_path_raw)) + as_path_raw
@@ -21,6 +21,7 @@ import binascii
 
 import netaddr
 
+from yabgp.message import encoder
 from yabgp.message.attribute import Attribute
 from yabgp.message.attribute import AttributeFlag
 from yabgp.message.attribute import AttributeID
@@ -328,12 +329,19 @@ class MpReachNLRI(Attribute):
                     nexthop_len *= 2
                     nexthop_bin += netaddr.IPAddress(value['linklocal_nexthop']).packed
 
-                nlri_bin = IPv6Unicast.construct(nlri_list=value['nlri'])
-
-                attr_value = struct.pack('!H', afi) + struct.pack('!B', safi) + struct.pack('!B', nexthop_len) + \
-                    nexthop_bin + b'\x00' + nlri_bin
-                return struct.pack('!B', cls.FLAG) + struct.pack('!B', cls.ID)\
-                    + struct.pack('!H', len(attr_value)) + attr_value
+                enc = encoder.Encoder()
+                enc.put_uint8(cls.FLAG)
+                enc.put_uint8(cls.ID)
+                length = enc.reserve()
+                enc.put_uint16(afi)
+                enc.put_uint8(safi)
+                enc.put_uint8(nexthop_len)
+                enc.put(nexthop_bin)
+                enc.put_uint8(0)
+                for prefix in value['nlri']:
+                    enc.put_prefix_v6(prefix)
+                enc.fill(length)
+                return enc.getvalue()
             elif safi == safn.SAFNUM_MPLS_LABEL:
                 try:
                     try:
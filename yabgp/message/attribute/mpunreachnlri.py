@@ -18,6 +18,7 @@
 
 import struct
 
+from yabgp.message import encoder
 from yabgp.message.attribute import Attribute
 from yabgp.message.attribute import AttributeFlag
 from yabgp.message.attribute import AttributeID
@@ -199,11 +200,17 @@ class MpUnReachNLRI(Attribute):
                     data=value)
         elif afi == afn.AFNUM_INET6:
             if safi == safn.SAFNUM_UNICAST:
-                nlri = IPv6Unicast.construct(nlri_list=value['withdraw'])
-                if nlri:
-                    attr_value = struct.pack('!H', afi) + struct.pack('!B', safi) + nlri
-                    return struct.pack('!B', cls.FLAG) + struct.pack('!B', cls.ID) \
-                        + struct.pack('!H', len(attr_value)) + attr_value
+                if value['withdraw']:
+                    enc = encoder.Encoder()
+                    enc.put_uint8(cls.FLAG)
+                    enc.put_uint8(cls.ID)
+                    length = enc.reserve()
+                    enc.put_uint16(afi)
+                    enc.put_uint8(safi)
+                    for prefix in value['withdraw']:
+                        enc.put_prefix_v6(prefix)
+                    enc.fill(length)
+                    return enc.getvalue()
             elif safi == safn.SAFNUM_LAB_VPNUNICAST:
                 nlri = IPv6MPLSVPN.construct(value=value['withdraw'], iswithdraw=True)
                 if nlri:
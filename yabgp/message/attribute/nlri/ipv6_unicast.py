@@ -19,6 +19,7 @@ import struct
 import binascii
 import netaddr
 
+from yabgp.message import encoder
 from yabgp.message.attribute.nlri import NLRI
 
 
@@ -72,13 +73,7 @@ class IPv6Unicast(NLRI):
         :param nlri_list:
         :return:
         """
-        nlri_hex = b''
+        enc = encoder.Encoder()
         for prefix in nlri_list:
-            prefix = netaddr.IPNetwork(prefix)
-            nlri_hex += struct.pack('!B', prefix.prefixlen)
-            if prefix.prefixlen % 8 == 0:
-                prefix_byte_len = prefix.prefixlen // 8
-            else:
-                prefix_byte_len = prefix.prefixlen // 8 + 1
-            nlri_hex += prefix.ip.packed[:prefix_byte_len]
-        return nlri_hex
+            enc.put_prefix_v6(prefix)
+        return enc.getvalue()
@@ -0,0 +1,153 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+""" Message encoder
+
+Messages are written into one growable bytearray with precompiled
+struct packers, length fields are reserved first and filled in when the
+data they count is written. Prefixes are packed from the address bytes,
+without building netaddr objects.
+"""
+
+import socket
+import struct
+
+import netaddr
+
+UINT8 = struct.Struct('!B')
+UINT16 = struct.Struct('!H')
+UINT32 = struct.Struct('!I')
+# marker, length, type
+MSG_HEADER = struct.Struct('!16sHB')
+MARKER = b'\xff' * 16
+
+
+def _address_bytes(family, address):
+    try:
+        return socket.inet_pton(family, address)
+    except (socket.error, ValueError):
+        # shorthand addresses accepted by netaddr
+        return netaddr.IPAddress(address).packed
+
+
+def split_prefix(prefix, add_path=False):
+    """
+    :param prefix: 'address/length', or {'prefix': .., 'path_id': ..} with add path
+    :param add_path: support add path or not
+    :return: (path id or None, address, prefix length)
+    """
+    path_id = None
+    if add_path and isinstance(prefix, dict):
+        path_id = prefix.get('path_id')
+        prefix = prefix.get('prefix')
+    address, _, masklen = prefix.partition('/')
+    if not masklen:
+        network = netaddr.IPNetwork(prefix)
+        return path_id, str(network.ip), network.prefixlen
+    return path_id, address, int(masklen)
+
+
+def prefix_size(masklen, path_id=None):
+    """
+    :return: encoded size of a prefix
+    """
+    size = 1 + (masklen + 7) // 8
+    if path_id is not None:
+        size += 4
+    return size
+
+
+class Encoder(object):
+    """
+    Growable buffer of an encoded message.
+    """
+
+    def __init__(self):
+        self.buf = bytearray()
+
+    def __len__(self):
+        return len(self.buf)
+
+    def getvalue(self):
+        return bytes(self.buf)
+
+    def put(self, data):
+        self.buf += data
+
+    def put_uint8(self, value):
+        self.buf += UINT8.pack(value)
+
+    def put_uint16(self, value):
+        self.buf += UINT16.pack(value)
+
+    def put_uint32(self, value):
+        self.buf += UINT32.pack(value)
+
+    def reserve(self, packer=UINT16):
+        """
+        Reserve a length field.
+
+        :param packer: struct of the field
+        :return: position of the field
+        """
+        position = len(self.buf)
+        self.buf += b'\x00' * packer.size
+        return position
+
+    def fill(self, position, packer=UINT16, value=None):
+        """
+        Fill a reserved length field, by default with the length of the
+        data written after it.
+        """
+        if value is None:
+            value = len(self.buf) - position - packer.size
+        packer.pack_into(self.buf, position, value)
+
+    def begin_message(self, msg_type):
+        """
+        Write a BGP message header, the length is filled by `end_message`.
+
+        :return: position of the message
+        """
+        position = len(self.buf)
+        self.buf += MSG_HEADER.pack(MARKER, 0, msg_type)
+        return position
+
+    def end_message(self, position):
+        UINT16.pack_into(self.buf, position + 16, len(self.buf) - position)
+
+    def put_prefix(self, family, address, masklen, path_id=None):
+        """
+        Write a prefix: path id (add path), length and the significant
+        bytes of the address.
+        """
+        if path_id is not None:
+            self.buf += UINT32.pack(path_id)
+        self.buf += UINT8.pack(masklen)
+        self.buf += _address_bytes(family, address)[:(masklen + 7) // 8]
+
+    def put_prefix_v4(self, prefix, add_path=False):
+        """
+        :param prefix: IPv4 prefix string, or dict with add path
+        """
+        path_id, address, masklen = split_prefix(prefix, add_path)
+        self.put_prefix(socket.AF_INET, address, masklen, path_id)
+
+    def put_prefix_v6(self, prefix, add_path=False):
+        """
+        :param prefix: IPv6 prefix string, or dict with add path
+        """
+        path_id, address, masklen = split_prefix(prefix, add_path)
+        self.put_prefix(socket.AF_INET6, address, masklen, path_id)
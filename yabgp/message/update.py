@@ -17,11 +17,19 @@
 
 import binascii
 import logging
-import netaddr
 import struct
 import traceback
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+from yabgp.common import afn
+from yabgp.common import safn
 from yabgp.common import exception as excep
 from yabgp.common import constants as bgp_cons
+from yabgp.common.nlri import nlri_key
+from yabgp.message import encoder
 from yabgp.message.attribute import AttributeFlag
 from yabgp.message.attribute.origin import Origin
 from yabgp.message.attribute.aspath import ASPath
@@ -45,6 +53,16 @@ from yabgp.message.attribute.largecommunity import LargeCommunity
 
 LOG = logging.getLogger()
 
+# attributes of a lazy parsed message which are only checked for their
+# length (a multiple of the value) when the message is received, they
+# are decoded when they are read
+LENGTH_CHECKED_ATTRS = {
+    bgp_cons.BGPTYPE_COMMUNITIES: 4,
+    bgp_cons.BGPTYPE_CLUSTER_LIST: 4,
+    bgp_cons.BGPTYPE_EXTENDED_COMMUNITY: 8,
+    bgp_cons.BGPTYPE_LARGE_COMMUNITY: 12,
+}
+
 
 class Update(object):
     """
@@ -144,7 +162,7 @@ class Update(object):
         """
 
     @classmethod
-    def parse(cls, t, msg_hex, asn4=False, afi_add_path=None):
+    def parse(cls, t, msg_hex, asn4=False, afi_add_path=None, attr_cache=None):
 
         """
         Parse BGP Update message
@@ -152,6 +170,8 @@ class Update(object):
         :param msg_hex: raw message
         :param asn4: support 4 bytes AS or not
         :param afi_add_path: support add-path or not in each afi/safi
+        :param attr_cache: LRU cache of parsed attributes, the attribute
+            dictionary may be shared with other messages if it is given.
         :return: message after parsing.
         """
         results = {
@@ -185,7 +205,10 @@ class Update(object):
             results['err_data'] = ''
         try:
             # parse attributes
-            results['attr'] = cls.parse_attributes(attribute_data, asn4, afi_add_path)
+            if attr_cache is not None:
+                results['attr'] = cls.parse_attributes_cached(attribute_data, attr_cache, asn4, afi_add_path)
+            else:
+                results['attr'] = cls.parse_attributes(attribute_data, asn4, afi_add_path)
         except excep.UpdateMessageError as e:
             LOG.error(e)
             results['sub_error'] = e.sub_error
@@ -201,31 +224,191 @@ class Update(object):
         return results
 
     @classmethod
-    def construct(cls, msg_dict, asn4=False, addpath=False):
+    def construct(cls, msg_dict, asn4=False, addpath=False, attr_cache=None):
         """construct BGP update message
 
         :param msg_dict: update message string
         :param asn4: support 4 bytes asn or not
         :param addpath: support add path or not
+        :param attr_cache: LRU cache of encoded attributes, see `construct_attributes_cached`
         """
         attr_hex = b''
-        nlri_hex = b''
-        withdraw_hex = b''
         if msg_dict.get('attr'):
-            attr_hex = cls.construct_attributes(msg_dict['attr'], asn4)
-        if msg_dict.get('nlri'):
-            nlri_hex = cls.construct_prefix_v4(msg_dict['nlri'], addpath)
+            attr_hex = cls.construct_attributes_cached(msg_dict['attr'], attr_cache, asn4)
+        if attr_hex:
+            return cls._encode(attr_hex, msg_dict.get('nlri') or [], (), addpath)
+        elif msg_dict.get('withdraw'):
+            return cls._encode(b'', (), msg_dict['withdraw'], addpath)
+
+    @staticmethod
+    def _encode(attr_hex, nlri, withdraw, addpath=False):
+        """
+        Encode one update message.
+
+        :param attr_hex: encoded path attributes
+        :param nlri: IPv4 prefixes
+        :param withdraw: withdrawn IPv4 prefixes
+        :param addpath: support add path or not
+        """
+        enc = encoder.Encoder()
+        position = enc.begin_message(bgp_cons.MSG_UPDATE)
+        length = enc.reserve()
+        for prefix in withdraw:
+            enc.put_prefix_v4(prefix, addpath)
+        enc.fill(length)
+        length = enc.reserve()
+        enc.put(attr_hex)
+        enc.fill(length)
+        for prefix in nlri:
+            enc.put_prefix_v4(prefix, addpath)
+        enc.end_message(position)
+        return enc.getvalue()
+
+    @classmethod
+    def construct_split(cls, msg_dict, asn4=False, addpath=False, max_len=bgp_cons.MAX_LEN, attr_cache=None):
+        """construct BGP update messages not longer than `max_len`, the NLRI
+        and the withdrawn routes (MP_REACH_NLRI and MP_UNREACH_NLRI included)
+        are split in as few messages as possible, withdrawn routes are sent
+        in messages of their own.
+
+        :param msg_dict: update message dictionary
+        :param asn4: support 4 bytes asn or not
+        :param addpath: support add path or not
+        :param max_len: max length of one message
+        :param attr_cache: LRU cache of encoded attributes, see `construct_attributes_cached`
+        :return: list of messages
+        """
+        attr = msg_dict.get('attr') or {}
+        base_attr = dict((k, v) for k, v in attr.items() if k not in (
+            bgp_cons.BGPTYPE_MP_REACH_NLRI, bgp_cons.BGPTYPE_MP_UNREACH_NLRI))
+        # message length without withdrawn routes, path attributes and NLRI
+        room = max_len - 23
+        messages = []
         if msg_dict.get('withdraw'):
-            withdraw_hex = cls.construct_prefix_v4(msg_dict['withdraw'], addpath)
-        if nlri_hex and attr_hex:
-            msg_body = struct.pack('!H', 0) + struct.pack('!H', len(attr_hex)) + attr_hex + nlri_hex
-            return cls.construct_header(msg_body)
-        elif attr_hex and not nlri_hex:
-            msg_body = struct.pack('!H', 0) + struct.pack('!H', len(attr_hex)) + attr_hex + nlri_hex
-            return cls.construct_header(msg_body)
-        elif withdraw_hex:
-            msg_body = struct.pack('!H', len(withdraw_hex)) + withdraw_hex + struct.pack('!H', 0)
-            return cls.construct_header(msg_body)
+            withdraw = msg_dict['withdraw']
+            for start, end in cls._split(cls._prefix_sizes(withdraw, addpath), room):
+                messages.append(cls._encode(b'', (), withdraw[start:end], addpath))
+
+        mp_unreach = attr.get(bgp_cons.BGPTYPE_MP_UNREACH_NLRI)
+        if mp_unreach:
+            if isinstance(mp_unreach.get('withdraw'), list) and mp_unreach['withdraw']:
+                messages.extend(cls._construct_mp_split(MpUnReachNLRI, mp_unreach, 'withdraw', b'', room))
+            else:
+                messages.append(cls.construct(
+                    {'attr': {bgp_cons.BGPTYPE_MP_UNREACH_NLRI: mp_unreach}}, asn4, addpath, attr_cache))
+
+        mp_reach = attr.get(bgp_cons.BGPTYPE_MP_REACH_NLRI)
+        if mp_reach:
+            if isinstance(mp_reach.get('nlri'), list) and mp_reach['nlri']:
+                messages.extend(cls._construct_mp_split(
+                    MpReachNLRI, mp_reach, 'nlri', cls.construct_attributes_cached(base_attr, attr_cache, asn4), room))
+            else:
+                reach_attr = dict(base_attr)
+                reach_attr[bgp_cons.BGPTYPE_MP_REACH_NLRI] = mp_reach
+                messages.append(cls.construct({'attr': reach_attr}, asn4, addpath, attr_cache))
+
+        if msg_dict.get('nlri'):
+            attr_hex = cls.construct_attributes_cached(base_attr, attr_cache, asn4)
+            nlri = msg_dict['nlri']
+            for start, end in cls._split(cls._prefix_sizes(nlri, addpath), room - len(attr_hex)):
+                messages.append(cls._encode(attr_hex, nlri[start:end], (), addpath))
+        elif not messages and base_attr:
+            messages.append(cls.construct({'attr': base_attr}, asn4, addpath, attr_cache))
+        return messages
+
+    @staticmethod
+    def _prefix_sizes(prefix_list, addpath=False):
+        """
+        :return: encoded sizes of prefixes
+        """
+        sizes = []
+        for prefix in prefix_list:
+            path_id, _, masklen = encoder.split_prefix(prefix, addpath)
+            sizes.append(encoder.prefix_size(masklen, path_id))
+        return sizes
+
+    @staticmethod
+    def _fit(sizes, start, room):
+        """
+        :return: end index of the longest group of items from `start` whose
+            total size is not bigger than `room`, at least one item
+        """
+        end = start + 1
+        total = sizes[start]
+        while end < len(sizes) and total + sizes[end] <= room:
+            total += sizes[end]
+            end += 1
+        return end
+
+    @classmethod
+    def _split(cls, sizes, room):
+        """
+        Split items into as few consecutive groups as possible, the total size
+        of each group is not bigger than room unless the group has only one item.
+
+        :param sizes: sizes of the items
+        :param room: max total size of a group
+        :return: list of (start, end) indexes
+        """
+        groups = []
+        start = 0
+        while start < len(sizes):
+            end = cls._fit(sizes, start, room)
+            groups.append((start, end))
+            start = end
+        return groups
+
+    @classmethod
+    def _construct_mp_split(cls, attr_cls, value, key, attr_hex, room):
+        """
+        Split the NLRI of a MP_REACH_NLRI or MP_UNREACH_NLRI attribute in
+        update messages. The size of each NLRI is found by encoding it alone
+        (IPv6 unicast prefixes are only measured), the attribute header is
+        the size which is not added by a second NLRI.
+
+        :param attr_cls: MpReachNLRI or MpUnReachNLRI
+        :param value: attribute value
+        :param key: 'nlri' or 'withdraw'
+        :param attr_hex: the other path attributes of the messages
+        :param room: max length of the path attributes
+        """
+        nlri_list = value[key]
+
+        def construct_mp(nlri):
+            mp_value = dict(value)
+            mp_value[key] = nlri
+            return attr_cls.construct(mp_value)
+
+        if tuple(value['afi_safi']) == (afn.AFNUM_INET6, safn.SAFNUM_UNICAST):
+            # plain prefixes, the sizes are known without encoding them
+            sizes = cls._prefix_sizes(nlri_list)
+            header = len(construct_mp(nlri_list[:1])) - sizes[0]
+        else:
+            sizes = [len(construct_mp([nlri])) for nlri in nlri_list]
+            header = 0
+            if len(nlri_list) > 1:
+                header = sizes[0] + sizes[1] - len(construct_mp(nlri_list[:2]))
+            sizes = [size - header for size in sizes]
+        messages = []
+        start = 0
+        while start < len(nlri_list):
+            end = cls._fit(sizes, start, room - len(attr_hex) - header)
+            mp_hex = construct_mp(nlri_list[start:end])
+            # the sizes are estimated, leave the last NLRI to the next message if it does not fit
+            while len(attr_hex) + len(mp_hex) > room and end - start > 1:
+                end -= 1
+                mp_hex = construct_mp(nlri_list[start:end])
+            enc = encoder.Encoder()
+            position = enc.begin_message(bgp_cons.MSG_UPDATE)
+            enc.put_uint16(0)
+            length = enc.reserve()
+            enc.put(attr_hex)
+            enc.put(mp_hex)
+            enc.fill(length)
+            enc.end_message(position)
+            messages.append(enc.getvalue())
+            start = end
+        return messages
 
     @staticmethod
     def parse_prefix_list(data, addpath=False):
@@ -309,182 +492,309 @@ class Update(object):
                     attr_value = postfix[3:3 + attr_len]
                     postfix = postfix[3 + attr_len:]  # Next attribute
 
-                if type_code == bgp_cons.BGPTYPE_ORIGIN:
+                if type_code == bgp_cons.BGPTYPE_LINK_STATE:
+                    if bgpls_pro_id:
+                        attributes.update(LinkState.unpack(bgpls_pro_id=bgpls_pro_id, data=attr_value).dict())
+                    else:
+                        bgpls_attr = attr_value
+                    continue
 
-                    decode_value = Origin.parse(value=attr_value)
+                decode_value = Update.parse_attribute(type_code, attr_value, asn4, afi_add_path)
 
-                elif type_code == bgp_cons.BGPTYPE_AS_PATH:
+                if type_code == bgp_cons.BGPTYPE_MP_REACH_NLRI:
+                    if decode_value['nlri'][0] and type(decode_value['nlri'][0]) is dict:
+                        if decode_value['nlri'][0].get("protocol_id"):
+                            bgpls_pro_id = decode_value['nlri'][0]["protocol_id"]
 
-                    decode_value = ASPath.parse(value=attr_value, asn4=asn4)
+                elif type_code == bgp_cons.BGPTYPE_PMSI_TUNNEL:
+                    pmsi_hex = attr_value
 
-                elif type_code == bgp_cons.BGPTYPE_NEXT_HOP:
+                attributes[type_code] = decode_value
 
-                    decode_value = NextHop.parse(value=attr_value)
+            if bgpls_attr:
+                attributes.update(LinkState.unpack(bgpls_pro_id=bgpls_pro_id, data=bgpls_attr).dict())
 
-                elif type_code == bgp_cons.BGPTYPE_MULTI_EXIT_DISC:
+            evpn_overlay = EVPN.signal_evpn_overlay(attributes)
+            if evpn_overlay['evpn'] and evpn_overlay['encap_ec']:
+                if bgp_cons.BGPTYPE_PMSI_TUNNEL in attributes:
+                    attributes[bgp_cons.BGPTYPE_PMSI_TUNNEL] = PMSITunnel.parse(value=pmsi_hex,
+                                                                                evpn_overlay=evpn_overlay)
+        except excep.UpdateMessageError as e:
+            raise excep.UpdateMessageError(
+                sub_error=e.sub_error,
+                data=e.data,
+                sub_results=attributes)
+        except Exception as e:
+            LOG.error(e)
+            error_str = traceback.format_exc()
+            LOG.debug(error_str)
+            raise excep.UpdateMessageError(
+                sub_error=bgp_cons.ERR_MSG_UPDATE_MALFORMED_ATTR_LIST,
+                data='',
+                sub_results=attributes)
+        return attributes
 
-                    decode_value = MED.parse(value=attr_value)
+    @staticmethod
+    def parse_attributes_cached(data, cache, asn4=False, afi_add_path=None):
+        """
+        Parses BGP attributes through a cache keyed on the raw attributes.
+        MP_REACH_NLRI and MP_UNREACH_NLRI are not part of the key, they are
+        decoded for every message. Each message gets its own dictionary with
+        the keys in the order of `parse_attributes`, the decoded values are
+        shared by all the messages with the same attributes, so they must
+        not be changed.
+
+        :param data: raw attributes
+        :param cache: LRU cache
+        :param asn4: support 4 bytes asn or not
+        :param afi_add_path: support add path or not in afi/safi
+        :return: attribute dictionary
+        """
+        mp_attrs = []
+        # (<type code>, <raw MP attribute value or None>) in message order
+        attr_order = []
+        key_parts = []
+        pos = 0
+        last = 0
+        total = len(data)
+        while pos < total:
+            if total - pos < 3:
+                return Update.parse_attributes(data, asn4, afi_add_path)
+            flags, type_code, attr_len = struct.unpack_from('!BBB', data, pos)
+            if flags & AttributeFlag.EXTENDED_LENGTH:
+                attr_len = struct.unpack('!H', data[pos + 2:pos + 4])[0] if total - pos >= 4 else total
+                start = pos + 4
+            else:
+                start = pos + 3
+            end = start + attr_len
+            if end > total or type_code in (bgp_cons.BGPTYPE_LINK_STATE, bgp_cons.BGPTYPE_PMSI_TUNNEL):
+                # malformed attributes are reported by the normal parser,
+                # BGP-LS and PMSI tunnel depend on the MP_REACH_NLRI value
+                return Update.parse_attributes(data, asn4, afi_add_path)
+            if type_code in (bgp_cons.BGPTYPE_MP_REACH_NLRI, bgp_cons.BGPTYPE_MP_UNREACH_NLRI):
+                mp_attrs.append(type_code)
+                attr_order.append((type_code, data[start:end]))
+                key_parts.append(data[last:pos])
+                last = end
+            else:
+                attr_order.append((type_code, None))
+            pos = end
+        if mp_attrs:
+            key_parts.append(data[last:])
+            attr_data = b''.join(key_parts)
+        else:
+            attr_data = data
+        add_path = tuple(sorted(afi_add_path.items())) if afi_add_path else None
+        key = (attr_data, asn4, add_path)
+
+        cached = cache.get(key)
+        if cached is None:
+            cached = Update.parse_attributes(attr_data, asn4, afi_add_path)
+            cache.put(key, cached)
+        if not mp_attrs:
+            return dict(cached)
 
-                elif type_code == bgp_cons.BGPTYPE_LOCAL_PREF:
+        attributes = {}
+        try:
+            for type_code, attr_value in attr_order:
+                if attr_value is None:
+                    attributes[type_code] = cached[type_code]
+                else:
+                    attributes[type_code] = Update.parse_attribute(type_code, attr_value, asn4, afi_add_path)
+        except excep.UpdateMessageError as e:
+            raise excep.UpdateMessageError(
+                sub_error=e.sub_error,
+                data=e.data,
+                sub_results=attributes)
+        except Exception as e:
+            LOG.error(e)
+            error_str = traceback.format_exc()
+            LOG.debug(error_str)
+            raise excep.UpdateMessageError(
+                sub_error=bgp_cons.ERR_MSG_UPDATE_MALFORMED_ATTR_LIST,
+                data='',
+                sub_results=attributes)
+        return attributes
 
-                    decode_value = LocalPreference.parse(value=attr_value)
+    @staticmethod
+    def parse_attribute(type_code, attr_value, asn4=False, afi_add_path=None):
+        """
+        Decode the value of one path attribute. BGP-LS attribute is not
+        handled here because it depends on the MP_REACH_NLRI protocol id.
 
-                elif type_code == bgp_cons.BGPTYPE_ATOMIC_AGGREGATE:
+        :param type_code: attribute type code
+        :param attr_value: attribute value without flags and length
+        :param asn4: support 4 bytes asn or not
+        :param afi_add_path: support add path or not in afi/safi
+        :return: decoded value
+        """
+        if type_code == bgp_cons.BGPTYPE_ORIGIN:
 
-                    decode_value = AtomicAggregate.parse(value=attr_value)
+            decode_value = Origin.parse(value=attr_value)
 
-                elif type_code == bgp_cons.BGPTYPE_AGGREGATOR:
+        elif type_code == bgp_cons.BGPTYPE_AS_PATH:
 
-                    decode_value = Aggregator.parse(value=attr_value, asn4=asn4)
+            decode_value = ASPath.parse(value=attr_value, asn4=asn4)
 
-                elif type_code == bgp_cons.BGPTYPE_COMMUNITIES:
+        elif type_code == bgp_cons.BGPTYPE_NEXT_HOP:
 
-                    decode_value = Community.parse(value=attr_value)
+            decode_value = NextHop.parse(value=attr_value)
 
-                elif type_code == bgp_cons.BGPTYPE_ORIGINATOR_ID:
+        elif type_code == bgp_cons.BGPTYPE_MULTI_EXIT_DISC:
 
-                    decode_value = OriginatorID.parse(value=attr_value)
+            decode_value = MED.parse(value=attr_value)
 
-                elif type_code == bgp_cons.BGPTYPE_CLUSTER_LIST:
+        elif type_code == bgp_cons.BGPTYPE_LOCAL_PREF:
 
-                    decode_value = ClusterList.parse(value=attr_value)
+            decode_value = LocalPreference.parse(value=attr_value)
 
-                elif type_code == bgp_cons.BGPTYPE_NEW_AS_PATH:
+        elif type_code == bgp_cons.BGPTYPE_ATOMIC_AGGREGATE:
 
-                    decode_value = ASPath.parse(value=attr_value, asn4=True)
+            decode_value = AtomicAggregate.parse(value=attr_value)
 
-                elif type_code == bgp_cons.BGPTYPE_NEW_AGGREGATOR:
+        elif type_code == bgp_cons.BGPTYPE_AGGREGATOR:
 
-                    decode_value = Aggregator.parse(value=attr_value, asn4=True)
+            decode_value = Aggregator.parse(value=attr_value, asn4=asn4)
 
-                elif type_code == bgp_cons.BGPTYPE_LARGE_COMMUNITY:
+        elif type_code == bgp_cons.BGPTYPE_COMMUNITIES:
 
-                    decode_value = LargeCommunity.parse(value=attr_value)
+            decode_value = Community.parse(value=attr_value)
 
-                elif type_code == bgp_cons.BGPTYPE_MP_REACH_NLRI:
-                    decode_value = MpReachNLRI.parse(value=attr_value, afi_add_path=afi_add_path)
-                    if decode_value['nlri'][0] and type(decode_value['nlri'][0]) is dict:
-                        if decode_value['nlri'][0].get("protocol_id"):
-                            bgpls_pro_id = decode_value['nlri'][0]["protocol_id"]
+        elif type_code == bgp_cons.BGPTYPE_ORIGINATOR_ID:
 
-                elif type_code == bgp_cons.BGPTYPE_MP_UNREACH_NLRI:
-                    decode_value = MpUnReachNLRI.parse(value=attr_value, afi_add_path=afi_add_path)
+            decode_value = OriginatorID.parse(value=attr_value)
 
-                elif type_code == bgp_cons.BGPTYPE_EXTENDED_COMMUNITY:
-                    decode_value = ExtCommunity.parse(value=attr_value)
+        elif type_code == bgp_cons.BGPTYPE_CLUSTER_LIST:
 
-                elif type_code == bgp_cons.BGPTYPE_PMSI_TUNNEL:
-                    decode_value = PMSITunnel.parse(value=attr_value)
-                    pmsi_hex = attr_value
+            decode_value = ClusterList.parse(value=attr_value)
 
-                elif type_code == bgp_cons.BGPTYPE_LINK_STATE:
-                    if bgpls_pro_id:
-                        attributes.update(LinkState.unpack(bgpls_pro_id=bgpls_pro_id, data=attr_value).dict())
-                    else:
-                        bgpls_attr = attr_value
-                    continue
+        elif type_code == bgp_cons.BGPTYPE_NEW_AS_PATH:
 
-                elif type_code == bgp_cons.BGPTYPE_BGP_PREFIX_SID:
-                    decode_value = BGPPrefixSID.unpack(data=attr_value)
+            decode_value = ASPath.parse(value=attr_value, asn4=True)
 
-                else:
-                    decode_value = binascii.b2a_hex(attr_value).decode('utf-8')
-                attributes[type_code] = decode_value
+        elif type_code == bgp_cons.BGPTYPE_NEW_AGGREGATOR:
 
-            if bgpls_attr:
-                attributes.update(LinkState.unpack(bgpls_pro_id=bgpls_pro_id, data=bgpls_attr).dict())
+            decode_value = Aggregator.parse(value=attr_value, asn4=True)
 
-            evpn_overlay = EVPN.signal_evpn_overlay(attributes)
-            if evpn_overlay['evpn'] and evpn_overlay['encap_ec']:
-                if bgp_cons.BGPTYPE_PMSI_TUNNEL in attributes:
-                    attributes[bgp_cons.BGPTYPE_PMSI_TUNNEL] = PMSITunnel.parse(value=pmsi_hex,
-                                                                                evpn_overlay=evpn_overlay)
-        except excep.UpdateMessageError as e:
-            raise excep.UpdateMessageError(
-                sub_error=e.sub_error,
-                data=e.data,
-                sub_results=attributes)
-        except Exception as e:
-            LOG.error(e)
-            error_str = traceback.format_exc()
-            LOG.debug(error_str)
-            raise excep.UpdateMessageError(
-                sub_error=bgp_cons.ERR_MSG_UPDATE_MALFORMED_ATTR_LIST,
-                data='',
-                sub_results=attributes)
-        return attributes
+        elif type_code == bgp_cons.BGPTYPE_LARGE_COMMUNITY:
+
+            decode_value = LargeCommunity.parse(value=attr_value)
+
+        elif type_code == bgp_cons.BGPTYPE_MP_REACH_NLRI:
+            decode_value = MpReachNLRI.parse(value=attr_value, afi_add_path=afi_add_path)
+
+        elif type_code == bgp_cons.BGPTYPE_MP_UNREACH_NLRI:
+            decode_value = MpUnReachNLRI.parse(value=attr_value, afi_add_path=afi_add_path)
+
+        elif type_code == bgp_cons.BGPTYPE_EXTENDED_COMMUNITY:
+            decode_value = ExtCommunity.parse(value=attr_value)
+
+        elif type_code == bgp_cons.BGPTYPE_PMSI_TUNNEL:
+            decode_value = PMSITunnel.parse(value=attr_value)
+
+        elif type_code == bgp_cons.BGPTYPE_BGP_PREFIX_SID:
+            decode_value = BGPPrefixSID.unpack(data=attr_value)
+
+        else:
+            decode_value = binascii.b2a_hex(attr_value).decode('utf-8')
+        return decode_value
 
     @staticmethod
-    def construct_attributes(attr_dict, asn4=False):
+    def construct_attributes(attr_dict, asn4=False, enc=None):
 
         """
         construts BGP Update attirubte.
 
         :param attr_dict: bgp attribute dictionary
         :param asn4: support 4 bytes asn or not
+        :param enc: encoder the attributes are written to, by default
+            the encoded attributes are returned
         """
-        attr_raw_hex = b''
+        attr_enc = encoder.Encoder() if enc is None else enc
         for type_code, value in attr_dict.items():
             if type_code == bgp_cons.BGPTYPE_ORIGIN:
-                origin_hex = Origin.construct(value=value)
-                attr_raw_hex += origin_hex
+                attr_enc.put(Origin.construct(value=value))
 
             elif type_code == bgp_cons.BGPTYPE_AS_PATH:
-                aspath_hex = ASPath.construct(value=value, asn4=asn4)
-                attr_raw_hex += aspath_hex
+                attr_enc.put(ASPath.construct(value=value, asn4=asn4))
 
             elif type_code == bgp_cons.BGPTYPE_NEXT_HOP:
-                nexthop_hex = NextHop.construct(value=value)
-                attr_raw_hex += nexthop_hex
+                attr_enc.put(NextHop.construct(value=value))
 
             elif type_code == bgp_cons.BGPTYPE_MULTI_EXIT_DISC:
-                med_hex = MED.construct(value=value)
-                attr_raw_hex += med_hex
+                attr_enc.put(MED.construct(value=value))
 
             elif type_code == bgp_cons.BGPTYPE_LOCAL_PREF:
-                localpre_hex = LocalPreference.construct(value=value)
-                attr_raw_hex += localpre_hex
+                attr_enc.put(LocalPreference.construct(value=value))
 
             elif type_code == bgp_cons.BGPTYPE_ATOMIC_AGGREGATE:
-                atomicaggregate_hex = AtomicAggregate.construct(value=value)
-                attr_raw_hex += atomicaggregate_hex
+                attr_enc.put(AtomicAggregate.construct(value=value))
 
             elif type_code == bgp_cons.BGPTYPE_AGGREGATOR:
-                aggregator_hex = Aggregator.construct(value=value, asn4=asn4)
-                attr_raw_hex += aggregator_hex
+                attr_enc.put(Aggregator.construct(value=value, asn4=asn4))
 
             elif type_code == bgp_cons.BGPTYPE_COMMUNITIES:
-                community_hex = Community.construct(value=value)
-                attr_raw_hex += community_hex
+                attr_enc.put(Community.construct(value=value))
 
             elif type_code == bgp_cons.BGPTYPE_ORIGINATOR_ID:
-                originatorid_hex = OriginatorID.construct(value=value)
-                attr_raw_hex += originatorid_hex
+                attr_enc.put(OriginatorID.construct(value=value))
 
             elif type_code == bgp_cons.BGPTYPE_CLUSTER_LIST:
-                clusterlist_hex = ClusterList.construct(value=value)
-                attr_raw_hex += clusterlist_hex
+                attr_enc.put(ClusterList.construct(value=value))
 
             elif type_code == bgp_cons.BGPTYPE_MP_REACH_NLRI:
-                mpreach_hex = MpReachNLRI().construct(value=value)
-                attr_raw_hex += mpreach_hex
+                attr_enc.put(MpReachNLRI().construct(value=value))
             elif type_code == bgp_cons.BGPTYPE_MP_UNREACH_NLRI:
-                mpunreach_hex = MpUnReachNLRI.construct(value=value)
-                attr_raw_hex += mpunreach_hex
+                attr_enc.put(MpUnReachNLRI.construct(value=value))
             elif type_code == bgp_cons.BGPTYPE_EXTENDED_COMMUNITY:
-                community_ext_hex = ExtCommunity.construct(value=value)
-                attr_raw_hex += community_ext_hex
+                attr_enc.put(ExtCommunity.construct(value=value))
             elif type_code == bgp_cons.BGPTYPE_PMSI_TUNNEL:
                 evpn_overlay = EVPN.signal_evpn_overlay(attr_dict)
-                attr_raw_hex += PMSITunnel.construct(value=value, evpn_overlay=evpn_overlay)
+                attr_enc.put(PMSITunnel.construct(value=value, evpn_overlay=evpn_overlay))
             elif type_code == bgp_cons.BGPTYPE_TUNNEL_ENCAPS_ATTR:
-                tunnelencap_hex = TunnelEncaps.construct(value=value)
-                attr_raw_hex += tunnelencap_hex
+                attr_enc.put(TunnelEncaps.construct(value=value))
             elif type_code == bgp_cons.BGPTYPE_LARGE_COMMUNITY:
-                large_community_ext_hex = LargeCommunity.construct(value=value)
-                attr_raw_hex += large_community_ext_hex
+                attr_enc.put(LargeCommunity.construct(value=value))
+        if enc is None:
+            return attr_enc.getvalue()
+
+    @staticmethod
+    def construct_attributes_cached(attr_dict, cache, asn4=False):
+        """
+        Constructs BGP attributes through a cache keyed on the attribute
+        values and asn4, so an attribute set sent with many NLRI is encoded
+        once. MP_REACH_NLRI and MP_UNREACH_NLRI are not part of the key,
+        they are encoded for every message at their place in `attr_dict`.
 
-        return attr_raw_hex
+        :param attr_dict: bgp attribute dictionary
+        :param cache: LRU cache, None means no cache
+        :param asn4: support 4 bytes asn or not
+        """
+        if cache is None or bgp_cons.BGPTYPE_PMSI_TUNNEL in attr_dict:
+            # PMSI tunnel depends on the MP_REACH_NLRI value
+            return Update.construct_attributes(attr_dict, asn4)
+        mp_types = (bgp_cons.BGPTYPE_MP_REACH_NLRI, bgp_cons.BGPTYPE_MP_UNREACH_NLRI)
+        items = [(type_code, value) for type_code, value in attr_dict.items() if type_code not in mp_types]
+        try:
+            key = (asn4, tuple((type_code, nlri_key(value)) for type_code, value in items))
+            hash(key)
+        except TypeError:
+            return Update.construct_attributes(attr_dict, asn4)
+        encoded = cache.get(key)
+        if encoded is None:
+            encoded = tuple(Update.construct_attributes({type_code: value}, asn4) for type_code, value in items)
+            cache.put(key, encoded)
+        if len(items) == len(attr_dict):
+            return b''.join(encoded)
+        enc = encoder.Encoder()
+        position = 0
+        for type_code, value in attr_dict.items():
+            if type_code in mp_types:
+                Update.construct_attributes({type_code: value}, asn4, enc)
+            else:
+                enc.put(encoded[position])
+                position += 1
+        return enc.getvalue()
 
     @staticmethod
     def construct_header(msg):
@@ -498,7 +808,7 @@ class Update(object):
         # ---------------+--------+---------+------+
         #    Maker      | Length |  Type   |  msg |
         # ---------------+--------+---------+------+
-        return b'\xff' * 16 + struct.pack('!HB', len(msg) + 19, 2) + msg
+        return encoder.MSG_HEADER.pack(encoder.MARKER, len(msg) + 19, bgp_cons.MSG_UPDATE) + msg
 
     @staticmethod
     def construct_prefix_v4(prefix_list, add_path=False):
@@ -508,20 +818,256 @@ class Update(object):
         :param prefix_list: prefix list
         :param add_path: support add path or not
         """
-        nlri_raw_hex = b''
+        enc = encoder.Encoder()
         for prefix in prefix_list:
-            if add_path and isinstance(prefix, dict):
-                path_id = prefix.get('path_id')
-                prefix = prefix.get('prefix')
-                nlri_raw_hex += struct.pack('!I', path_id)
-            masklen = prefix.split('/')[1]
-            ip_hex = struct.pack('!I', netaddr.IPNetwork(prefix).value)
-            masklen = int(masklen)
-            if 16 < masklen <= 24:
-                ip_hex = ip_hex[0:3]
-            elif 8 < masklen <= 16:
-                ip_hex = ip_hex[0:2]
-            elif masklen <= 8:
-                ip_hex = ip_hex[0:1]
-            nlri_raw_hex += struct.pack('!B', masklen) + ip_hex
-        return nlri_raw_hex
+            enc.put_prefix_v4(prefix, add_path)
+        return enc.getvalue()
+
+
+class LazyAttributes(Mapping):
+    """
+    Path attributes of one UPDATE message which are only located when
+    the message is received, each attribute is decoded the first time
+    it is read and the decoded value is kept for later reads.
+
+    `raw_key` is made of the raw attributes, the RIB shares one attribute
+    set between the messages with the same key without decoding them.
+    """
+
+    def __init__(self, data, asn4=False, afi_add_path=None):
+        """
+        :param data: raw path attributes
+        :param asn4: support 4 bytes asn or not
+        :param afi_add_path: support add path or not in afi/safi
+        """
+        self.data = data
+        self.asn4 = asn4
+        self.afi_add_path = afi_add_path
+        # {<type code>: (<value start>, <value end>)}
+        self.offsets = {}
+        self.index_error = None
+        self.raw_key = (data, asn4)
+        self._values = {}
+        self._route_attributes = None
+        self._index()
+
+    def _index(self):
+        """record the value offsets of every attribute in one pass"""
+        pos = 0
+        total = len(self.data)
+        while pos < total:
+            if total - pos < 3:
+                break
+            flags, type_code, attr_len = struct.unpack_from('!BBB', self.data, pos)
+            if flags & AttributeFlag.EXTENDED_LENGTH:
+                if total - pos < 4:
+                    break
+                attr_len = struct.unpack_from('!H', self.data, pos + 2)[0]
+                start = pos + 4
+            else:
+                start = pos + 3
+            pos = start + attr_len
+            if pos > total:
+                break
+            self.offsets[type_code] = (start, pos)
+        if pos != total:
+            self.index_error = excep.UpdateMessageError(
+                sub_error=bgp_cons.ERR_MSG_UPDATE_ATTR_LEN,
+                data='')
+
+    def check(self):
+        """
+        Check the attributes like `Update.parse_attributes` does. The
+        well-known and MP attributes are decoded at once, the attributes in
+        `LENGTH_CHECKED_ATTRS` only have their length checked.
+
+        :return: the error of the first malformed attribute or None
+        """
+        if self.index_error is not None:
+            # report the error of the eager parser if it finds one
+            try:
+                Update.parse_attributes(self.data, self.asn4, self.afi_add_path)
+            except excep.UpdateMessageError as e:
+                return e
+            return self.index_error
+        try:
+            for type_code, (start, end) in self.offsets.items():
+                size = LENGTH_CHECKED_ATTRS.get(type_code)
+                if size is None or (end - start) % size:
+                    # a bad length is reported by decoding the attribute
+                    self[type_code]
+        except excep.UpdateMessageError as e:
+            return e
+        return None
+
+    def route_attributes(self):
+        """
+        The attributes stored with the MP_REACH_NLRI routes, the same as
+        `yabgp.core.rib.route_attr` without decoding the attributes. The
+        raw value of MP_REACH_NLRI still has the NLRI.
+
+        :return: LazyAttributes without MP_UNREACH_NLRI and the NLRI
+        """
+        if self._route_attributes is None:
+            attr = LazyAttributes.__new__(LazyAttributes)
+            attr.data = self.data
+            attr.asn4 = self.asn4
+            attr.afi_add_path = self.afi_add_path
+            attr.index_error = self.index_error
+            attr.offsets = dict(
+                (type_code, offset) for type_code, offset in self.offsets.items()
+                if type_code != bgp_cons.BGPTYPE_MP_UNREACH_NLRI)
+            attr._values = dict(
+                (type_code, value) for type_code, value in self._values.items()
+                if type_code in attr.offsets)
+            attr._route_attributes = attr
+            mp_reach = None
+            if bgp_cons.BGPTYPE_MP_REACH_NLRI in attr.offsets:
+                mp_reach = dict((k, v) for k, v in self[bgp_cons.BGPTYPE_MP_REACH_NLRI].items() if k != 'nlri')
+                attr._values[bgp_cons.BGPTYPE_MP_REACH_NLRI] = mp_reach
+            attr.raw_key = (
+                tuple((type_code, self.data[start:end]) for type_code, (start, end) in attr.offsets.items()
+                      if type_code != bgp_cons.BGPTYPE_MP_REACH_NLRI),
+                self.asn4, nlri_key(mp_reach))
+            self._route_attributes = attr
+        return self._route_attributes
+
+    def raw(self, type_code):
+        """return the undecoded value of one attribute"""
+        start, end = self.offsets[type_code]
+        return self.data[start:end]
+
+    def _bgpls_protocol_id(self):
+        mp_reach = self.get(bgp_cons.BGPTYPE_MP_REACH_NLRI)
+        if mp_reach and mp_reach['nlri'][0] and type(mp_reach['nlri'][0]) is dict:
+            return mp_reach['nlri'][0].get("protocol_id") or None
+        return None
+
+    def _decode(self, type_code):
+        attr_value = self.raw(type_code)
+        if type_code == bgp_cons.BGPTYPE_LINK_STATE:
+            return LinkState.unpack(bgpls_pro_id=self._bgpls_protocol_id(), data=attr_value).value
+        if type_code == bgp_cons.BGPTYPE_PMSI_TUNNEL:
+            evpn_overlay = EVPN.signal_evpn_overlay({
+                bgp_cons.BGPTYPE_MP_REACH_NLRI: self.get(bgp_cons.BGPTYPE_MP_REACH_NLRI),
+                bgp_cons.BGPTYPE_EXTENDED_COMMUNITY: self.get(bgp_cons.BGPTYPE_EXTENDED_COMMUNITY)})
+            if evpn_overlay['evpn'] and evpn_overlay['encap_ec']:
+                return PMSITunnel.parse(value=attr_value, evpn_overlay=evpn_overlay)
+        return Update.parse_attribute(type_code, attr_value, self.asn4, self.afi_add_path)
+
+    def __getitem__(self, type_code):
+        if type_code in self._values:
+            return self._values[type_code]
+        if type_code not in self.offsets:
+            raise KeyError(type_code)
+        try:
+            value = self._decode(type_code)
+        except excep.UpdateMessageError:
+            raise
+        except Exception as e:
+            LOG.error(e)
+            LOG.debug(traceback.format_exc())
+            raise excep.UpdateMessageError(
+                sub_error=bgp_cons.ERR_MSG_UPDATE_MALFORMED_ATTR_LIST,
+                data='')
+        self._values[type_code] = value
+        return value
+
+    def __contains__(self, type_code):
+        return type_code in self.offsets
+
+    def __iter__(self):
+        return iter(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def decode_all(self):
+        """
+        Decode every attribute, the same as `Update.parse_attributes`.
+
+        :return: attribute dictionary
+        """
+        attributes = {}
+        try:
+            for type_code in self.offsets:
+                attributes[type_code] = self[type_code]
+        except excep.UpdateMessageError as e:
+            raise excep.UpdateMessageError(
+                sub_error=e.sub_error,
+                data=e.data,
+                sub_results=attributes)
+        if self.index_error:
+            error = self.check()
+            raise excep.UpdateMessageError(
+                sub_error=error.sub_error,
+                data=error.data,
+                sub_results=attributes)
+        return attributes
+
+
+class UpdateView(object):
+    """
+    Lazy parsing of a BGP Update message. Withdrawn routes and NLRI are
+    parsed at once, path attributes are checked at once with the same
+    errors as `Update.parse` (see `LazyAttributes.check`) and the other
+    attributes are decoded only when they are read through `attr`.
+    """
+
+    def __init__(self, t, msg_hex, asn4=False, afi_add_path=None):
+        """
+        :param t: timestamp
+        :param msg_hex: raw message
+        :param asn4: support 4 bytes AS or not
+        :param afi_add_path: support add-path or not in each afi/safi
+        """
+        self.time = t
+        self.hex = msg_hex
+        self.withdraw = []
+        self.nlri = []
+        self.sub_error = None
+        self.err_data = None
+
+        withdraw_len = struct.unpack('!H', msg_hex[:2])[0]
+        withdraw_prefix_data = msg_hex[2:withdraw_len + 2]
+        attr_len = struct.unpack('!H', msg_hex[withdraw_len + 2:withdraw_len + 4])[0]
+        attribute_data = msg_hex[withdraw_len + 4:withdraw_len + 4 + attr_len]
+        nlri_data = msg_hex[withdraw_len + 4 + attr_len:]
+        try:
+            add_path = afi_add_path.get('ipv4', False) if afi_add_path else False
+            self.withdraw = Update.parse_prefix_list(withdraw_prefix_data, add_path)
+            self.nlri = Update.parse_prefix_list(nlri_data, add_path)
+        except Exception as e:
+            LOG.error(e)
+            LOG.debug(traceback.format_exc())
+            self.sub_error = bgp_cons.ERR_MSG_UPDATE_INVALID_NETWORK_FIELD
+            self.err_data = ''
+        self.attr = LazyAttributes(attribute_data, asn4, afi_add_path)
+        error = self.attr.check()
+        if error is not None:
+            LOG.error(error)
+            self.sub_error = error.sub_error
+            self.err_data = error.data
+
+    def to_dict(self):
+        """
+        Decode all path attributes.
+
+        :return: the same dictionary as `Update.parse` returns.
+        """
+        results = {
+            "withdraw": self.withdraw,
+            "attr": None,
+            "nlri": self.nlri,
+            'time': self.time,
+            'hex': self.hex,
+            'sub_error': self.sub_error,
+            'err_data': self.err_data}
+        try:
+            results['attr'] = self.attr.decode_all()
+        except excep.UpdateMessageError as e:
+            LOG.error(e)
+            results['sub_error'] = e.sub_error
+            results['err_data'] = e.data
+            results['attr'] = e.sub_results
+        return results
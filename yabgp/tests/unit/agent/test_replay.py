@@ -0,0 +1,99 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Test message replay
+"""
+
+import binascii
+import io
+import unittest
+
+import simplejson as json
+from oslo_config import cfg
+
+from yabgp import config  # noqa
+from yabgp.agent.replay import Replayer
+from yabgp.common import mrt
+from yabgp.message.keepalive import KeepAlive
+
+CONF = cfg.CONF
+
+# ORIGIN IGP, AS_PATH empty, NEXT_HOP 1.1.1.1, nlri 10.1.1.0/24 and 10.1.2.0/24
+UPDATE = b'\xff' * 16 + b'\x00\x2d\x02\x00\x00\x00\x0e\x40\x01\x01\x00\x40\x02\x00' \
+    b'\x40\x03\x04\x01\x01\x01\x01\x18\x0a\x01\x01\x18\x0a\x01\x02'
+WITHDRAW = b'\xff' * 16 + b'\x00\x1b\x02\x00\x04\x18\x0a\x01\x01\x00\x00'
+
+
+class TestReplay(unittest.TestCase):
+
+    def setUp(self):
+        CONF.set_override('rib', True, 'bgp')
+        CONF.set_override('afi_safi', ['ipv4'], 'bgp')
+        self.replayer = Replayer()
+
+    def tearDown(self):
+        CONF.clear_override('rib', 'bgp')
+        CONF.clear_override('afi_safi', 'bgp')
+
+    def test_replay_mrt(self):
+        fh = io.BytesIO()
+        for data in (UPDATE, KeepAlive().construct(), WITHDRAW):
+            fh.write(mrt.pack_message(1.5, 100, 200, '10.0.0.1', '10.0.0.2', data))
+        fh.write(mrt.pack_message(1.5, 200, 100, '10.0.0.1', '10.0.0.2', UPDATE, local=True))
+        fh.seek(0)
+        self.replayer.replay_mrt(fh)
+        self.replayer.flush()
+        stats = self.replayer.stats()
+        self.assertEqual(3, stats['messages'])
+        self.assertEqual(2, stats['updates'])
+        self.assertEqual(3, stats['prefixes'])
+        self.assertEqual(2, stats['latency']['ipv4']['updates'])
+        self.assertEqual(1, stats['rib']['ipv4'])
+        rib = self.replayer.protocol.adj_rib_in['ipv4']
+        self.assertEqual(['10.1.2.0/24'], [prefix for prefix, _ in rib.routes()])
+
+    def test_replay_hex(self):
+        fh = io.StringIO(u'%s\n\n0x%s\n' % (
+            binascii.hexlify(UPDATE + UPDATE).decode(), binascii.hexlify(WITHDRAW).decode()))
+        self.replayer.replay_hex(fh)
+        self.replayer.flush()
+        stats = self.replayer.stats()
+        self.assertEqual(2, stats['messages'])
+        self.assertEqual(3, stats['updates'])
+        self.assertEqual(5, stats['prefixes'])
+        self.assertEqual(1, stats['rib']['ipv4'])
+
+    def test_replay_json(self):
+        records = [
+            {'t': 1.5, 'seq': 1, 'type': 2, 'msg': {
+                'attr': {'1': 0, '2': [], '3': '1.1.1.1'}, 'nlri': ['10.1.1.0/24'], 'withdraw': []}},
+            {'t': 1.5, 'seq': 2, 'type': 4, 'msg': None},
+            {'t': 1.5, 'seq': 3, 'type': 2, 'msg': {
+                'attr': {'1': 0, '2': [], '14': {
+                    'afi_safi': [2, 1], 'nexthop': '2001::1', 'nlri': ['2001:db8::/32']}},
+                'nlri': [], 'withdraw': []}}
+        ]
+        fh = io.StringIO(u''.join(json.dumps(record) + '\n' for record in records))
+        self.replayer.replay_json(fh)
+        self.replayer.flush()
+        stats = self.replayer.stats()
+        self.assertEqual(2, stats['messages'])
+        self.assertEqual(2, stats['prefixes'])
+        self.assertEqual(['ipv4', 'ipv6'], sorted(stats['latency']))
+        self.assertEqual(1, stats['rib']['ipv4'])
+
+
+if __name__ == '__main__':
+    unittest.main()
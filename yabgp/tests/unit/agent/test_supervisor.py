@@ -0,0 +1,186 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Test the supervisor of the worker processes
+"""
+
+import base64
+import io
+import json
+import os
+import time
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from yabgp import config  # noqa
+from yabgp.agent import supervisor
+from yabgp.agent.supervisor import HashRing
+from yabgp.agent.supervisor import Supervisor
+from yabgp.api.app import supervisor_app
+
+
+def peers(count):
+    return [{'remote_addr': '10.0.%s.%s' % (i // 256, i % 256), 'remote_as': 65001} for i in range(count)]
+
+
+class TestHashRing(unittest.TestCase):
+
+    def test_balance(self):
+        ring = HashRing(range(4))
+        counts = [0] * 4
+        for i in range(4000):
+            counts[ring.get('10.0.%s.%s' % (i // 256, i % 256))] += 1
+        for count in counts:
+            self.assertTrue(600 < count < 1400, counts)
+
+    def test_add_node_moves_its_keys_only(self):
+        ring = HashRing(range(4))
+        new_ring = HashRing(range(5))
+        keys = ['10.0.%s.%s' % (i // 256, i % 256) for i in range(4000)]
+        moved = [key for key in keys if ring.get(key) != new_ring.get(key)]
+        self.assertTrue(all(new_ring.get(key) == 4 for key in moved))
+        self.assertTrue(len(moved) < 1400)
+
+
+class TestSupervisor(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('yabgp.agent.supervisor.reactor')
+        self.reactor = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.supervisor = Supervisor(peers(20), 3, ['--bgp-local_as', '65000'], base_port=9000)
+        self.addCleanup(self.supervisor.stop)
+
+    def test_shard(self):
+        self.assertEqual(20, sum(len(worker.peers) for worker in self.supervisor.workers))
+        for worker in self.supervisor.workers:
+            self.assertEqual(9000 + worker.index, worker.port)
+            with open(worker.config_file) as f:
+                self.assertEqual(worker.peers, json.load(f))
+            for peer in worker.peers:
+                self.assertIs(worker, self.supervisor.get_worker(peer['remote_addr']))
+        self.assertIsNone(self.supervisor.get_worker('10.1.0.1'))
+
+    def test_worker_args(self):
+        worker = self.supervisor.workers[0]
+        args = self.supervisor.worker_args(worker)
+        self.assertEqual(['--bgp-local_as', '65000'], args[:2])
+        self.assertEqual(worker.config_file, args[args.index('--bgp-config_file') + 1])
+        self.assertEqual(str(worker.port), args[args.index('--rest-bind_port') + 1])
+        self.assertEqual('0', args[args.index('--workers') + 1])
+
+    def test_restart(self):
+        worker = self.supervisor.workers[0]
+        worker.process = mock.Mock(exitcode=1)
+        worker.process.is_alive.return_value = False
+        worker.started = time.time()
+        self.supervisor.check()
+        self.assertEqual(1, worker.restarts)
+        self.reactor.callLater.assert_called_once_with(1, self.supervisor.spawn, worker)
+        self.assertIsNone(worker.process)
+        # crashed again soon after starting, wait longer
+        worker.process = mock.Mock(exitcode=1)
+        worker.process.is_alive.return_value = False
+        self.supervisor.check()
+        self.assertEqual(2, worker.restart_delay)
+        # a worker which ran for long is restarted at once
+        worker.process = mock.Mock(exitcode=1)
+        worker.process.is_alive.return_value = False
+        worker.started = time.time() - supervisor.WORKER_STABLE_TIME - 1
+        self.supervisor.check()
+        self.assertEqual(0, worker.restart_delay)
+
+    def test_no_restart_when_stopping(self):
+        config_dir = self.supervisor.config_dir
+        self.supervisor.stop()
+        self.assertFalse(os.path.exists(config_dir))
+        worker = self.supervisor.workers[0]
+        self.supervisor.spawn(worker)
+        self.assertIsNone(worker.process)
+
+
+class TestProxy(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('yabgp.agent.supervisor.reactor')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.supervisor = Supervisor(peers(4), 2, [], base_port=9000)
+        self.addCleanup(self.supervisor.stop)
+        for worker in self.supervisor.workers:
+            worker.process = mock.Mock(pid=100 + worker.index)
+            worker.process.is_alive.return_value = True
+        supervisor.set_supervisor(self.supervisor)
+        self.addCleanup(supervisor.set_supervisor, None)
+        self.app = supervisor_app.test_client()
+        credentials = base64.b64encode(b'admin:admin').decode('ascii')
+        self.headers = {'Authorization': 'Basic %s' % credentials}
+
+    def response(self, body, status=200):
+        response = mock.MagicMock(status=status, headers={'Content-Type': 'application/json'})
+        stream = io.BytesIO(json.dumps(body).encode('utf-8'))
+        response.read.side_effect = stream.read
+        response.__enter__.return_value = response
+        return response
+
+    @mock.patch('yabgp.api.proxy._open')
+    def test_forward(self, mock_open):
+        mock_open.return_value = self.response({'status': True})
+        result = self.app.post(
+            '/v1/peer/10.0.0.2/send/update?x=1', headers=self.headers, data='{"nlri": []}',
+            content_type='application/json')
+        self.assertEqual(200, result.status_code)
+        self.assertEqual({'status': True}, json.loads(result.data))
+        worker, path = mock_open.call_args[0]
+        self.assertIs(self.supervisor.get_worker('10.0.0.2'), worker)
+        self.assertEqual('/v1/peer/10.0.0.2/send/update?x=1', path)
+        self.assertEqual('POST', mock_open.call_args[1]['method'])
+        self.assertEqual(b'{"nlri": []}', mock_open.call_args[1]['data'])
+        self.assertEqual(self.headers['Authorization'], mock_open.call_args[1]['headers']['Authorization'])
+
+    def test_unknown_peer(self):
+        result = self.app.get('/v1/peer/10.1.0.1/state', headers=self.headers)
+        self.assertFalse(json.loads(result.data)['status'])
+
+    def test_worker_down(self):
+        worker = self.supervisor.get_worker('10.0.0.1')
+        worker.process.is_alive.return_value = False
+        result = self.app.get('/v1/peer/10.0.0.1/state', headers=self.headers)
+        self.assertEqual(503, result.status_code)
+        self.assertIn('Retry-After', result.headers)
+
+    @mock.patch('yabgp.api.proxy._open')
+    def test_statistic(self, mock_open):
+        mock_open.side_effect = lambda worker, path, **kwargs: self.response({
+            'peers': len(worker.peers), 'established': 1,
+            'send': {'Updates': 10}, 'receive': {'Updates': 5, 'Keepalives': 1}})
+        result = json.loads(self.app.get('/v1/statistic', headers=self.headers).data)
+        self.assertEqual(4, result['peers'])
+        self.assertEqual(2, result['established'])
+        self.assertEqual({'Updates': 20}, result['send'])
+        self.assertEqual({'Updates': 10, 'Keepalives': 2}, result['receive'])
+
+    def test_workers(self):
+        result = json.loads(self.app.get('/v1/workers', headers=self.headers).data)
+        self.assertEqual(4, result['peers'])
+        self.assertEqual([100, 101], [worker['pid'] for worker in result['workers']])
+
+
+if __name__ == '__main__':
+    unittest.main()
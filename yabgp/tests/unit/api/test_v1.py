@@ -15,8 +15,22 @@
 
 """Test v1 api"""
 
+import base64
+import json
 import unittest
+import zlib
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from yabgp import config  # noqa
+from yabgp.api import utils as api_utils
 from yabgp.api.app import app
+from yabgp.core.peers import get_registry
+from yabgp.core.protocol import BGP
+from yabgp.tests.unit.core.test_peers import peering
 
 
 class FlaskrTestCase(unittest.TestCase):
@@ -39,5 +53,153 @@ class FlaskrTestCase(unittest.TestCase):
     def test_v1_peer(self):
         self.assertTrue(self.app.get('/v1/peer'))
 
+
+class TestAdjRIBDump(unittest.TestCase):
+
+    def setUp(self):
+        config.CONF.set_override('rib', True, group='bgp')
+        self.addCleanup(config.CONF.clear_override, 'rib', group='bgp')
+        registry = get_registry()
+        registry.clear()
+        self.addCleanup(registry.clear)
+        bgp_peering = peering('10.0.0.2', afi_safi=['ipv4', 'flowspec'])
+        registry.add(bgp_peering)
+        self.protocol = BGP()
+        self.protocol.factory = bgp_peering
+        self.protocol.init_rib()
+        bgp_peering.fsm.protocol = self.protocol
+        for i in range(2500):
+            self.protocol.adj_rib_in['ipv4'].update('10.%s.%s.0/24' % (i // 256, i % 256), {1: i % 3})
+        self.protocol.adj_rib_in['flowspec'].update({1: '10.0.0.0/24'}, {1: 0})
+        self.protocol.publish_rib()
+        self.app = app.test_client()
+        credentials = base64.b64encode(b'admin:admin').decode('ascii')
+        self.headers = {'Authorization': 'Basic %s' % credentials}
+
+    def dump(self, path, **kwargs):
+        result = self.app.get(path, headers=dict(self.headers, **kwargs))
+        self.assertEqual('application/x-ndjson', result.mimetype)
+        data = result.data
+        if result.headers.get('Content-Encoding') == 'gzip':
+            data = zlib.decompress(data, 16 + zlib.MAX_WBITS)
+        return [json.loads(line) for line in data.decode('utf-8').splitlines()]
+
+    def test_dump(self):
+        lines = self.dump('/v1/peer/10.0.0.2/adj-rib-in/ipv4')
+        routes = [line for line in lines if 'cursor' not in line]
+        self.assertEqual(2500, len(routes))
+        self.assertEqual(2500, len(set(route['prefix'] for route in routes)))
+        self.assertEqual({'1': 0}, [route for route in routes if route['prefix'] == '10.0.3.0/24'][0]['attr'])
+        # a cursor line after every chunk and at the end
+        self.assertEqual(2, len([line for line in lines[:-1] if 'cursor' in line]))
+        self.assertEqual({'cursor': None, 'count': 2500, 'version': self.protocol.rib_snapshot.version}, lines[-1])
+
+    def test_resume(self):
+        lines = self.dump('/v1/peer/10.0.0.2/adj-rib-in/ipv4?limit=1500')
+        self.assertEqual(1500, lines[-1]['count'])
+        cursor = lines[-1]['cursor']
+        # the dump goes on from the same snapshot
+        self.protocol.adj_rib_in['ipv4'].update('11.0.0.0/8', {1: 0})
+        self.protocol.publish_rib()
+        rest = self.dump('/v1/peer/10.0.0.2/adj-rib-in/ipv4?cursor=%s' % cursor, **{'Accept-Encoding': 'gzip'})
+        self.assertEqual({'cursor': None, 'count': 1000, 'version': lines[-1]['version']}, rest[-1])
+        prefixes = [line['prefix'] for line in lines + rest if 'prefix' in line]
+        self.assertEqual(2500, len(set(prefixes)))
+        self.assertNotIn('11.0.0.0/8', prefixes)
+
+    def test_expired_cursor(self):
+        config.CONF.set_override('rib_dump_snapshots', 0, group='bgp')
+        self.addCleanup(config.CONF.clear_override, 'rib_dump_snapshots', group='bgp')
+        self.assertFalse(self.app.get(
+            '/v1/peer/10.0.0.2/adj-rib-in/ipv4?cursor=1000-0-0-0', headers=self.headers).json['status'])
+        self.assertFalse(self.app.get(
+            '/v1/peer/10.0.0.2/adj-rib-in/ipv4?cursor=x', headers=self.headers).json['status'])
+
+    def test_hashed(self):
+        self.assertEqual(
+            [{'nlri': {'1': '10.0.0.0/24'}, 'attr': {'1': 0}}],
+            self.dump('/v1/peer/10.0.0.2/adj-rib-in/flowspec')[:-1])
+        self.assertEqual([{'cursor': None, 'count': 0, 'version': self.protocol.rib_snapshot.version}],
+                         self.dump('/v1/peer/10.0.0.2/adj-rib-out/ipv4'))
+        self.assertFalse(self.app.get('/v1/peer/10.0.0.2/adj-rib-in/evpn', headers=self.headers).json['status'])
+
+    def test_gzip_chunks(self):
+        chunks = list(api_utils.gzip_chunks(['a\n', 'b\n']))
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        # each chunk can be decompressed at once
+        self.assertEqual(b'a\n', decompressor.decompress(chunks[0]))
+        self.assertEqual(b'a\nb\n', zlib.decompress(b''.join(chunks), 16 + zlib.MAX_WBITS))
+
+
+class TestSendUpdates(unittest.TestCase):
+
+    def setUp(self):
+        config.CONF.set_override('rib', True, group='bgp')
+        self.addCleanup(config.CONF.clear_override, 'rib', group='bgp')
+        registry = get_registry()
+        registry.clear()
+        self.addCleanup(registry.clear)
+        bgp_peering = peering('10.0.0.2')
+        registry.add(bgp_peering)
+        self.protocol = BGP()
+        self.protocol.factory = bgp_peering
+        self.protocol.init_rib()
+        self.protocol.writer = mock.Mock()
+        self.protocol.writer.wait_writable.return_value = True
+        bgp_peering.fsm.protocol = self.protocol
+        for target in ['yabgp.api.utils._ready_to_send_msg', 'yabgp.api.utils.get_peer_conf_and_state']:
+            patcher = mock.patch(target)
+            patcher.start().return_value = {'peer': {'remote_as': 65001, 'local_as': 65000}}
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch('yabgp.api.utils.threads.blockingCallFromThread',
+                             side_effect=lambda reactor, f, *args: f(*args))
+        self.reactor_calls = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.app = app.test_client()
+        credentials = base64.b64encode(b'admin:admin').decode('ascii')
+        self.headers = {'Authorization': 'Basic %s' % credentials}
+
+    def post(self, updates):
+        return self.app.post('/v1/peer/10.0.0.2/send/updates', headers=self.headers,
+                             json={'updates': updates}).get_json()
+
+    def test_send(self):
+        result = self.post([
+            {'attr': {'1': 0, '3': '10.0.0.1'}, 'nlri': ['10.1.0.0/24']},
+            {'attr': {'1': 0, '3': '10.0.0.1'}, 'nlri': ['10.2.0.0/24']}])
+        self.assertTrue(result['status'])
+        # one reactor call for all the updates
+        self.assertEqual(1, self.reactor_calls.call_count)
+        self.assertEqual(2, len(self.protocol.adj_rib_out['ipv4']))
+        self.assertEqual(1, self.protocol.writer.write.call_count)
+
+    def test_nothing_saved_when_one_update_is_invalid(self):
+        version = dict(self.protocol.send_version)
+        result = self.post([
+            {'attr': {'1': 0, '3': '10.0.0.1'}, 'nlri': ['10.1.0.0/24']},
+            {'attr': {'1': 0}}])
+        self.assertFalse(result['status'])
+        self.assertEqual(0, len(self.protocol.adj_rib_out['ipv4']))
+        self.assertEqual(version, self.protocol.send_version)
+        self.assertFalse(self.protocol.writer.write.called)
+
+    def test_nothing_saved_when_one_prefix_is_invalid(self):
+        version = dict(self.protocol.send_version)
+        result = self.post([
+            {'attr': {'1': 0, '3': '10.0.0.1'}, 'nlri': ['10.1.0.0/24'], 'withdraw': ['10.3.0.0/24']},
+            {'attr': {'1': 0, '3': '10.0.0.1'}, 'nlri': ['10.300.0.0/24']}])
+        self.assertFalse(result['status'])
+        self.assertEqual(0, len(self.protocol.adj_rib_out['ipv4']))
+        self.assertEqual(version, self.protocol.send_version)
+        self.assertFalse(self.protocol.writer.write.called)
+
+    def test_reject_update_which_is_not_an_object(self):
+        for update in ['10.1.0.0/24', 1, None, ['10.1.0.0/24']]:
+            result = self.post([{'attr': {'1': 0, '3': '10.0.0.1'}, 'nlri': ['10.1.0.0/24']}, update])
+            self.assertEqual({'status': False, 'code': 'please check your post data'}, result)
+        self.assertEqual(0, len(self.protocol.adj_rib_out['ipv4']))
+        self.assertFalse(self.protocol.writer.write.called)
+
+
 if __name__ == '__main__':
     unittest.main()
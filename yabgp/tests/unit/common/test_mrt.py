@@ -0,0 +1,59 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Test MRT records
+"""
+
+import io
+import tempfile
+import unittest
+
+from yabgp.common import mrt
+from yabgp.message.keepalive import KeepAlive
+
+
+class TestMRT(unittest.TestCase):
+
+    def test_pack_message(self):
+        data = KeepAlive().construct()
+        record = mrt.pack_message(1.5, 100, 200, '10.0.0.1', '10.0.0.2', data)
+        self.assertEqual(
+            b'\x00\x00\x00\x01\x00\x11\x00\x04\x00\x00\x00\x2b'
+            b'\x00\x07\xa1\x20'
+            b'\x00\x00\x00\x64\x00\x00\x00\xc8\x00\x00\x00\x01'
+            b'\x0a\x00\x00\x01\x0a\x00\x00\x02' + data, record)
+
+    def test_read_records(self):
+        data = KeepAlive().construct()
+        records = mrt.pack_message(1.25, 100, 200, '2001::1', '2001::2', data, local=True) + \
+            mrt.pack_state_change(2.0, 100, 200, '2001::1', '2001::2', 6, 1)
+        result = list(mrt.read_records(io.BytesIO(records + records[:10])))
+        self.assertEqual(2, len(result))
+        timestamp, mrt_type, subtype, body = result[0]
+        self.assertEqual((1.25, mrt.MRT_BGP4MP_ET, mrt.BGP4MP_MESSAGE_AS4_LOCAL), (timestamp, mrt_type, subtype))
+        self.assertEqual((100, 200, '2001::1', '2001::2', data), mrt.parse_message(subtype, body))
+        self.assertEqual(mrt.BGP4MP_STATE_CHANGE_AS4, result[1][2])
+
+    def test_count_records(self):
+        record = mrt.pack_message(1.0, 100, 200, '10.0.0.1', '10.0.0.2', KeepAlive().construct())
+        with tempfile.TemporaryFile() as fh:
+            fh.write(record * 3 + record[:30])
+            fh.flush()
+            fh.seek(0)
+            self.assertEqual((3, len(record) * 3), mrt.count_records(fh))
+
+
+if __name__ == '__main__':
+    unittest.main()
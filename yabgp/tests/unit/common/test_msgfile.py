@@ -0,0 +1,88 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Test compressed message files
+"""
+
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from yabgp.common import mrt
+from yabgp.common import msgfile
+from yabgp.common import msgindex
+from yabgp.message.keepalive import KeepAlive
+
+
+class TestMessageFile(unittest.TestCase):
+
+    def setUp(self):
+        self.msg_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.msg_dir)
+
+    def write_json(self, count, interval):
+        file_name = os.path.join(self.msg_dir, '1.0.msg')
+        index_file = msgindex.open_index(file_name)
+        with open(file_name, 'w') as f:
+            for seq in range(1, count + 1):
+                if seq == 1 or seq % interval == 0:
+                    index_file.write(msgindex.ENTRY.pack(seq, f.tell()))
+                f.write(json.dumps({'seq': seq, 't': 1.0, 'type': 2, 'msg': {}}) + '\n')
+        index_file.close()
+        return file_name
+
+    def test_compress_json(self):
+        file_name = self.write_json(25, 10)
+        new_name = msgfile.compress_file(file_name)
+        self.assertEqual(file_name + '.gz', new_name)
+        self.assertFalse(os.path.exists(file_name))
+        self.assertFalse(os.path.exists(msgindex.index_file_name(file_name)))
+        # one gzip member for each indexed block
+        entries = msgindex.read_index(new_name)
+        self.assertEqual([1, 10, 20], [seq for seq, offset in entries])
+        with open(new_name, 'rb') as f:
+            f.seek(entries[1][1])
+            self.assertEqual(b'{"seq": 10', gzip.GzipFile(fileobj=f).readline()[:10])
+        # the whole file is still a gzip file
+        with gzip.open(new_name, 'rb') as f:
+            self.assertEqual(25, len(f.readlines()))
+        self.assertEqual(list(range(1, 26)), [r['seq'] for r in msgfile.read_records(new_name)])
+        self.assertEqual(list(range(13, 26)), [r['seq'] for r in msgfile.read_records(new_name, 13)])
+
+    def test_compress_mrt(self):
+        file_name = os.path.join(self.msg_dir, '1.0.5.mrt')
+        with open(file_name, 'wb') as f:
+            for i in range(3):
+                f.write(mrt.pack_message(1.0, 100, 200, '1.1.1.1', '2.2.2.2', KeepAlive().construct()))
+        new_name = msgfile.compress_file(file_name)
+        self.assertTrue(msgfile.is_mrt(new_name))
+        records = list(msgfile.read_records(new_name, 6))
+        self.assertEqual([6, 7], [record[0] for record in records])
+        self.assertEqual(KeepAlive().construct(), mrt.parse_message(records[0][3], records[0][4])[4])
+
+    def test_read_uncompressed(self):
+        file_name = self.write_json(5, 2)
+        self.assertEqual([4, 5], [r['seq'] for r in msgfile.read_records(file_name, 4)])
+        self.assertEqual(msgfile.COMPRESS_NONE, msgfile.compress_method(file_name))
+        self.assertEqual(file_name, msgfile.base_name(file_name + '.zst'))
+
+
+if __name__ == '__main__':
+    unittest.main()
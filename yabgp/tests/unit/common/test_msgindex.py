@@ -0,0 +1,61 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Test message file index
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from yabgp.common import msgindex
+
+
+class TestMessageIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.msg_dir = tempfile.mkdtemp()
+        self.msg_file = os.path.join(self.msg_dir, '1.0.msg')
+        with open(self.msg_file, 'w') as f:
+            f.write('x' * 100)
+
+    def tearDown(self):
+        shutil.rmtree(self.msg_dir)
+
+    def test_index_file_name(self):
+        self.assertEqual(os.path.join(self.msg_dir, 'index', '1.0.msg.idx'), msgindex.index_file_name(self.msg_file))
+
+    def test_find_offset(self):
+        entries = [(5, 0), (10, 40), (20, 80)]
+        self.assertIsNone(msgindex.find_offset(entries, 4))
+        self.assertEqual((5, 0), msgindex.find_offset(entries, 9))
+        self.assertEqual((10, 40), msgindex.find_offset(entries, 10))
+        self.assertEqual((20, 80), msgindex.find_offset(entries, 100))
+
+    def test_read_and_last_entry(self):
+        self.assertEqual([], msgindex.read_index(self.msg_file))
+        self.assertIsNone(msgindex.last_entry(self.msg_file))
+        index_file = msgindex.open_index(self.msg_file)
+        index_file.write(msgindex.ENTRY.pack(5, 0) + msgindex.ENTRY.pack(10, 40))
+        # an incomplete entry
+        index_file.write(b'\x00' * 3)
+        index_file.close()
+        self.assertEqual([(5, 0), (10, 40)], msgindex.read_index(self.msg_file))
+        self.assertEqual((10, 40), msgindex.last_entry(self.msg_file))
+
+
+if __name__ == '__main__':
+    unittest.main()
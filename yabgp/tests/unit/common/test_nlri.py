@@ -0,0 +1,36 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+""" Test NLRI keys """
+
+import unittest
+
+from yabgp.common.nlri import nlri_key
+
+
+class TestNLRIKey(unittest.TestCase):
+
+    def test_nlri_key(self):
+        self.assertEqual(nlri_key({1: '10.0.0.0/24', 2: '20.0.0.0/24'}),
+                         nlri_key({'2': '20.0.0.0/24', '1': '10.0.0.0/24'}))
+
+    def test_list_key(self):
+        self.assertEqual(nlri_key([{'prefix': '10.0.0.0/24', 'label': [25]}]),
+                         nlri_key(({'label': (25,), 'prefix': '10.0.0.0/24'},)))
+        hash(nlri_key([{'prefix': '10.0.0.0/24', 'label': [25]}]))
+
+
+if __name__ == '__main__':
+    unittest.main()
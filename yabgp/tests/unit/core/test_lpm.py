@@ -0,0 +1,158 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Test batch longest prefix match
+"""
+
+import random
+import unittest
+
+from yabgp import config  # noqa
+from yabgp.api import utils as api_utils
+from yabgp.core.lpm import build_intervals
+from yabgp.core.lpm import LPMIndex
+from yabgp.core.peers import get_registry
+from yabgp.core.protocol import BGP
+from yabgp.core.rib import new_adj_rib
+from yabgp.core.rib import RIBSnapshot
+from yabgp.tests.unit.core.test_peers import peering
+
+
+def snapshot(rib):
+    return RIBSnapshot.take(rib.attr_table, {rib.afi_safi: rib}, {}).adj_rib_in[rib.afi_safi]
+
+
+def random_prefix(rand):
+    length = rand.choice([0, 8, 12, 15, 16, 20, 22, 24, 24, 24, 32])
+    ip = (rand.choice([10, 11]) << 24 | rand.getrandbits(24)) & ~((1 << (32 - length)) - 1)
+    return '%s.%s.%s.%s/%s' % (ip >> 24, ip >> 16 & 0xff, ip >> 8 & 0xff, ip & 0xff, length)
+
+
+def random_address(rand):
+    return '%s.%s.%s.%s' % (rand.choice([10, 11, 12]), rand.randint(0, 255), rand.randint(0, 255), rand.randint(0, 255))
+
+
+class TestLPMIndex(unittest.TestCase):
+
+    def match(self, rib, addresses):
+        snap_rib = snapshot(rib)
+        return [rib.unpack(key) if key is not None else None for key in self.index.match(snap_rib, addresses)]
+
+    def setUp(self):
+        self.rib = new_adj_rib('ipv4')
+        self.index = LPMIndex('ipv4')
+
+    def test_nested(self):
+        for prefix in ['10.0.0.0/8', '10.1.0.0/16', '10.1.2.0/24', '10.2.0.0/16']:
+            self.rib.update(prefix, {1: 0})
+        self.assertEqual(
+            ['10.0.0.0/8', '10.1.0.0/16', '10.1.2.0/24', '10.1.0.0/16', '10.2.0.0/16', '10.0.0.0/8', None],
+            self.match(self.rib, ['10.0.0.1', '10.1.0.1', '10.1.2.255', '10.1.3.0', '10.2.255.255', '10.3.0.0',
+                                  '11.0.0.0']))
+
+    def test_intervals(self):
+        keys = sorted(self.rib.pack(prefix) for prefix in ['10.0.0.0/8', '10.1.0.0/16'])
+        starts, matches = build_intervals(keys, 32)
+        self.assertEqual([10 << 24, 10 << 24 | 1 << 16, 10 << 24 | 2 << 16, 11 << 24], starts)
+        self.assertEqual([keys[0], keys[1], keys[0], None], matches)
+
+    def test_same_as_rib_lookup(self):
+        rand = random.Random(1)
+        addresses = [random_address(rand) for _ in range(2000)]
+        for _ in range(5):
+            # the index is refreshed from the changes
+            for _ in range(300):
+                prefix = random_prefix(rand)
+                if rand.random() < 0.3:
+                    self.rib.withdraw(prefix)
+                else:
+                    self.rib.update(prefix, {1: 0})
+            expected = [self.rib.lookup(address).get('prefix') for address in addresses]
+            self.assertEqual(expected, self.match(self.rib, addresses))
+        fresh = LPMIndex('ipv4')
+        fresh.refresh(snapshot(self.rib))
+        self.assertEqual(fresh.prefixes, self.index.prefixes)
+        self.assertEqual(fresh.intervals, self.index.intervals)
+        self.assertEqual(fresh.short_intervals, self.index.short_intervals)
+
+    def test_add_path(self):
+        self.rib.update({'prefix': '10.0.0.0/24', 'path_id': 1}, {1: 0})
+        self.rib.update({'prefix': '10.0.0.0/24', 'path_id': 2}, {1: 1})
+        self.assertEqual(['10.0.0.0/24'], self.match(self.rib, ['10.0.0.1']))
+        self.rib.withdraw({'prefix': '10.0.0.0/24', 'path_id': 1})
+        self.assertEqual(['10.0.0.0/24'], self.match(self.rib, ['10.0.0.1']))
+        self.rib.withdraw({'prefix': '10.0.0.0/24', 'path_id': 2})
+        self.assertEqual([None], self.match(self.rib, ['10.0.0.1']))
+        self.assertEqual(0, len(self.index))
+
+    def test_ipv6(self):
+        rib = new_adj_rib('ipv6')
+        self.index = LPMIndex('ipv6')
+        rib.update('2001:db8::/32', {1: 0})
+        rib.update('2001:db8:1::/48', {1: 0})
+        rib.update('2000::/3', {1: 0})
+        self.assertEqual(
+            ['2001:db8:1::/48', '2001:db8::/32', '2000::/3', None],
+            self.match(rib, ['2001:db8:1::1', '2001:db8:2::1', '2400::1', '::1']))
+
+    def test_invalid_address(self):
+        self.assertRaises(ValueError, self.match, self.rib, ['10.0.0'])
+        self.assertRaises(ValueError, self.match, self.rib, ['2001:db8::1'])
+
+
+class TestBatchLongestMatch(unittest.TestCase):
+
+    def setUp(self):
+        registry = get_registry()
+        registry.clear()
+        self.addCleanup(registry.clear)
+        bgp_peering = peering('10.0.0.2', afi_safi=['ipv4', 'ipv6', 'flowspec'])
+        registry.add(bgp_peering)
+        self.protocol = BGP()
+        self.protocol.factory = bgp_peering
+        self.protocol.init_rib()
+        bgp_peering.fsm.protocol = self.protocol
+        self.protocol.adj_rib_in['ipv4'].update('10.0.0.0/8', {1: 0})
+        self.protocol.adj_rib_in['ipv4'].update('10.1.0.0/16', {1: 1})
+        self.protocol.adj_rib_in['ipv6'].update('2001:db8::/32', {1: 2})
+        self.protocol.publish_rib()
+
+    def test_mixed_families(self):
+        result = self.protocol.batch_longest_match(
+            ['10.1.0.1', '2001:db8::1', '11.0.0.1', '10.2.0.1', '10.1.2.3'], attr=True)
+        self.assertEqual(self.protocol.rib_snapshot.version, result['version'])
+        prefixes = [result['prefixes'][i] if i >= 0 else None for i in result['data']]
+        self.assertEqual(['10.1.0.0/16', '2001:db8::/32', None, '10.0.0.0/8', '10.1.0.0/16'], prefixes)
+        self.assertEqual(3, len(result['prefixes']))
+        self.assertEqual({1: 1}, result['attr'][result['data'][0]])
+
+    def test_snapshot(self):
+        self.protocol.adj_rib_in['ipv4'].update('10.1.2.0/24', {1: 0})
+        # the change is not published yet
+        self.assertEqual(['10.1.0.0/16'], self.protocol.batch_longest_match(['10.1.2.1'], 'ipv4')['prefixes'])
+        self.protocol.publish_rib()
+        result = self.protocol.batch_longest_match(['10.1.2.1'], 'ipv4')
+        self.assertEqual(['10.1.2.0/24'], [result['prefixes'][i] for i in result['data']])
+
+    def test_api(self):
+        result = api_utils.batch_longest_match(['10.1.0.1'], peer_ip='10.0.0.2')
+        self.assertTrue(result['status'])
+        self.assertEqual(['10.1.0.0/16'], result['prefixes'])
+        self.assertFalse(api_utils.batch_longest_match(['10.1.0.1'], 'flowspec', peer_ip='10.0.0.2')['status'])
+        self.assertFalse(api_utils.batch_longest_match(['10.1.0'], peer_ip='10.0.0.2')['status'])
+
+
+if __name__ == '__main__':
+    unittest.main()
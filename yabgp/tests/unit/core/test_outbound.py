@@ -0,0 +1,176 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Test outbound message queue
+"""
+
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from yabgp.core.outbound import OutboundQueue
+from yabgp.core.outbound import OutboundWriter
+
+
+def update(nlri=None, withdraw=None):
+    return {'type': 'update', 'msg': {'attr': {1: 0}, 'nlri': nlri or [], 'withdraw': withdraw or []}}
+
+
+class TestOutboundQueue(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('yabgp.core.outbound.reactor')
+        self.reactor = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.queue = OutboundQueue()
+        self.protocol = mock.Mock(writer=None)
+        self.sent = []
+        self.protocol.send_update.side_effect = lambda msg: self.sent.append(msg['nlri'] or msg['withdraw'])
+        self.protocol.send_notification.side_effect = lambda error, sub_error, data: self.sent.append(error)
+
+    def test_wait_until_established(self):
+        self.queue.put(update(['1.1.1.0/24']))
+        self.assertFalse(self.reactor.callFromThread.called)
+        self.queue.attach(self.protocol)
+        self.reactor.callFromThread.assert_called_once_with(self.queue.drain)
+        self.queue.drain()
+        self.assertEqual([['1.1.1.0/24']], self.sent)
+
+    def test_wake_on_put(self):
+        self.queue.attach(self.protocol)
+        self.queue.put(update(['1.1.1.0/24']))
+        self.queue.put(update(['1.1.2.0/24']))
+        # one drain for the messages pushed before it runs
+        self.assertEqual(1, self.reactor.callFromThread.call_count)
+        self.queue.drain()
+        self.assertEqual(2, len(self.sent))
+        stats = self.queue.stats()
+        self.assertEqual(2, stats['sent'])
+        self.assertEqual(2, sum(stats['latency_histogram'].values()))
+
+    def test_priority(self):
+        self.queue.put(update(['1.1.1.0/24']))
+        self.queue.put(update(withdraw=['2.2.2.0/24']))
+        # the announcement of this route is queued before
+        self.queue.put(update(withdraw=['1.1.1.0/24']))
+        self.queue.put({'type': 'notification', 'msg': {'error': 6, 'sub_error': 2, 'data': b''}})
+        self.assertEqual(1, self.queue.stats()['withdraw_depth'])
+        self.queue.attach(self.protocol)
+        self.queue.drain()
+        self.assertEqual([6, ['2.2.2.0/24'], ['1.1.1.0/24'], ['1.1.1.0/24']], self.sent)
+        # the announcement was sent, a new withdrawal has priority again
+        self.queue.put(update(withdraw=['1.1.1.0/24']))
+        self.assertEqual(1, self.queue.stats()['withdraw_depth'])
+
+    def test_batch(self):
+        self.queue.batch_size = 2
+        for i in range(3):
+            self.queue.put(update(['1.1.%s.0/24' % i]))
+        self.queue.attach(self.protocol)
+        self.queue.drain()
+        self.assertEqual(2, len(self.sent))
+        # the next batch is scheduled
+        self.assertEqual(2, self.reactor.callFromThread.call_count)
+        self.queue.drain()
+        self.assertEqual(3, len(self.sent))
+
+    def test_detach(self):
+        self.queue.attach(self.protocol)
+        self.queue.detach(self.protocol)
+        self.queue.put(update(['1.1.1.0/24']))
+        self.assertFalse(self.reactor.callFromThread.called)
+        self.assertEqual(['1.1.1.0/24'], self.queue.get()['msg']['nlri'])
+        self.assertTrue(self.queue.empty())
+
+
+class TestOutboundWriter(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch('yabgp.core.outbound.reactor')
+        self.reactor = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.protocol = mock.Mock()
+        self.writer = OutboundWriter(self.protocol)
+
+    def test_coalesce(self):
+        self.writer.write(b'a' * 10)
+        self.writer.write(b'b' * 20)
+        self.reactor.callFromThread.assert_called_once_with(self.writer.flush)
+        self.assertEqual(30, self.writer.stats()['queued_bytes'])
+        self.writer.flush()
+        self.protocol.transport.writeSequence.assert_called_once_with([b'a' * 10, b'b' * 20])
+        stats = self.writer.stats()
+        self.assertEqual(0, stats['queued_bytes'])
+        self.assertEqual(30, stats['max_queued_bytes'])
+        self.assertEqual(1, stats['batches'])
+        self.assertEqual(2, stats['max_batch'])
+        # a new callback for the next messages
+        self.writer.write(b'c')
+        self.assertEqual(2, self.reactor.callFromThread.call_count)
+
+    def test_clear(self):
+        self.writer.write(b'a')
+        self.writer.clear()
+        self.writer.flush()
+        self.assertFalse(self.protocol.transport.writeSequence.called)
+
+    def test_pause(self):
+        self.writer.write(b'a')
+        self.writer.pauseProducing()
+        self.writer.flush()
+        self.assertFalse(self.protocol.transport.writeSequence.called)
+        # no callback while paused
+        self.writer.write(b'b')
+        self.assertEqual(1, self.reactor.callFromThread.call_count)
+        self.writer.resumeProducing()
+        self.protocol.transport.writeSequence.assert_called_once_with([b'a', b'b'])
+
+    def test_watermarks(self):
+        writer = OutboundWriter(self.protocol, high_watermark=100, low_watermark=40)
+        writer.chunk_size = 30
+        self.protocol.transport.writeSequence.side_effect = lambda data: writer.pauseProducing()
+        writer.pauseProducing()
+        for _ in range(10):
+            writer.write(b'a' * 10)
+        self.assertFalse(writer.writable())
+        self.assertFalse(writer.wait_writable(0.01))
+        callback = mock.Mock()
+        writer.notify_writable(callback)
+        # 30 bytes are written each time the transport is resumed
+        writer.resumeProducing()
+        self.assertEqual(70, writer.stats()['queued_bytes'])
+        self.assertFalse(writer.writable())
+        writer.resumeProducing()
+        self.assertEqual(40, writer.stats()['queued_bytes'])
+        self.assertTrue(writer.writable())
+        self.assertTrue(writer.wait_writable(0))
+        callback.assert_called_once_with()
+        self.assertEqual(1, writer.stats()['busy_count'])
+
+    def test_queue_waits_for_writer(self):
+        queue = OutboundQueue()
+        self.protocol.writer.writable.return_value = False
+        queue.put(update(['1.1.1.0/24']))
+        queue.attach(self.protocol)
+        queue.drain()
+        self.assertFalse(self.protocol.send_update.called)
+        self.protocol.writer.notify_writable.assert_called_once_with(queue._schedule)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Test peer registry
+"""
+
+import json
+import os
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from yabgp import config  # noqa
+from yabgp.api import utils as api_utils
+from yabgp.common import constants as bgp_cons
+from yabgp.core.factory import BGPPeering
+from yabgp.core.peers import PeerRegistry
+from yabgp.core.peers import get_registry
+from yabgp.core.protocol import BGP
+
+
+def peering(peer_addr, remote_as=65001, afi_safi=None):
+    running_config = config.peer_running_config({
+        'remote_as': remote_as,
+        'remote_addr': peer_addr,
+        'local_as': 65000,
+        'local_addr': '10.0.0.1',
+        'afi_safi': afi_safi or ['ipv4']
+    })
+    bgp_peering = BGPPeering(
+        myasn=65000, myaddr='10.0.0.1', peerasn=remote_as, peeraddr=peer_addr,
+        afisafi=running_config['afi_safi'], handler=mock.Mock(), running_config=running_config)
+    running_config['factory'] = bgp_peering
+    return bgp_peering
+
+
+class TestPeerRegistry(unittest.TestCase):
+
+    def test_get(self):
+        registry = PeerRegistry()
+        peer1 = peering('10.0.0.2')
+        peer2 = peering('2001:DB8::2')
+        registry.add(peer1)
+        registry.add(peer2)
+        self.assertEqual(2, len(registry))
+        self.assertIs(peer1, registry.get('10.0.0.2'))
+        self.assertIs(peer2, registry.get('2001:db8:0::2'))
+        self.assertIsNone(registry.get('10.0.0.3'))
+        self.assertIsNone(registry.get('not-an-address'))
+        self.assertIs(peer1, registry.default)
+        self.assertEqual([peer1, peer2], registry.peers())
+
+    def test_add_twice(self):
+        registry = PeerRegistry()
+        registry.add(peering('10.0.0.2'))
+        self.assertRaises(ValueError, registry.add, peering('10.0.0.2'))
+
+    def test_remove(self):
+        registry = PeerRegistry()
+        peer1 = peering('10.0.0.2')
+        registry.add(peer1)
+        self.assertIs(peer1, registry.remove('10.0.0.2'))
+        self.assertNotIn('10.0.0.2', registry)
+        self.assertIsNone(registry.default)
+
+
+class TestPeersConfig(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+        config.CONF.set_override('local_as', 65000, group='bgp')
+        self.addCleanup(config.CONF.clear_override, 'local_as', group='bgp')
+
+    def write(self, peers):
+        with open(self.path, 'w') as f:
+            json.dump(peers, f)
+
+    def test_load(self):
+        self.write([
+            {'remote_as': 65001, 'remote_addr': '10.0.0.2'},
+            {'remote_as': 65002, 'remote_addr': '10.0.0.3', 'local_as': 65010,
+             'afi_safi': ['ipv4', 'vpnv4'], 'ext_nexthop': [['vpnv4', 'ipv6']], 'route_refresh': False}
+        ])
+        peers_config = config.load_peers_config(self.path)
+        self.assertEqual(2, len(peers_config))
+        self.assertEqual(65000, peers_config[0]['local_as'])
+        self.assertEqual(['ipv4'], peers_config[0]['afi_safi'])
+        self.assertTrue(peers_config[0]['capability']['local']['route_refresh'])
+        self.assertEqual(65010, peers_config[1]['local_as'])
+        self.assertFalse(peers_config[1]['capability']['local']['route_refresh'])
+        self.assertEqual(
+            [{'afi_safi': (1, 128), 'nexthop_afi': 2}], peers_config[1]['capability']['local']['ext_nexthop'])
+        # each peer has its own capabilities
+        self.assertIsNot(peers_config[0]['capability'], peers_config[1]['capability'])
+
+    def test_load_duplicated_peer(self):
+        self.write([
+            {'remote_as': 65001, 'remote_addr': '10.0.0.2'},
+            {'remote_as': 65002, 'remote_addr': '10.0.0.2'}
+        ])
+        self.assertRaises(ValueError, config.load_peers_config, self.path)
+
+
+class TestPeerSessions(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = get_registry()
+        self.registry.clear()
+        self.addCleanup(self.registry.clear)
+        self.peer1 = peering('10.0.0.2', remote_as=65001)
+        self.peer2 = peering('10.0.0.3', remote_as=65002, afi_safi=['ipv4', 'ipv6'])
+        self.registry.add(self.peer1)
+        self.registry.add(self.peer2)
+
+    def protocol(self, bgp_peering):
+        protocol = BGP()
+        protocol.factory = bgp_peering
+        protocol.init_rib()
+        return protocol
+
+    def test_capability_per_peer(self):
+        protocol1 = self.protocol(self.peer1)
+        protocol2 = self.protocol(self.peer2)
+        self.peer1.running_config['capability']['remote'] = {'route_refresh': True, 'afi_safi': [(1, 1)]}
+        self.peer2.running_config['capability']['remote'] = {'afi_safi': [(1, 1)]}
+        protocol1.writer = mock.Mock()
+        protocol2.writer = mock.Mock()
+        self.assertTrue(protocol1.send_route_refresh(afi=1, safi=1))
+        # the second peer does not support route refresh
+        self.assertFalse(protocol2.send_route_refresh(afi=1, safi=1))
+        self.assertEqual(['ipv4'], sorted(protocol1.adj_rib_in))
+        self.assertEqual(['ipv4', 'ipv6'], sorted(protocol2.adj_rib_in))
+
+    def test_api_resolves_peer(self):
+        self.assertIs(self.peer1, api_utils.get_peering('10.0.0.2'))
+        self.assertIs(self.peer2, api_utils.get_peering('10.0.0.3'))
+        self.assertIs(self.peer1, api_utils.get_peering())
+        self.assertIsNone(api_utils.get_peering('10.0.0.4'))
+        state = api_utils.get_peer_conf_and_state('10.0.0.3')['peer']
+        self.assertEqual(65002, state['remote_as'])
+        self.assertEqual(bgp_cons.stateDescr[bgp_cons.ST_IDLE], state['fsm'])
+        self.assertFalse(api_utils.get_peer_conf_and_state('10.0.0.4')['status'])
+        peers = api_utils.get_peers_conf_and_state()['peers']
+        self.assertEqual(['10.0.0.2', '10.0.0.3'], [peer['remote_addr'] for peer in peers])
+
+    def test_inter_mq_first_peer(self):
+        for bgp_peering, attached in [(self.peer2, False), (self.peer1, True)]:
+            protocol = self.protocol(bgp_peering)
+            protocol.fsm = mock.Mock(state=bgp_cons.ST_ESTABLISHED)
+            bgp_peering.handler.raw_msg = False
+            protocol._keepalive_received(0, b'')
+            self.assertEqual(attached, bgp_peering.handler.inter_mq.attach.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -15,3 +15,359 @@
 
 """Test BGP protocol
 """
+
+import struct
+import unittest
+from concurrent.futures import Future
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from oslo_config import cfg
+
+from yabgp import config  # noqa
+from yabgp.common import constants as bgp_cons
+from yabgp.core.fsm import FSM
+from yabgp.core.protocol import BGP
+from yabgp.core.protocol import group_updates
+from yabgp.message.keepalive import KeepAlive
+from yabgp.message.update import Update
+
+CONF = cfg.CONF
+
+
+class TestReceiveBuffer(unittest.TestCase):
+
+    def setUp(self):
+        self.protocol = BGP()
+        self.protocol.fsm = mock.Mock()
+        self.protocol.factory = mock.Mock()
+        self.protocol.factory.handler.raw_msg = False
+        self.protocol.factory.handler.backlog.return_value = 0
+        self.protocol._keepalive_received = mock.Mock()
+        self.protocol._update_received = mock.Mock()
+
+    def test_raw_msg(self):
+        handler = self.protocol.factory.handler
+        handler.raw_msg = True
+        update = b'\xff' * 16 + b'\x00\x17\x02\x00\x00\x00\x00'
+        self.protocol.dataReceived(update + KeepAlive().construct())
+        self.assertEqual([update, KeepAlive().construct()],
+                         [call[0][2] for call in handler.raw_msg_received.call_args_list])
+
+    def test_parse_several_messages_in_one_read(self):
+        update = b'\xff' * 16 + b'\x00\x17\x02\x00\x00\x00\x00'
+        self.protocol.dataReceived(KeepAlive().construct() + update + KeepAlive().construct())
+        self.assertEqual(2, self.protocol._keepalive_received.call_count)
+        self.assertEqual(1, self.protocol._update_received.call_count)
+        msg = self.protocol._update_received.call_args[1]['msg']
+        self.assertEqual(b'\x00\x00\x00\x00', msg)
+        self.assertIsInstance(msg, bytes)
+        self.assertEqual(0, len(self.protocol._receive_buffer))
+        self.assertEqual(0, self.protocol._receive_offset)
+
+    def test_keep_partial_message(self):
+        data = KeepAlive().construct() * 2
+        self.protocol.dataReceived(data[:25])
+        self.assertEqual(1, self.protocol._keepalive_received.call_count)
+        self.assertEqual(data[19:25], bytes(self.protocol._receive_buffer))
+        self.protocol.dataReceived(data[25:])
+        self.assertEqual(2, self.protocol._keepalive_received.call_count)
+        self.assertEqual(0, len(self.protocol._receive_buffer))
+
+
+class TestUpdateBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.protocol = BGP()
+        self.protocol.fsm = mock.Mock()
+        self.protocol.factory = mock.Mock()
+        self.handler = self.protocol.factory.handler
+        self.handler.backlog.return_value = 0
+        self.handler.lazy_update = False
+        self.update = b'\xff' * 16 + b'\x00\x1f\x02\x00\x00\x00\x04\x40\x01\x01\x00\x18\x0a\x01\x01'
+
+    def test_deliver_updates_of_one_read_together(self):
+        self.protocol.dataReceived(self.update * 3)
+        self.assertEqual(1, self.handler.update_batch_received.call_count)
+        peer, batch = self.handler.update_batch_received.call_args[0]
+        self.assertEqual(3, len(batch))
+        self.assertEqual(['10.1.1.0/24'], batch[0][1]['nlri'])
+        self.assertEqual(3, self.protocol.msg_recv_stat['Updates'])
+        self.assertEqual(3, self.protocol.fsm.update_received.call_count)
+
+    def test_lazy_malformed_attribute(self):
+        self.handler.lazy_update = True
+        self.protocol.fourbytesas = True
+        # truncated AS_PATH segment
+        update = b'\xff' * 16 + b'\x00\x22\x02\x00\x00\x00\x0b\x40\x01\x01\x00\x40\x02\x04\x02\x01\xff\xff'
+        self.protocol.dataReceived(update)
+        self.assertEqual(1, self.handler.on_update_error.call_count)
+        self.assertEqual({1: 0}, self.handler.on_update_error.call_args[0][2]['attr'])
+        self.assertFalse(self.handler.update_batch_received.called)
+
+    def test_flush_before_keepalive(self):
+        self.protocol._keepalive_received = mock.Mock(
+            side_effect=lambda **kwargs: self.assertEqual(1, self.handler.update_batch_received.call_count))
+        self.protocol.dataReceived(self.update * 2 + KeepAlive().construct() + self.update)
+        self.assertEqual(2, self.handler.update_batch_received.call_count)
+        self.assertEqual(1, self.protocol._keepalive_received.call_count)
+
+
+class TestParsePool(unittest.TestCase):
+
+    def setUp(self):
+        self.protocol = BGP()
+        self.protocol.fsm = mock.Mock()
+        self.protocol.factory = mock.Mock()
+        self.protocol.transport = mock.Mock()
+        self.handler = self.protocol.factory.handler
+        self.handler.backlog.return_value = 0
+        self.futures = []
+        self.protocol.parse_pool = mock.Mock(queue_depth=4, batch_size=2)
+        self.protocol.parse_pool.submit.side_effect = self._submit
+        self.updates = [
+            b'\x00\x00\x00\x04\x40\x01\x01\x00\x18\x0a\x01' + struct.pack('!B', i) for i in range(1, 7)]
+
+    def _submit(self, msgs, asn4=False, afi_add_path=None):
+        future = Future()
+        self.futures.append((future, msgs))
+        return future
+
+    def _resolve(self, index):
+        future, msgs = self.futures[index]
+        future.set_result([Update.parse(None, msg) for msg in msgs])
+
+    def _data(self, msgs):
+        return b''.join(b'\xff' * 16 + b'\x00\x1f\x02' + msg for msg in msgs)
+
+    @mock.patch('yabgp.core.protocol.reactor')
+    def test_one_batch_per_read(self, reactor):
+        self.protocol.dataReceived(self._data(self.updates[:3]))
+        # a full batch and the rest of the read
+        self.assertEqual([2, 1], [len(msgs) for _, msgs in self.futures])
+        self._resolve(0)
+        self._resolve(1)
+        # one callback for each batch
+        self.assertEqual(2, reactor.callFromThread.call_count)
+        self.protocol._process_parsed_updates()
+        self.assertEqual(1, self.handler.update_batch_received.call_count)
+        self.assertEqual(3, len(self.handler.update_batch_received.call_args[0][1]))
+
+    @mock.patch('yabgp.core.protocol.reactor')
+    def test_process_in_received_order(self, reactor):
+        self.protocol.dataReceived(self._data(self.updates))
+        # the queue is full, the last two messages wait in the buffer
+        self.assertEqual(2, len(self.futures))
+        self.assertTrue(self.protocol.transport.pauseProducing.called)
+        self.assertEqual(4, self.protocol.fsm.update_received.call_count)
+
+        self._resolve(1)
+        self.protocol._process_parsed_updates()
+        self.assertFalse(self.handler.update_batch_received.called)
+
+        self._resolve(0)
+        self.protocol._process_parsed_updates()
+        batch = self.handler.update_batch_received.call_args[0][1]
+        self.assertEqual([['10.1.%s.0/24' % i] for i in range(1, 5)], [msg['nlri'] for _, msg in batch])
+        self.assertTrue(self.protocol.transport.resumeProducing.called)
+        self.assertEqual(3, len(self.futures))
+
+        self._resolve(2)
+        self.protocol._process_parsed_updates()
+        batch = self.handler.update_batch_received.call_args[0][1]
+        self.assertEqual([['10.1.5.0/24'], ['10.1.6.0/24']], [msg['nlri'] for _, msg in batch])
+        self.assertEqual(6, self.protocol.msg_recv_stat['Updates'])
+
+    @mock.patch('yabgp.core.protocol.reactor')
+    def test_drop_queued_updates_when_connection_lost(self, reactor):
+        self.protocol.dataReceived(self._data(self.updates[:3]))
+        self.protocol.connectionLost(mock.Mock())
+        # nothing waits for the parse pool in the reactor
+        self.assertTrue(all(future.cancelled() for future, msgs in self.futures))
+        self.assertEqual(0, self.protocol._parse_queued)
+        self.protocol._process_parsed_updates()
+        self.assertFalse(self.handler.update_batch_received.called)
+
+
+class TestInternalQueue(unittest.TestCase):
+
+    def test_attach_when_established(self):
+        protocol = BGP()
+        protocol.fsm = mock.Mock(state=bgp_cons.ST_ESTABLISHED)
+        protocol.factory = mock.Mock()
+        protocol._keepalive_received(1.0, b'')
+        protocol.factory.handler.inter_mq.attach.assert_called_once_with(protocol)
+        protocol.connectionLost(mock.Mock())
+        protocol.factory.handler.inter_mq.detach.assert_called_once_with(protocol)
+
+
+class TestSendUpdates(unittest.TestCase):
+
+    def setUp(self):
+        self.attr = {1: 0, 2: [], 3: '10.0.0.1'}
+
+    def test_group_by_attributes(self):
+        other = dict(self.attr)
+        other[4] = 10
+        msg_list = [
+            {'attr': self.attr, 'nlri': ['1.1.1.0/24'], 'withdraw': []},
+            {'attr': other, 'nlri': ['2.2.2.0/24'], 'withdraw': []},
+            {'attr': self.attr, 'nlri': ['3.3.3.0/24'], 'withdraw': ['4.4.4.0/24']}]
+        result = group_updates(msg_list)
+        self.assertEqual([['4.4.4.0/24'], [], []], [msg['withdraw'] for msg in result])
+        self.assertEqual([[], ['1.1.1.0/24', '3.3.3.0/24'], ['2.2.2.0/24']], [msg['nlri'] for msg in result])
+
+    def test_keep_route_order(self):
+        msg_list = [
+            {'attr': self.attr, 'nlri': ['1.1.1.0/24'], 'withdraw': []},
+            {'attr': {}, 'nlri': [], 'withdraw': ['1.1.1.0/24']}]
+        result = group_updates(msg_list)
+        self.assertEqual([['1.1.1.0/24'], []], [msg['nlri'] for msg in result])
+        self.assertEqual([[], ['1.1.1.0/24']], [msg['withdraw'] for msg in result])
+
+    @mock.patch('yabgp.core.outbound.reactor')
+    def test_write_once(self, reactor):
+        protocol = BGP()
+        protocol.transport = mock.Mock()
+        msg_list = [{'attr': self.attr, 'nlri': ['10.%s.%s.0/24' % (i // 256, i % 256)], 'withdraw': []}
+                    for i in range(2000)]
+        self.assertEqual(2, protocol.send_updates(msg_list))
+        self.assertEqual(1, reactor.callFromThread.call_count)
+        protocol.writer.flush()
+        data = protocol.transport.writeSequence.call_args[0][0][0]
+        first = Update.parse(None, data[bgp_cons.HDR_LEN:struct.unpack('!H', data[16:18])[0]])
+        self.assertEqual(2, protocol.msg_sent_stat['Updates'])
+        self.assertTrue(len(first['nlri']) > 1000)
+
+    @mock.patch('yabgp.core.outbound.reactor')
+    def test_keepalive_after_updates(self, reactor):
+        protocol = BGP()
+        protocol.factory = mock.Mock()
+        protocol.transport = mock.Mock()
+        protocol.send_update({'attr': self.attr, 'nlri': ['1.1.1.0/24'], 'withdraw': []})
+        protocol.send_keepalive()
+        self.assertEqual(['writeSequence', 'write'], [call[0] for call in protocol.transport.method_calls])
+
+    @mock.patch('yabgp.core.outbound.reactor')
+    def test_keepalive_before_paused_updates(self, reactor):
+        protocol = BGP()
+        protocol.factory = mock.Mock()
+        protocol.transport = mock.Mock()
+        protocol.writer.pauseProducing()
+        protocol.send_update({'attr': self.attr, 'nlri': ['1.1.1.0/24'], 'withdraw': []})
+        protocol.send_keepalive()
+        # the keepalive does not wait for the peer to read the pending update
+        self.assertEqual(['write'], [call[0] for call in protocol.transport.method_calls])
+        self.assertEqual(1, protocol.writer.stats()['pending'])
+        protocol.writer.resumeProducing()
+        self.assertEqual(['write', 'writeSequence'], [call[0] for call in protocol.transport.method_calls])
+
+
+class TestReceiveBacklog(unittest.TestCase):
+
+    def setUp(self):
+        self.protocol = BGP()
+        self.protocol.fsm = mock.Mock()
+        self.protocol.factory = mock.Mock()
+        self.protocol.transport = mock.Mock()
+        self.handler = self.protocol.factory.handler
+        self.handler.lazy_update = False
+        self.handler.raw_msg = False
+        self.update = b'\xff' * 16 + b'\x00\x1f\x02\x00\x00\x00\x04\x40\x01\x01\x00\x18\x0a\x01\x01'
+
+    @mock.patch('yabgp.core.protocol.reactor')
+    def test_pause_and_resume(self, reactor):
+        self.handler.backlog.return_value = CONF.bgp.receive_backlog_high
+        self.protocol.dataReceived(self.update)
+        self.assertTrue(self.protocol.transport.pauseProducing.called)
+        self.assertTrue(self.protocol.reading_paused)
+        reactor.callLater.assert_called_once_with(
+            self.protocol.backlog_check_interval, self.protocol._poll_receive_backlog)
+        # not drained enough
+        self.handler.backlog.return_value = CONF.bgp.receive_backlog_low + 1
+        self.protocol._poll_receive_backlog()
+        self.assertFalse(self.protocol.transport.resumeProducing.called)
+        self.assertEqual(2, reactor.callLater.call_count)
+        self.handler.backlog.return_value = CONF.bgp.receive_backlog_low
+        self.protocol._poll_receive_backlog()
+        self.assertTrue(self.protocol.transport.resumeProducing.called)
+        self.assertFalse(self.protocol.reading_paused)
+        self.assertEqual(1, self.protocol.read_pauses)
+
+    def test_hold_timer_while_paused(self):
+        fsm = FSM(bgp_peering=mock.Mock())
+        fsm.protocol = self.protocol
+        fsm.state = bgp_cons.ST_ESTABLISHED
+        fsm.hold_timer = mock.Mock()
+        self.protocol._pause_reading('backlog')
+        fsm.hold_time_event()
+        fsm.hold_timer.reset.assert_called_once_with(fsm.hold_time)
+        self.assertEqual(bgp_cons.ST_ESTABLISHED, fsm.state)
+        self.assertFalse(self.protocol.transport.write.called)
+        # a message of the peer allows one more restart
+        fsm.keep_alive_received()
+        fsm.hold_time_event()
+        self.assertEqual(bgp_cons.ST_ESTABLISHED, fsm.state)
+
+    def test_hold_timer_expires_after_restart(self):
+        fsm = FSM(bgp_peering=mock.Mock())
+        fsm.protocol = self.protocol
+        fsm.state = bgp_cons.ST_ESTABLISHED
+        fsm.hold_timer = mock.Mock()
+        self.protocol._pause_reading('backlog')
+        fsm.hold_time_event()
+        # the peer is still silent one hold time later
+        with mock.patch.object(fsm, '_error_close'):
+            fsm.hold_time_event()
+        self.assertEqual(bgp_cons.ST_IDLE, fsm.state)
+        self.assertTrue(self.protocol.transport.write.called)
+
+
+class TestRouteVersion(unittest.TestCase):
+
+    def setUp(self):
+        self.protocol = BGP()
+        self.nlri = [
+            {'label': [25], 'rd': '100:100', 'prefix': '10.0.0.0/24'},
+            {'label': [26], 'rd': '100:100', 'prefix': '10.0.1.0/24'}
+        ]
+
+    def test_send_update_and_withdraw(self):
+        attr = {1: 0, 14: {'afi_safi': [1, 128], 'nexthop': {'rd': '0:0', 'str': '1.1.1.1'}, 'nlri': self.nlri}}
+        self.protocol.update_send_version(None, attr, [], [])
+        self.assertEqual(2, self.protocol.send_version['mpls_vpn'])
+        self.assertEqual(2, len(self.protocol.mpls_vpn_send_dict))
+        # same routes and attributes
+        self.protocol.update_send_version(None, attr, [], [])
+        self.assertEqual(2, self.protocol.send_version['mpls_vpn'])
+        # attributes changed
+        attr[1] = 1
+        self.protocol.update_send_version(None, attr, [], [])
+        self.assertEqual(4, self.protocol.send_version['mpls_vpn'])
+        self.protocol.update_send_version(None, {15: {'afi_safi': [1, 128], 'withdraw': self.nlri[:1]}}, [], [])
+        self.assertEqual(5, self.protocol.send_version['mpls_vpn'])
+        self.assertEqual(1, len(self.protocol.mpls_vpn_send_dict))
+
+    def test_receive_flowspec(self):
+        nlri = {1: '10.0.0.0/24', 2: '20.0.0.0/24'}
+        attr = {1: 0, 14: {'afi_safi': (1, 133), 'nexthop': '', 'nlri': [nlri]}}
+        self.protocol.update_receive_verion(attr, [], [])
+        self.assertEqual(1, self.protocol.receive_version['flowspec'])
+        withdraw = [{'1': '10.0.0.0/24', '2': '20.0.0.0/24'}]
+        self.protocol.update_receive_verion({15: {'afi_safi': (1, 133), 'withdraw': withdraw}}, [], [])
+        self.assertEqual(2, self.protocol.receive_version['flowspec'])
+        self.assertEqual({}, self.protocol.flowspec_receive_dict)
+
+    def test_sr_policy(self):
+        nlri = {'distinguisher': 1, 'color': 10, 'endpoint': '1.1.1.1'}
+        self.protocol.update_send_version(None, {14: {'afi_safi': [1, 73], 'nexthop': '', 'nlri': nlri}}, [], [])
+        self.assertEqual(1, self.protocol.send_version['sr_policy'])
+        self.protocol.update_send_version(None, {15: {'afi_safi': [1, 73], 'withdraw': nlri}}, [], [])
+        self.assertEqual(2, self.protocol.send_version['sr_policy'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,374 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Test Adj-RIB
+"""
+
+import threading
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from yabgp import config  # noqa
+from yabgp.core.protocol import BGP
+from yabgp.core.rib import AttrTable
+from yabgp.core.rib import CowDict
+from yabgp.core.rib import attr_fingerprint
+from yabgp.core.rib import HashedAdjRIB
+from yabgp.core.rib import IPAdjRIB
+from yabgp.core.rib import new_adj_rib
+from yabgp.core.rib import RIBSnapshot
+from yabgp.message.update import Update
+from yabgp.message.update import UpdateView
+
+
+class TestAttrTable(unittest.TestCase):
+
+    def test_intern_and_release(self):
+        table = AttrTable()
+        attr_id = table.intern({1: 0, 2: [[2, [100]]]})
+        self.assertEqual(attr_id, table.intern({2: [[2, [100]]], 1: 0}))
+        self.assertEqual(2, table.refcount(attr_id))
+        self.assertNotEqual(attr_id, table.intern({1: 1}))
+        self.assertEqual(2, len(table))
+        table.release(attr_id)
+        table.release(attr_id)
+        self.assertEqual(0, table.refcount(attr_id))
+        self.assertEqual(1, len(table))
+
+    def test_shared_by_routes(self):
+        table = AttrTable()
+        rib = new_adj_rib('ipv4', table)
+        rib.update('10.0.0.0/24', {1: 0})
+        rib.update('10.0.1.0/24', {1: 0})
+        self.assertIs(rib.lookup('10.0.0.1')['attr'], rib.lookup('10.0.1.1')['attr'])
+        self.assertEqual(1, len(table))
+        rib.update('10.0.0.0/24', {1: 1})
+        self.assertEqual(2, len(table))
+        rib.withdraw('10.0.1.0/24')
+        rib.withdraw('10.0.0.0/24')
+        self.assertEqual(0, len(table))
+
+
+class TestIPAdjRIB(unittest.TestCase):
+
+    def setUp(self):
+        self.rib = IPAdjRIB('ipv4')
+        self.attr = {1: 0, 3: '10.0.0.1'}
+
+    def test_update_and_lookup(self):
+        self.assertTrue(self.rib.update('192.168.0.0/16', self.attr))
+        self.assertTrue(self.rib.update('192.168.1.0/24', self.attr))
+        self.assertFalse(self.rib.update('192.168.1.0/24', self.attr))
+        self.assertEqual(2, len(self.rib))
+        self.assertEqual({'prefix': '192.168.1.0/24', 'attr': self.attr}, self.rib.lookup('192.168.1.0/24'))
+        self.assertEqual('192.168.1.0/24', self.rib.lookup('192.168.1.1')['prefix'])
+        self.assertEqual('192.168.0.0/16', self.rib.lookup('192.168.2.1')['prefix'])
+        self.assertEqual({}, self.rib.lookup('192.168.2.0/24'))
+        self.assertEqual({}, self.rib.lookup('10.0.0.1'))
+
+    def test_pack(self):
+        self.assertEqual((0xc0a80100 << 8) | 24, self.rib.pack('192.168.1.0/24'))
+        self.assertEqual(self.rib.pack('192.168.1.0/24'), self.rib.pack('192.168.1.7/24'))
+        self.assertEqual('192.168.1.0/24', self.rib.unpack(self.rib.pack('192.168.1.0/24')))
+        rib = new_adj_rib('ipv6')
+        self.assertEqual('2001:db8::/32', rib.unpack(rib.pack('2001:db8::/32')))
+
+    def test_routes(self):
+        self.rib.update('192.168.1.0/24', self.attr)
+        self.rib.update({'prefix': '10.0.0.0/8', 'path_id': 1}, self.attr)
+        self.assertEqual(
+            sorted([('192.168.1.0/24', self.attr), ({'prefix': '10.0.0.0/8', 'path_id': 1}, self.attr)], key=str),
+            sorted(self.rib.routes(), key=str))
+
+    def test_withdraw(self):
+        self.rib.update('192.168.1.0/24', self.attr)
+        self.assertTrue(self.rib.withdraw('192.168.1.0/24'))
+        self.assertFalse(self.rib.withdraw('192.168.1.0/24'))
+        self.assertEqual(0, len(self.rib))
+        self.assertEqual({}, self.rib.lookup('192.168.1.1'))
+
+    def test_add_path(self):
+        self.rib.update({'prefix': '10.0.0.0/8', 'path_id': 1}, self.attr)
+        self.rib.update({'prefix': '10.0.0.0/8', 'path_id': 2}, {1: 1})
+        self.assertEqual(2, len(self.rib))
+        self.assertEqual(self.attr, self.rib.lookup({'prefix': '10.1.1.1', 'path_id': 1})['attr'])
+        self.assertEqual({1: 1}, self.rib.lookup({'prefix': '10.1.1.1', 'path_id': 2})['attr'])
+        self.assertTrue(self.rib.withdraw({'prefix': '10.0.0.0/8', 'path_id': 1}))
+        self.assertEqual(2, self.rib.lookup('10.0.0.0/8')['path_id'])
+
+    def test_vpn(self):
+        rib = IPAdjRIB('vpnv4')
+        rib.update({'rd': '100:1', 'prefix': '10.0.0.0/24', 'label': [25]}, self.attr)
+        rib.update({'rd': '100:2', 'prefix': '10.0.0.0/24', 'label': [26]}, self.attr)
+        route = rib.lookup({'rd': '100:2', 'prefix': '10.0.0.1'})
+        self.assertEqual({'prefix': '10.0.0.0/24', 'rd': '100:2', 'label': [26], 'attr': self.attr}, route)
+        self.assertEqual({}, rib.lookup({'rd': '100:3', 'prefix': '10.0.0.1'}))
+        self.assertTrue(rib.withdraw({'rd': '100:1', 'prefix': '10.0.0.0/24', 'label': [524288]}))
+        self.assertEqual(1, len(rib))
+
+    def test_ipv6(self):
+        rib = new_adj_rib('ipv6')
+        rib.update('2001:db8::/32', self.attr)
+        self.assertEqual('2001:db8::/32', rib.lookup('2001:db8::1')['prefix'])
+
+
+class TestHashedAdjRIB(unittest.TestCase):
+
+    def test_attr_fingerprint(self):
+        attr1 = {1: 0, 14: {'afi_safi': (1, 133), 'nexthop': '', 'nlri': [{1: '10.0.0.0/24'}]}}
+        attr2 = {14: {'afi_safi': (1, 133), 'nexthop': '', 'nlri': [{1: '20.0.0.0/24'}]}, 1: 0}
+        self.assertEqual(attr_fingerprint(attr1), attr_fingerprint(attr2))
+        attr2[1] = 1
+        self.assertNotEqual(attr_fingerprint(attr1), attr_fingerprint(attr2))
+        self.assertIn(14, attr1)
+        self.assertIn('nlri', attr1[14])
+
+    def test_flowspec(self):
+        rib = new_adj_rib('flowspec')
+        self.assertIsInstance(rib, HashedAdjRIB)
+        nlri = {1: '10.0.0.0/24', 2: '20.0.0.0/24'}
+        self.assertTrue(rib.update(nlri, {1: 0}))
+        self.assertEqual({'nlri': nlri, 'attr': {1: 0}}, rib.lookup({'1': '10.0.0.0/24', '2': '20.0.0.0/24'}))
+        self.assertTrue(rib.withdraw(nlri))
+        self.assertEqual({}, rib.lookup(nlri))
+
+    def test_evpn_label_not_in_key(self):
+        rib = new_adj_rib('evpn')
+        nlri = {'type': 2, 'value': {'rd': '1:1', 'mac': '00-11-22-33-44-55', 'label': [100]}}
+        rib.update(nlri, {1: 0})
+        withdraw = {'type': 2, 'value': {'rd': '1:1', 'mac': '00-11-22-33-44-55', 'label': [0]}}
+        self.assertTrue(rib.withdraw(withdraw))
+        self.assertEqual(0, len(rib))
+
+
+class TestCowDict(unittest.TestCase):
+
+    def test_dict(self):
+        table = CowDict(buckets=4)
+        for i in range(100):
+            table[i << 8 | 24] = i
+        self.assertEqual(100, len(table))
+        self.assertEqual(5, table[5 << 8 | 24])
+        self.assertIn(5 << 8 | 24, table)
+        self.assertEqual(5, table.pop(5 << 8 | 24))
+        self.assertIsNone(table.pop(5 << 8 | 24))
+        del table[6 << 8 | 24]
+        self.assertEqual(98, len(table))
+        self.assertEqual(sorted(set(range(100)) - {5, 6}), sorted(table.values()))
+
+    def test_snapshot(self):
+        table = CowDict(buckets=4)
+        table[1] = 'a'
+        table[2] = 'b'
+        snap = table.snapshot()
+        table[1] = 'c'
+        del table[2]
+        table[3] = 'd'
+        self.assertEqual({1: 'a', 2: 'b'}, dict(snap.items()))
+        self.assertEqual({1: 'c', 3: 'd'}, dict(table.items()))
+        self.assertEqual(2, len(snap))
+        self.assertRaises(TypeError, snap.__setitem__, 4, 'e')
+        self.assertIs(snap, snap.snapshot())
+
+    def test_diff(self):
+        table = CowDict(buckets=4)
+        for i in range(100):
+            table[i] = i
+        old = table.snapshot()
+        table[100] = 100
+        table[1] = 'changed'
+        del table[2]
+        self.assertEqual(({100}, {2}), table.snapshot().diff(old))
+
+    def test_grow(self):
+        table = CowDict(buckets=4)
+        for i in range(100000):
+            table[i << 8 | 24] = i
+        self.assertEqual(100000, len(table))
+        self.assertEqual(1024, len(table._buckets))
+        self.assertEqual(12345, table[12345 << 8 | 24])
+        snap = table.snapshot()
+        table[12345 << 8 | 24] = 'changed'
+        # one small bucket is copied, not a 64th of the table
+        copied = [bucket for bucket, old_bucket in zip(table._buckets, snap._buckets) if bucket is not old_bucket]
+        self.assertEqual(1, len(copied))
+        self.assertTrue(len(copied[0]) < 4 * CowDict.max_load)
+        self.assertEqual(12345, snap[12345 << 8 | 24])
+
+    def test_diff_after_grow(self):
+        table = CowDict(buckets=4)
+        for i in range(4 * CowDict.max_load):
+            table[i] = i
+        old = table.snapshot()
+        table[-1] = -1
+        del table[2]
+        self.assertEqual(8, len(table._buckets))
+        self.assertEqual(4, len(old._buckets))
+        self.assertEqual(({-1}, {2}), table.snapshot().diff(old))
+        self.assertEqual(dict((i, i) for i in range(4 * CowDict.max_load)), dict(old.items()))
+
+    def test_walk(self):
+        table = CowDict(buckets=4)
+        for i in range(100):
+            table[i] = i
+        self.assertRaises(TypeError, list, table.walk())
+        snap = table.snapshot()
+        items = list(snap.walk())
+        self.assertEqual(list(range(100)), sorted(key for _, key, _ in items))
+        # resume after each position
+        for i, (position, _key, _value) in enumerate(items):
+            self.assertEqual(items[i + 1:], list(snap.walk(position)))
+
+
+class TestRIBSnapshot(unittest.TestCase):
+
+    def test_ip(self):
+        table = AttrTable()
+        rib = new_adj_rib('ipv4', table)
+        rib.update('10.0.0.0/24', {1: 0})
+        snapshot = RIBSnapshot.take(table, {'ipv4': rib}, {}, version=1)
+        rib.update('10.0.1.0/24', {1: 1})
+        rib.withdraw('10.0.0.0/24')
+        self.assertEqual(1, len(table))
+        snap_rib = snapshot.adj_rib_in['ipv4']
+        # the released attributes are still in the snapshot
+        self.assertEqual({1: 0}, snap_rib.lookup('10.0.0.1')['attr'])
+        self.assertEqual({}, snap_rib.lookup('10.0.1.1'))
+        self.assertEqual([('10.0.0.0/24', {1: 0})], list(snap_rib.routes()))
+        self.assertEqual(1, len(snap_rib))
+        self.assertEqual({1: 1}, rib.lookup('10.0.1.1')['attr'])
+        self.assertEqual({}, rib.lookup('10.0.0.1'))
+        self.assertRaises(TypeError, snap_rib.update, '10.0.2.0/24', {1: 0})
+
+    def test_hashed(self):
+        rib = new_adj_rib('flowspec')
+        nlri = {1: '10.0.0.0/24'}
+        rib.update(nlri, {1: 0})
+        snap_rib = rib.snapshot()
+        rib.withdraw(nlri)
+        self.assertEqual({1: 0}, snap_rib.lookup(nlri)['attr'])
+        self.assertEqual(0, len(rib))
+
+    def test_walk(self):
+        table = AttrTable()
+        rib = new_adj_rib('vpnv4', table)
+        for i in range(300):
+            rib.update({'rd': '100:%s' % (i % 3), 'prefix': '10.0.%s.0/24' % (i // 3)}, {1: i % 2})
+        snap_rib = RIBSnapshot.take(table, {'vpnv4': rib}, {}).adj_rib_in['vpnv4']
+        routes = list(snap_rib.walk())
+        self.assertEqual(300, len(routes))
+        self.assertEqual(
+            sorted(snap_rib.routes(), key=str), sorted(((nlri, attr) for _, nlri, attr in routes), key=str))
+        position = routes[149][0]
+        rib.withdraw({'rd': '100:2', 'prefix': '10.0.99.0/24'})
+        self.assertEqual(routes[150:], list(snap_rib.walk(position)))
+        flowspec = new_adj_rib('flowspec')
+        flowspec.update({1: '10.0.0.0/24'}, {1: 0})
+        self.assertEqual([({1: '10.0.0.0/24'}, {1: 0})], [route[1:] for route in flowspec.snapshot().walk()])
+
+    def test_read_while_changing(self):
+        table = AttrTable()
+        rib = new_adj_rib('ipv4', table)
+        for i in range(1000):
+            rib.update('10.%s.%s.0/24' % (i // 256, i % 256), {1: i % 3})
+        snapshot = RIBSnapshot.take(table, {'ipv4': rib}, {})
+        errors = []
+        counts = []
+
+        def read():
+            try:
+                for _ in range(20):
+                    counts.append(sum(1 for _ in snapshot.adj_rib_in['ipv4'].routes()))
+            except Exception as e:
+                errors.append(e)
+
+        reader = threading.Thread(target=read)
+        reader.start()
+        for i in range(1000):
+            rib.withdraw('10.%s.%s.0/24' % (i // 256, i % 256))
+            rib.update('11.%s.%s.0/24' % (i // 256, i % 256), {1: 5})
+        reader.join()
+        self.assertEqual([], errors)
+        self.assertEqual([1000] * 20, counts)
+
+
+class TestProtocolRIBIn(unittest.TestCase):
+
+    def setUp(self):
+        self.protocol = BGP()
+        self.protocol.adj_rib_in = {
+            k: new_adj_rib(k, self.protocol.rib_attr_table) for k in ('ipv4', 'ipv6', 'flowspec')}
+
+    def test_ipv4(self):
+        attr = {1: 0, 3: '10.0.0.1'}
+        self.protocol.update_rib_in({'withdraw': [], 'nlri': ['1.1.1.0/24'], 'attr': attr})
+        self.assertEqual(attr, self.protocol.ip_longest_match('1.1.1.1')['attr'])
+        self.protocol.update_rib_in({'withdraw': ['1.1.1.0/24'], 'nlri': [], 'attr': {}})
+        self.assertEqual({}, self.protocol.ip_longest_match('1.1.1.1'))
+
+    def test_mp_reach_and_unreach(self):
+        attr = {1: 0, 14: {'afi_safi': (2, 1), 'nexthop': '2001::1', 'nlri': ['2001:db8::/32']}}
+        self.protocol.update_rib_in({'withdraw': [], 'nlri': [], 'attr': attr})
+        route = self.protocol.ip_longest_match('2001:db8::1', 'ipv6')
+        self.assertEqual({1: 0, 14: {'afi_safi': (2, 1), 'nexthop': '2001::1'}}, route['attr'])
+        attr = {15: {'afi_safi': (2, 1), 'withdraw': ['2001:db8::/32']}}
+        self.protocol.update_rib_in({'withdraw': [], 'nlri': [], 'attr': attr})
+        self.assertEqual(0, len(self.protocol.adj_rib_in['ipv6']))
+
+    @mock.patch('yabgp.core.protocol.reactor')
+    def test_publish_snapshot(self, mock_reactor):
+        config.CONF.set_override('rib_snapshot_interval', 1000, group='bgp')
+        self.addCleanup(config.CONF.clear_override, 'rib_snapshot_interval', group='bgp')
+        self.protocol.publish_rib()
+        version = self.protocol.rib_snapshot.version
+        self.protocol.update_rib_in({'withdraw': [], 'nlri': ['1.1.1.0/24'], 'attr': {1: 0}})
+        self.protocol.rib_changed()
+        self.protocol.rib_changed()
+        # published once, at most rib_snapshot_interval after the last one
+        self.assertEqual(1, mock_reactor.callLater.call_count)
+        delay, publish = mock_reactor.callLater.call_args[0]
+        self.assertTrue(0 < delay <= 1)
+        self.assertEqual({}, self.protocol.rib_snapshot.adj_rib_in['ipv4'].lookup('1.1.1.1'))
+        publish()
+        self.assertEqual(version + 1, self.protocol.rib_snapshot.version)
+        self.assertEqual({1: 0}, self.protocol.rib_snapshot.adj_rib_in['ipv4'].lookup('1.1.1.1')['attr'])
+
+    def test_lazy_attributes(self):
+        views = []
+        for prefix in ['2001:db8::/32', '2001:db9::/32']:
+            msg_hex = Update.construct({'attr': {
+                1: 0, 2: [], 8: ['100:1'],
+                14: {'afi_safi': (2, 1), 'nexthop': '2001::1', 'nlri': [prefix]}}, 'nlri': [], 'withdraw': []}, True)
+            views.append(UpdateView(None, msg_hex[19:], True))
+            self.protocol.update_rib_in({'withdraw': [], 'nlri': [], 'attr': views[-1].attr})
+        # one attribute set keyed on the raw attributes, the community is not decoded
+        self.assertEqual(1, len(self.protocol.rib_attr_table))
+        attr = self.protocol.ip_longest_match('2001:db9::1', 'ipv6')['attr']
+        self.assertIs(attr, self.protocol.ip_longest_match('2001:db8::1', 'ipv6')['attr'])
+        self.assertNotIn(8, attr._values)
+        self.assertEqual({1: 0, 2: [], 8: ['100:1'], 14: {'afi_safi': (2, 1), 'nexthop': '2001::1'}}, dict(attr))
+
+    def test_unconfigured_family(self):
+        attr = {14: {'afi_safi': (25, 70), 'nexthop': '1.1.1.1', 'nlri': [{'type': 1, 'value': {}}]}}
+        self.assertTrue(self.protocol.update_rib_in({'withdraw': [], 'nlri': [], 'attr': attr}))
+        self.assertEqual({}, self.protocol.ip_longest_match('1.1.1.1', 'evpn'))
+
+
+if __name__ == '__main__':
+    unittest.main()
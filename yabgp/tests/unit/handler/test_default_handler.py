@@ -0,0 +1,351 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Test default handler and message writer
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from oslo_config import cfg
+
+from yabgp import config  # noqa
+from yabgp.common import mrt
+from yabgp.common import msgfile
+from yabgp.common import msgindex
+from yabgp.handler.default_handler import DefaultHandler
+from yabgp.message.keepalive import KeepAlive
+from yabgp.handler.writer import FileCompressor
+from yabgp.handler.writer import MessageWriter
+
+CONF = cfg.CONF
+
+
+class TestMessageWriter(unittest.TestCase):
+
+    def test_group_write(self):
+        written = []
+        event = threading.Event()
+
+        def write(peer, records):
+            event.wait()
+            written.append((peer, records))
+
+        writer = MessageWriter(write, queue_size=10)
+        for i in range(5):
+            writer.put('1.1.1.1', {'seq': i})
+        writer.put('2.2.2.2', {'seq': 0})
+        event.set()
+        writer.flush()
+        writer.stop()
+        records = [r['seq'] for peer, batch in written if peer == '1.1.1.1' for r in batch]
+        self.assertEqual([0, 1, 2, 3, 4], records)
+        stats = writer.stats()
+        self.assertEqual(6, stats['records'])
+        self.assertEqual(0, stats['queue_depth'])
+        self.assertEqual(10, stats['queue_size'])
+
+    def test_write_error(self):
+        writer = MessageWriter(mock.Mock(side_effect=IOError('disk full')), queue_size=10)
+        writer.put('1.1.1.1', {'seq': 0})
+        writer.flush()
+        writer.stop()
+        self.assertEqual(1, writer.stats()['records'])
+
+    def test_sync_when_idle(self):
+        synced = threading.Event()
+        writer = MessageWriter(mock.Mock(), queue_size=10, sync_func=synced.set, sync_interval=0.01)
+        self.assertTrue(synced.wait(5))
+        writer.stop()
+
+
+class TestDefaultHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.write_dir = tempfile.mkdtemp()
+        CONF.set_override('write_dir', self.write_dir, 'message')
+        CONF.set_override('write_msg_max_size', 1024 * 1024, 'message')
+        self.handler = DefaultHandler()
+        self.handler.init_msg_file('1.1.1.1')
+        self.peer = mock.Mock()
+        self.peer.factory.peer_addr = '1.1.1.1'
+
+    def tearDown(self):
+        if self.handler.writer:
+            self.handler.writer.stop()
+        if self.handler.compressor:
+            self.handler.compressor.stop()
+        for msg_path, msg_file in self.handler.peer_files.values():
+            msg_file.close()
+        for index_file, offset in self.handler.peer_index.values():
+            index_file.close()
+        shutil.rmtree(self.write_dir)
+        CONF.clear_override('write_dir', 'message')
+        CONF.clear_override('write_msg_max_size', 'message')
+        CONF.clear_override('write_fsync', 'message')
+        CONF.clear_override('write_fsync_interval', 'message')
+        CONF.clear_override('write_index_interval', 'message')
+        CONF.clear_override('compress', 'message')
+
+    def read_records(self):
+        msg_path, msg_file = self.handler.peer_files['1.1.1.1']
+        msg_file.flush()
+        records = []
+        for name in sorted(os.listdir(msg_path)):
+            if name == msgindex.INDEX_DIR:
+                continue
+            with open(os.path.join(msg_path, name)) as f:
+                records.extend(json.loads(line) for line in f)
+        return records
+
+    def test_write_in_reactor_thread(self):
+        CONF.set_override('write_fsync', 'always', 'message')
+        with mock.patch('os.fsync') as fsync:
+            self.handler.update_batch_received(self.peer, [(1.0, {'nlri': ['1.1.1.0/24']}), (2.0, {'nlri': []})])
+        # the message file and its index are synced once for the batch
+        self.assertEqual(2, fsync.call_count)
+        records = self.read_records()
+        self.assertEqual([1, 2], [r['seq'] for r in records])
+        self.assertEqual({'nlri': ['1.1.1.0/24']}, records[0]['msg'])
+
+    def test_write_in_writer_thread(self):
+        self.handler.writer = MessageWriter(self.handler.write_records, 100)
+        with mock.patch('os.fsync') as fsync:
+            for i in range(10):
+                self.handler.update_received(self.peer, float(i), {'nlri': []})
+            self.handler.writer.flush()
+        self.assertEqual(0, fsync.call_count)
+        self.assertEqual(list(range(1, 11)), [r['seq'] for r in self.read_records()])
+
+    def test_interval_sync_per_peer(self):
+        CONF.set_override('write_fsync', 'interval', 'message')
+        self.handler.init_msg_file('2.2.2.2')
+        self.handler.last_sync = {'1.1.1.1': 0, '2.2.2.2': 0}
+        with mock.patch('os.fsync') as fsync:
+            self.handler.write_records('1.1.1.1', [{'seq': 1}])
+            self.handler.write_records('2.2.2.2', [{'seq': 1}])
+            # both peers are synced, not only the first one
+            self.assertEqual(4, fsync.call_count)
+            self.handler.write_records('2.2.2.2', [{'seq': 2}])
+            self.assertEqual(4, fsync.call_count)
+            self.assertEqual({'2.2.2.2'}, self.handler.unsynced)
+            self.handler.sync_msg_files()
+            self.assertEqual(4, fsync.call_count)
+            self.handler.last_sync['2.2.2.2'] = 0
+            self.handler.sync_msg_files()
+        self.assertEqual(6, fsync.call_count)
+        self.assertEqual(set(), self.handler.unsynced)
+
+    def test_interval_sync_after_last_write(self):
+        CONF.set_override('write_fsync', 'interval', 'message')
+        CONF.set_override('write_fsync_interval', 10, 'message')
+        self.handler.writer = MessageWriter(
+            self.handler.write_records, 100, self.handler.sync_msg_files, 0.01)
+        synced = threading.Event()
+        with mock.patch('os.fsync', side_effect=lambda fd: synced.set()):
+            self.handler.last_sync['1.1.1.1'] = float('inf')
+            self.handler.update_received(self.peer, 1.0, {'nlri': []})
+            self.handler.writer.flush()
+            self.assertFalse(synced.is_set())
+            # no record comes anymore, the writer syncs the file on its own
+            self.handler.last_sync['1.1.1.1'] = 0
+            self.assertTrue(synced.wait(5))
+
+    def test_rotate(self):
+        CONF.set_override('write_msg_max_size', 1, 'message')
+        with mock.patch('os.fsync') as fsync:
+            self.handler.update_received(self.peer, 1.0, {'nlri': []})
+        # the file and its index are synced when rotated
+        self.assertEqual(2, fsync.call_count)
+        msg_path = self.handler.peer_files['1.1.1.1'][0]
+        self.assertEqual(2, len(os.listdir(os.path.join(msg_path, msgindex.INDEX_DIR))))
+        self.assertEqual(3, len(os.listdir(msg_path)))
+
+    def test_index(self):
+        CONF.set_override('write_index_interval', 4, 'message')
+        for i in range(10):
+            self.handler.update_received(self.peer, float(i), {'nlri': []})
+        msg_path, msg_file = self.handler.peer_files['1.1.1.1']
+        msg_file.flush()
+        entries = msgindex.read_index(msg_file.name)
+        self.assertEqual([1, 4, 8], [seq for seq, offset in entries])
+        with open(msg_file.name) as f:
+            self.assertEqual(4, msgindex.seek(f, msg_file.name, 6))
+            self.assertEqual(4, json.loads(f.readline())['seq'])
+            self.assertEqual(8, msgindex.seek(f, msg_file.name, 8))
+            self.assertEqual(8, json.loads(f.readline())['seq'])
+        self.assertEqual((10, os.path.basename(msg_file.name)), DefaultHandler.get_last_seq_and_file(msg_path))
+
+    def test_compress_rotated_files(self):
+        CONF.set_override('compress', 'gzip', 'message')
+        CONF.set_override('write_msg_max_size', 1, 'message')
+        self.handler.compressor = FileCompressor(self.handler.compress_file)
+        with mock.patch('os.fsync'):
+            for i in range(2):
+                self.handler.update_received(self.peer, float(i), {'nlri': []})
+            self.handler.compressor.flush()
+        msg_path, msg_file = self.handler.peer_files['1.1.1.1']
+        names = sorted(name for name in os.listdir(msg_path) if name != msgindex.INDEX_DIR)
+        self.assertEqual(['.gz', '.gz', '.msg'], [os.path.splitext(name)[1] for name in names])
+        self.assertEqual(msg_file.name, os.path.join(msg_path, names[-1]))
+        self.assertEqual([[1], [2]], [[r['seq'] for r in msgfile.read_records(os.path.join(msg_path, name))]
+                                      for name in names[:2]])
+        self.assertEqual(2, self.handler.compressor.stats()['files'])
+
+    def test_compress_files_rotated_before_start(self):
+        msg_path, msg_file = self.handler.peer_files['1.1.1.1']
+        for name in ('1.0.msg', '2.0.msg.gz.tmp'):
+            with open(os.path.join(msg_path, name), 'w') as f:
+                f.write('{"seq": 1}\n')
+        self.handler.compressor = mock.Mock()
+        self.handler.compress_rotated_files('1.1.1.1')
+        self.handler.compressor.put.assert_called_once_with(os.path.join(msg_path, '1.0.msg'))
+        self.assertFalse(os.path.exists(os.path.join(msg_path, '2.0.msg.gz.tmp')))
+        self.handler.compressor = None
+
+    def test_drop_unwritten_index_entries(self):
+        CONF.set_override('write_index_interval', 2, 'message')
+        for i in range(3):
+            self.handler.update_received(self.peer, float(i), {'nlri': []})
+        msg_path, msg_file = self.handler.peer_files['1.1.1.1']
+        # the records of the last entry did not reach the disk
+        msg_file.truncate(msgindex.read_index(msg_file.name)[1][1])
+        msg_file.close()
+        self.handler.peer_index['1.1.1.1'][0].close()
+        self.assertEqual([(1, 0), (2, mock.ANY)], msgindex.read_index(msg_file.name))
+        self.assertEqual((1, 0), msgindex.last_entry(msg_file.name))
+        msgindex.open_index(msg_file.name).close()
+        self.assertEqual([(1, 0)], msgindex.read_index(msg_file.name))
+        self.handler.peer_files.clear()
+        self.handler.peer_index.clear()
+
+
+class TestMRTFormat(unittest.TestCase):
+
+    def setUp(self):
+        self.write_dir = tempfile.mkdtemp()
+        CONF.set_override('write_dir', self.write_dir, 'message')
+        CONF.set_override('write_msg_max_size', 1024 * 1024, 'message')
+        self.handler = self.new_handler()
+        self.peer = mock.Mock()
+        self.peer.factory.peer_addr = '1.1.1.1'
+        self.peer.factory.peer_asn = 100
+        self.peer.factory.my_asn = 65536
+        self.peer.transport.getHost.return_value.host = '2.2.2.2'
+
+    def tearDown(self):
+        self.close()
+        shutil.rmtree(self.write_dir)
+        CONF.clear_override('write_dir', 'message')
+        CONF.clear_override('write_msg_max_size', 'message')
+
+    def new_handler(self):
+        handler = DefaultHandler()
+        handler.mrt = handler.raw_msg = True
+        handler.peer_info['1.1.1.1'] = (100, 65536, '1.1.1.1', '2.2.2.2')
+        handler.init_msg_file('1.1.1.1')
+        return handler
+
+    def close(self):
+        for msg_path, msg_file in self.handler.peer_files.values():
+            msg_file.close()
+        for index_file, offset in self.handler.peer_index.values():
+            index_file.close()
+
+    def read_records(self):
+        msg_path, msg_file = self.handler.peer_files['1.1.1.1']
+        msg_file.flush()
+        records = []
+        for name in sorted(os.listdir(msg_path)):
+            if name == msgindex.INDEX_DIR:
+                continue
+            with open(os.path.join(msg_path, name), 'rb') as f:
+                records.extend(mrt.read_records(f))
+        return records
+
+    def test_write_messages(self):
+        update = b'\xff' * 16 + b'\x00\x17\x02\x00\x00\x00\x00'
+        self.handler.raw_msg_received(self.peer, 1500000000.123456, update)
+        # keepalive is not written by default
+        self.handler.raw_msg_received(self.peer, 1500000001.0, KeepAlive().construct())
+        self.handler.on_connection_lost(self.peer)
+        records = self.read_records()
+        self.assertEqual(2, len(records))
+        timestamp, mrt_type, subtype, body = records[0]
+        self.assertAlmostEqual(1500000000.123456, timestamp, places=5)
+        self.assertEqual((mrt.MRT_BGP4MP_ET, mrt.BGP4MP_MESSAGE_AS4), (mrt_type, subtype))
+        self.assertEqual((100, 65536, '1.1.1.1', '2.2.2.2', update), mrt.parse_message(subtype, body))
+        self.assertEqual(mrt.BGP4MP_STATE_CHANGE_AS4, records[1][2])
+        self.assertEqual(3, self.handler.msg_sequence['1.1.1.1'])
+
+    def test_resume_sequence(self):
+        update = b'\xff' * 16 + b'\x00\x17\x02\x00\x00\x00\x00'
+        for i in range(3):
+            self.handler.raw_msg_received(self.peer, 1.0, update)
+        msg_path, msg_file = self.handler.peer_files['1.1.1.1']
+        # a record being written when the process stopped
+        msg_file.write(mrt.pack_message(1.0, 100, 65536, '1.1.1.1', '2.2.2.2', update)[:20])
+        self.close()
+        self.assertEqual(3, DefaultHandler.get_last_seq_and_file(msg_path)[0])
+        self.handler = self.new_handler()
+        self.assertEqual(4, self.handler.msg_sequence['1.1.1.1'])
+        self.handler.raw_msg_received(self.peer, 1.0, update)
+        self.assertEqual(4, len(self.read_records()))
+
+    def test_resume_from_index(self):
+        CONF.set_override('write_index_interval', 2, 'message')
+        self.addCleanup(CONF.clear_override, 'write_index_interval', 'message')
+        update = b'\xff' * 16 + b'\x00\x17\x02\x00\x00\x00\x00'
+        for i in range(5):
+            self.handler.raw_msg_received(self.peer, 1.0, update)
+        msg_path, msg_file = self.handler.peer_files['1.1.1.1']
+        self.assertEqual([1, 2, 4], [seq for seq, offset in msgindex.read_index(msg_file.name)])
+        self.close()
+        counted = []
+        mrt_count_records = mrt.count_records
+
+        def count_records(fh):
+            result = mrt_count_records(fh)
+            counted.append(result[0])
+            return result
+
+        with mock.patch('yabgp.common.mrt.count_records', side_effect=count_records):
+            self.assertEqual(5, DefaultHandler.get_last_seq_and_file(msg_path)[0])
+        # only the records from seq 4 are read
+        self.assertEqual([2], counted)
+
+    def test_rotate(self):
+        CONF.set_override('write_msg_max_size', 1, 'message')
+        update = b'\xff' * 16 + b'\x00\x17\x02\x00\x00\x00\x00'
+        with mock.patch('os.fsync'):
+            self.handler.raw_msg_received(self.peer, 1.0, update)
+            self.handler.raw_msg_received(self.peer, 1.0, update)
+        msg_path = self.handler.peer_files['1.1.1.1'][0]
+        names = [name for name in sorted(os.listdir(msg_path)) if name != msgindex.INDEX_DIR]
+        self.assertEqual(['1', '2', '3'], [name.rsplit('.', 2)[1] for name in names])
+        self.assertEqual(2, DefaultHandler.get_last_seq_and_file(msg_path)[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+# Copyright 2015 Cisco Systems, Inc.
+# All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+""" Test message encoder"""
+
+import unittest
+
+from yabgp.message import encoder
+from yabgp.message.update import Update
+
+
+class TestEncoder(unittest.TestCase):
+
+    def test_prefix_v4(self):
+        self.assertEqual(b'\x18\x0a\x01\x01\x20\x0a\x01\x01\x01\x0f\x0a\x02\x00',
+                         Update.construct_prefix_v4(['10.1.1.0/24', '10.1.1.1/32', '10.2.0.0/15', '0.0.0.0/0']))
+        self.assertEqual(b'\x00\x00\x00\x05\x08\x0a',
+                         Update.construct_prefix_v4([{'prefix': '10.0.0.0/8', 'path_id': 5}], True))
+        # host bits of the significant bytes are kept
+        self.assertEqual(b'\x17\x0a\x01\x01', Update.construct_prefix_v4(['10.1.1.0/23']))
+
+    def test_prefix_v6(self):
+        enc = encoder.Encoder()
+        enc.put_prefix_v6('2001:db8::/32')
+        enc.put_prefix_v6('2001:db8:1:2::/63')
+        enc.put_prefix_v6('::/0')
+        self.assertEqual(b'\x20\x20\x01\x0d\xb8\x3f\x20\x01\x0d\xb8\x00\x01\x00\x02\x00', enc.getvalue())
+        self.assertEqual(encoder.prefix_size(63), 1 + 8)
+
+    def test_length_fields(self):
+        enc = encoder.Encoder()
+        position = enc.begin_message(2)
+        length = enc.reserve()
+        enc.put(b'\x01\x02\x03')
+        enc.fill(length)
+        enc.end_message(position)
+        self.assertEqual(b'\xff' * 16 + b'\x00\x18\x02\x00\x03\x01\x02\x03', enc.getvalue())
+
+    def test_update(self):
+        msg = {'attr': {1: 0, 2: [[2, [65001, 65002]]], 3: '1.1.1.1'}, 'nlri': ['10.0.0.0/8', '20.1.0.0/16']}
+        data = Update.construct(msg)
+        self.assertEqual(len(data), encoder.UINT16.unpack(data[16:18])[0])
+        self.assertEqual(msg['nlri'], Update.parse(None, data[19:])['nlri'])
+        data = Update.construct({'withdraw': ['10.0.0.0/8']})
+        self.assertEqual(b'\x00\x02\x08\x0a\x00\x00', data[19:])
+
+
+if __name__ == '__main__':
+    unittest.main()
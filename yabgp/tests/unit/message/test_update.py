@@ -15,11 +15,15 @@
 
 """ Test Update message"""
 
+import struct
 import unittest
 
+from yabgp.common import constants as bgp_cons
+from yabgp.common.cache import LRUCache
 from yabgp.common.constants import HDR_LEN
 from yabgp.common.exception import UpdateMessageError
 from yabgp.message.update import Update
+from yabgp.message.update import UpdateView
 
 
 class TestUpdate(unittest.TestCase):
@@ -138,6 +142,70 @@ class TestUpdate(unittest.TestCase):
                 msg_dict=value_parse,
                 asn4=True)[HDR_LEN:], True)['attr'], True)
 
+    def test_parse_attributes_cached(self):
+        cache = LRUCache(10)
+        msg_dict = {
+            'attr': {
+                1: 0,
+                2: [(2, [65502])],
+                4: 0,
+                14: {
+                    'afi_safi': (2, 1),
+                    'linklocal_nexthop': 'fe80::c002:bff:fe7e:0',
+                    'nexthop': '2001:db8::2',
+                    'nlri': ['2001:db8:2:2::/64']}
+            }}
+        first = Update.parse(None, Update.construct(msg_dict, asn4=True)[HDR_LEN:], True, attr_cache=cache)
+        msg_dict['attr'][14]['nlri'] = ['2001:db8:2:1::/64']
+        second = Update.parse(None, Update.construct(msg_dict, asn4=True)[HDR_LEN:], True, attr_cache=cache)
+        self.assertEqual(['2001:db8:2:2::/64'], first['attr'][14]['nlri'])
+        self.assertEqual(msg_dict['attr'], second['attr'])
+        # MP_REACH_NLRI keeps its place in the message
+        med = b'\x80\x04\x04\x00\x00\x00\x00'
+        msg_hex = Update.construct(msg_dict, asn4=True)[HDR_LEN:]
+        msg_hex = msg_hex.replace(med, b'') + med
+        self.assertEqual([1, 2, 14, 4], list(Update.parse(None, msg_hex, True, attr_cache=cache)['attr']))
+        self.assertEqual(list(Update.parse(None, msg_hex, True)['attr']),
+                         list(Update.parse(None, msg_hex, True, attr_cache=cache)['attr']))
+        self.assertEqual(3, cache.hits)
+        self.assertEqual(1, len(cache))
+
+        msg_hex = b'\x00\x00\x00\x28\x40\x01\x01\x02\x40\x02\x0a\x02\x01\x00\x1e\x01\x02\x00\x0a\x00\x14\x40\x03' \
+                  b'\x04\x0a\x00\x00\x09\x80\x04\x04\x00\x00\x00\x00\xc0\x07\x06\x00\x1e\x0a\x00\x00\x09\x15\xac' \
+                  b'\x10\x00'
+        first = Update.parse(None, msg_hex, attr_cache=cache)
+        second = Update.parse(None, msg_hex, attr_cache=cache)
+        self.assertIsNot(first['attr'], second['attr'])
+        self.assertEqual(Update.parse(None, msg_hex)['attr'], second['attr'])
+        # changing one message does not change the cached attributes
+        first['attr'][1] = 0
+        self.assertEqual(2, Update.parse(None, msg_hex, attr_cache=cache)['attr'][1])
+        # the asn4 context is part of the key
+        self.assertNotEqual(first['attr'], Update.parse(None, msg_hex, True, attr_cache=cache)['attr'])
+
+    def test_construct_attributes_cached(self):
+        cache = LRUCache(10)
+        attr = {
+            1: 0,
+            14: {'afi_safi': (2, 1), 'nexthop': '2001:db8::2', 'nlri': ['2001:db8:2:2::/64']},
+            2: [[2, [65502, 65001]]],
+            16: [[2, '100:100']]
+        }
+        self.assertEqual(Update.construct_attributes(attr, True),
+                         Update.construct_attributes_cached(attr, cache, True))
+        attr[14] = dict(attr[14], nlri=['2001:db8:2:1::/64'])
+        # MP_REACH_NLRI is encoded at its place
+        self.assertEqual(Update.construct_attributes(attr, True),
+                         Update.construct_attributes_cached(attr, cache, True))
+        self.assertEqual(1, cache.hits)
+        # equal values from JSON share the entry
+        msg = {'attr': {1: 0, 2: [(2, (65502, 65001))], 16: [(2, '100:100')]}, 'nlri': ['10.0.0.0/8']}
+        self.assertEqual(Update.construct(msg, True), Update.construct(msg, True, attr_cache=cache))
+        self.assertEqual(2, cache.hits)
+        # the asn4 context is part of the key
+        self.assertEqual(Update.construct(msg), Update.construct(msg, attr_cache=cache))
+        self.assertEqual(2, len(cache))
+
     def test_parse_ipv6_unicast(self):
         data_bin = b'\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff\xff' \
                    b'\x00\x55\x02\x00\x00\x00\x3e\x80\x0e\x26\x00\x02\x01\x10\x00\x00' \
@@ -337,5 +405,127 @@ class TestUpdate(unittest.TestCase):
         )
 
 
+class TestConstructSplit(unittest.TestCase):
+
+    def setUp(self):
+        self.nlri = ['10.%s.%s.0/24' % (i // 256, i % 256) for i in range(2000)]
+        self.v6_nlri = ['2001:db8:%x::/48' % i for i in range(1, 1001)]
+
+    def parse(self, messages):
+        results = []
+        for msg in messages:
+            self.assertLessEqual(len(msg), 4096)
+            results.append(Update.parse(None, msg[HDR_LEN:], True))
+        return results
+
+    def test_ipv4(self):
+        attr = {1: 0, 2: [], 3: '1.1.1.1'}
+        messages = Update.construct_split({'attr': attr, 'nlri': self.nlri, 'withdraw': self.nlri[:1500]}, True)
+        # 4 bytes each prefix, withdrawn routes are in their own messages
+        self.assertEqual(4, len(messages))
+        self.assertEqual(4095, len(messages[0]))
+        results = self.parse(messages)
+        self.assertEqual(self.nlri[:1500], sum([r['withdraw'] for r in results], []))
+        self.assertEqual(self.nlri, sum([r['nlri'] for r in results], []))
+        self.assertEqual(attr, results[-1]['attr'])
+
+    def test_small_message(self):
+        msg = {'attr': {1: 0, 2: [], 3: '1.1.1.1'}, 'nlri': ['10.0.0.0/24']}
+        self.assertEqual([Update.construct(msg, True)], Update.construct_split(msg, True))
+
+    def test_mp_reach_and_unreach(self):
+        attr = {
+            1: 0, 2: [],
+            14: {'afi_safi': (2, 1), 'nexthop': '2001:db8::1', 'nlri': self.v6_nlri},
+            15: {'afi_safi': (2, 1), 'withdraw': self.v6_nlri[:10]}
+        }
+        messages = Update.construct_split({'attr': attr}, True)
+        self.assertEqual(3, len(messages))
+        results = self.parse(messages)
+        self.assertEqual(self.v6_nlri[:10], results[0]['attr'][15]['withdraw'])
+        self.assertNotIn(14, results[0]['attr'])
+        self.assertEqual(self.v6_nlri, sum([r['attr'][14]['nlri'] for r in results[1:]], []))
+        self.assertNotIn(15, results[1]['attr'])
+
+    def test_attr_cache(self):
+        cache = LRUCache(10)
+        attr = {1: 0, 2: [], 3: '1.1.1.1'}
+        msg = {'attr': attr, 'nlri': self.nlri}
+        self.assertEqual(Update.construct_split(msg, True), Update.construct_split(msg, True, attr_cache=cache))
+        self.assertEqual(Update.construct_split(msg, True), Update.construct_split(msg, True, attr_cache=cache))
+        self.assertEqual(1, cache.hits)
+
+    def test_mpls_vpn(self):
+        nlri = [{'prefix': prefix, 'rd': '100:1', 'label': [100]} for prefix in self.nlri[:1000]]
+        attr = {1: 0, 2: [], 14: {'afi_safi': (1, 128), 'nexthop': {'rd': '0:0', 'str': '1.1.1.1'}, 'nlri': nlri}}
+        results = self.parse(Update.construct_split({'attr': attr}, True))
+        self.assertEqual(nlri, sum([r['attr'][14]['nlri'] for r in results], []))
+
+
+class TestUpdateView(unittest.TestCase):
+
+    def test_attributes_decoded_on_access(self):
+        msg_hex = b'\x00\x00\x00\x30\x40\x01\x01\x00\x40\x02\x06\x02\x01\x00\x00\xfb\xff\x40\x03\x04\x0a\x00\x0e' \
+                  b'\x01\x80\x04\x04\x00\x00\x00\x00\x40\x05\x04\x00\x00\x00\x64\x80\x0a\x04\x0a\x00\x22' \
+                  b'\x04\x80\x09\x04\x0a\x00\x0f\x01\x00\x00\x00\x01\x20\x05\x05\x05\x05\x00\x00\x00\x01' \
+                  b'\x20\xc0\xa8\x01\x05'
+        view = UpdateView(None, msg_hex, True, {'ipv4': True})
+        self.assertEqual([
+            {'path_id': 1, 'prefix': '5.5.5.5/32'},
+            {'path_id': 1, 'prefix': '192.168.1.5/32'}], view.nlri)
+        self.assertEqual([1, 2, 3, 4, 5, 10, 9], list(view.attr))
+        # the well-known attributes are decoded when they are checked,
+        # CLUSTER_LIST is only checked for its length
+        self.assertEqual([1, 2, 3, 4, 5, 9], sorted(view.attr._values))
+        self.assertEqual('10.0.14.1', view.attr[3])
+        self.assertEqual(['10.0.34.4'], view.attr[10])
+        self.assertNotIn(14, view.attr)
+        self.assertIsNone(view.attr.get(14))
+        self.assertEqual(Update.parse(None, msg_hex, True, {'ipv4': True}), view.to_dict())
+
+    def test_to_dict(self):
+        for msg_hex, asn4 in [
+            (b'\x00\x00\x00\x28\x40\x01\x01\x02\x40\x02\x0a\x02\x01\x00\x1e\x01\x02\x00\x0a\x00\x14\x40\x03'
+             b'\x04\x0a\x00\x00\x09\x80\x04\x04\x00\x00\x00\x00\xc0\x07\x06\x00\x1e\x0a\x00\x00\x09\x15\xac'
+             b'\x10\x00', False),
+            (b'\x00\x08\x18\x0a\x01\x01\x18\x0a\x01\x02\x00\x00', False),
+            (b'\x00\x00\x00\x0b\x40\x01\x01\x00\x40\x02\x04\x02\x01\xff\xff', True)
+        ]:
+            self.assertEqual(Update.parse(None, msg_hex, asn4), UpdateView(None, msg_hex, asn4).to_dict())
+
+    def test_malformed_attribute(self):
+        msg_hex = b'\x00\x00\x00\x0b\x40\x01\x01\x00\x40\x02\x04\x02\x01\xff\xff'
+        view = UpdateView(None, msg_hex, True)
+        self.assertEqual(bgp_cons.ERR_MSG_UPDATE_ATTR_LEN, view.sub_error)
+        self.assertEqual(0, view.attr[1])
+        self.assertRaises(UpdateMessageError, view.attr.__getitem__, 2)
+        result = view.to_dict()
+        self.assertIsNotNone(result['sub_error'])
+        self.assertEqual({1: 0}, result['attr'])
+
+    def test_same_error_as_parse(self):
+        origin = b'\x40\x01\x01\x00'
+        for attr_hex in [
+            # truncated AS_PATH segment
+            origin + b'\x40\x02\x04\x02\x01\xff\xff',
+            # AS_PATH longer than the attributes
+            origin + b'\x40\x02\x06\x02\x01\x00\x00',
+            origin + b'\x40\x03\x03\x0a\x00\x00',
+            b'\x40\x01\x01\x05',
+            origin + b'\xc0\x08\x03\x00\x01\x02',
+            origin + b'\xc0\x10\x04\x00\x02\x00\x01',
+            origin + b'\xc0\x20\x08\x00\x00\x00\x01\x00\x00\x00\x02',
+            origin + b'\x80\x0a\x03\x0a\x00\x00',
+            origin + b'\x80\x09\x05\x0a\x00\x00\x01\x01',
+            origin + b'\x80\x04\x04\x00\x00\x00\x00\x80\x04',
+        ]:
+            msg_hex = b'\x00\x00' + struct.pack('!H', len(attr_hex)) + attr_hex
+            result = Update.parse(None, msg_hex, True)
+            view = UpdateView(None, msg_hex, True)
+            self.assertIsNotNone(result['sub_error'])
+            self.assertEqual((result['sub_error'], result['err_data']), (view.sub_error, view.err_data))
+            self.assertEqual(result, view.to_dict())
+
+
 if __name__ == '__main__':
     unittest.main()